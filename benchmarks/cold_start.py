@@ -0,0 +1,201 @@
+""" Cold-start profile for every Lambda under lambda-functions/.
+
+For each function, in a fresh interpreter laid out like the deployed zip (function dir + shared/):
+  * `python -X importtime` breakdown of importing the handler module, slowest modules first
+  * cold invocation (first call, lazy clients/modules built) vs warm invocations
+  * what startup.py built lazily during the cold call and how long each took
+
+By default nothing leaves the machine: S3, GitLab and the HTTP sessions are the fakes from
+benchmarks/fakes.py, installed with startup.override(), and Telegram notifications go to a
+MemorySink. The real boto3 client and gitlab module are still built on first use, so the cold call
+pays what it would in Lambda. Only --live calls the real services with the real environment's
+credentials, which creates GitLab users and projects, sends messages and runs the backup and its
+retention. Pass --event to use another payload than the function's test_event.json.
+
+    python3 benchmarks/cold_start.py [function ...] [--warm 5] [--top 15] [--json] [--live]
+"""
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "lambda-functions")
+SHARED_DIR = os.path.join(LAMBDA_DIR, "shared")
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+# Placeholders so modules that read these at call time don't fail before we measure anything
+PLACEHOLDER_ENV = {
+    "TELEGRAM_BOT_TOKEN": "0:benchmark",
+    "TELEGRAM_CHAT_ID": "0",
+    "ADMIN_CHAT_ID": "0",
+    "GITLAB_TOKEN": "benchmark",
+    "AWS_DEFAULT_REGION": "eu-central-1",
+}
+# Dropped from offline runs, so a call that somehow misses the fakes fails instead of acting
+CREDENTIAL_ENV = ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN", "AWS_PROFILE")
+SAMPLE_CSV = "name,amount,day\nAlice,1.5,2024-01-02\nBob,2,2024-01-03\n"
+
+def functions():
+    return sorted(
+        name for name in os.listdir(LAMBDA_DIR)
+        if name != "shared" and os.path.isfile(os.path.join(LAMBDA_DIR, name, f"{name}.py"))
+    )
+
+def child_env(function_name, live=False):
+    if live:
+        env = dict(PLACEHOLDER_ENV, **os.environ)
+    else:
+        env = {name: value for name, value in os.environ.items() if name not in CREDENTIAL_ENV}
+        env.update(PLACEHOLDER_ENV)
+    env["PYTHONPATH"] = os.pathsep.join([os.path.join(LAMBDA_DIR, function_name), SHARED_DIR])
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+def parse_importtime(stderr):
+    """ Rows of `-X importtime` output as dicts, in microseconds """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append({"module": name.strip(), "self_us": int(self_us), "cumulative_us": int(cumulative_us)})
+    return rows
+
+def profile_imports(function_name):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {function_name}"],
+        env=child_env(function_name), capture_output=True, text=True
+    )
+    rows = parse_importtime(result.stderr)
+    total = next((r["cumulative_us"] for r in reversed(rows) if r["module"] == function_name), None)
+    error = result.stderr.strip().splitlines()[-1] if result.returncode else None
+    return {"total_us": total, "modules": rows, "error": error}
+
+def profile_invocations(function_name, event_file, warm, live):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", function_name, "--event", event_file or "", "--warm", str(warm)]
+        + (["--live"] if live else []),
+        env=child_env(function_name, live), capture_output=True, text=True
+    )
+    try:
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        return {"error": (result.stderr.strip().splitlines() or ["no output"])[-1]}
+
+def offline(name, fake, build_real=None):
+    """ Serve `fake` as startup's `name`, after building the real object on first use when it can be built locally """
+    import startup
+
+    def build():
+        if build_real is not None:
+            try:
+                build_real()
+            except ImportError:
+                pass
+        return fake
+    # Built and timed under its own name; get() would return the override itself for `name`
+    startup.override(name, startup.lazy(f"offline:{name}", build))
+
+def install_fakes(handler_module, event):
+    """ Point the handler's S3, GitLab and HTTP clients at the fakes; objects the event names get a sample CSV """
+    sys.path.insert(0, BENCHMARKS_DIR)
+    import fakes
+    import requests
+    s3 = fakes.FakeS3()
+    for record in event.get("Records", []):
+        if "s3" in record:
+            s3.seed(record["s3"]["bucket"]["name"], record["s3"]["object"]["key"], SAMPLE_CSV)
+    gl = fakes.FakeGitlab()
+    offline("client:s3", s3, lambda: importlib.import_module("boto3").client("s3"))
+    offline("module:gitlab", fakes.gitlab_module(), lambda: importlib.import_module("gitlab"))
+    offline("gitlab:client", gl)
+    offline("gitlab:group", gl.groups.get(2, lazy=True))
+    for attribute, value in list(vars(handler_module).items()):
+        if isinstance(value, requests.Session):
+            setattr(handler_module, attribute, fakes.FakeHTTP())
+
+def run_child(function_name, event_file, warm, live):
+    """ Runs inside the fresh interpreter: import, one cold call, then warm calls """
+    started = time.perf_counter()
+    import notifier
+    notifier.set_sink(notifier.MemorySink())
+    import startup
+    handler_module = __import__(function_name)
+    import_ms = (time.perf_counter() - started) * 1000
+
+    event_file = event_file or os.path.join(LAMBDA_DIR, function_name, "test_event.json")
+    with open(event_file) as f:
+        event = json.load(f)
+    if not live:
+        install_fakes(handler_module, event)
+
+    def invoke():
+        started = time.perf_counter()
+        try:
+            response = handler_module.lambda_handler(event, None)
+            status = response.get("statusCode") if isinstance(response, dict) else None
+        except Exception as e:
+            status = f"raised {type(e).__name__}"
+        return (time.perf_counter() - started) * 1000, status
+
+    cold_ms, cold_status = invoke()
+    lazy_ms = {name: seconds * 1000 for name, seconds in startup.timings().items()}
+    warm_runs = [invoke() for _ in range(warm)]
+    warm_ms = sorted(ms for ms, _ in warm_runs)
+    print(json.dumps({
+        "import_ms": round(import_ms, 2),
+        "cold_ms": round(cold_ms, 2),
+        "cold_status": cold_status,
+        "warm_median_ms": round(warm_ms[len(warm_ms) // 2], 2) if warm_ms else None,
+        "warm_status": warm_runs[-1][1] if warm_runs else None,
+        "lazy_init_ms": {name: round(ms, 2) for name, ms in lazy_ms.items()},
+    }))
+
+def report(name, imports, invocations, top):
+    print(f"== {name}")
+    if imports["error"]:
+        print(f"  import failed: {imports['error']}")
+    else:
+        print(f"  import {name}: {imports['total_us'] / 1000:.1f} ms")
+        print(f"  {'self ms':>9} {'cum ms':>9}  module")
+        for row in sorted(imports["modules"], key=lambda r: r["cumulative_us"], reverse=True)[:top]:
+            print(f"  {row['self_us'] / 1000:>9.1f} {row['cumulative_us'] / 1000:>9.1f}  {row['module']}")
+    if "error" in invocations:
+        print(f"  invoke failed: {invocations['error']}")
+        return
+    print(f"  cold invoke: {invocations['cold_ms']:.1f} ms (status {invocations['cold_status']}), "
+          f"warm median: {invocations['warm_median_ms']} ms (status {invocations['warm_status']})")
+    for lazy_name, ms in invocations["lazy_init_ms"].items():
+        print(f"    lazy {lazy_name}: {ms:.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time and cold/warm latency profile of the Lambda handlers")
+    parser.add_argument("functions", nargs="*", help="function names (default: all)")
+    parser.add_argument("--warm", type=int, default=5, help="warm invocations after the cold one")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list per function")
+    parser.add_argument("--event", help="event JSON file instead of the function's test_event.json")
+    parser.add_argument("--json", action="store_true", help="print the raw results as JSON")
+    parser.add_argument("--live", action="store_true",
+                        help="call the real AWS, GitLab, Telegram and Wikipedia APIs with this environment's credentials")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.event, args.warm, args.live)
+        return
+
+    results = {}
+    for name in args.functions or functions():
+        imports = profile_imports(name)
+        invocations = profile_invocations(name, args.event, args.warm, args.live)
+        results[name] = {"imports": imports, "invocations": invocations}
+        if not args.json:
+            report(name, imports, invocations, args.top)
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+""" In-process stand-ins for S3, Lambda, the Telegram and Wikipedia APIs and GitLab, for the offline benchmarks and tests.
+
+Each fake implements only what the Lambdas under lambda-functions/ and the website call, keeps state in
+memory and can add a fixed per-call latency to imitate the network, so concurrency changes show up in numbers.
+"""
+import hashlib
+import io
+import itertools
+import json
+import os
+import threading
+import time
+import types
+import uuid
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+
+def pause(latency_ms):
+    if latency_ms:
+        time.sleep(latency_ms / 1000)
+
+def client_error(code, operation, message=''):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+class NoSuchKey(ClientError):
+    def __init__(self, operation='GetObject'):
+        super().__init__({'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'}}, operation)
+
+class FakePaginator:
+    def __init__(self, list_page):
+        self.list_page = list_page
+
+    def paginate(self, **params):
+        token = None
+        while True:
+            page, token = self.list_page(token=token, **params)
+            yield page
+            if token is None:
+                return
+
+class FakeS3:
+    """ Thread-safe in-memory S3 with the subset of the client API the Lambdas use """
+
+    PAGE_SIZE = 1000
+
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+        self.objects = {}  # (bucket, key) -> object dict
+        self.uploads = {}  # upload_id -> {"bucket", "key", "parts": {number: bytes}, "metadata"}
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.exceptions = types.SimpleNamespace(ClientError=ClientError, NoSuchKey=NoSuchKey)
+
+    def _call(self, name):
+        pause(self.latency_ms)
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    @staticmethod
+    def _object(body, metadata=None, content_type=None):
+        body = body.encode('utf-8') if isinstance(body, str) else bytes(body)
+        return {
+            "Body": body,
+            "ETag": f'"{hashlib.md5(body).hexdigest()}"',
+            "Metadata": dict(metadata or {}),
+            "ContentType": content_type or 'binary/octet-stream',
+            "LastModified": datetime.now(timezone.utc),
+        }
+
+    def _get(self, bucket, key, operation):
+        with self.lock:
+            obj = self.objects.get((bucket, key))
+        if obj is None:
+            raise NoSuchKey(operation) if operation == 'GetObject' else client_error('404', operation, 'Not Found')
+        return obj
+
+    def seed(self, bucket, key, body, metadata=None):
+        """ Put an object without latency or call counting, for scenario setup """
+        self.objects[(bucket, key)] = self._object(body, metadata)
+
+    def clear(self):
+        with self.lock:
+            self.objects.clear()
+            self.uploads.clear()
+            self.calls.clear()
+
+    def put_object(self, Bucket, Key, Body=b'', Metadata=None, ContentType=None, IfNoneMatch=None, IfMatch=None, **_):
+        self._call('put_object')
+        obj = self._object(Body, Metadata, ContentType)
+        with self.lock:
+            current = self.objects.get((Bucket, Key))
+            if (IfNoneMatch == '*' and current) or (IfMatch and (current is None or current["ETag"] != IfMatch)):
+                raise client_error('PreconditionFailed', 'PutObject', 'At least one of the pre-conditions you specified did not hold')
+            self.objects[(Bucket, Key)] = obj
+        return {"ETag": obj["ETag"]}
+
+    def get_object(self, Bucket, Key, **_):
+        self._call('get_object')
+        obj = self._get(Bucket, Key, 'GetObject')
+        return {
+            "Body": io.BytesIO(obj["Body"]),
+            "ETag": obj["ETag"],
+            "Metadata": dict(obj["Metadata"]),
+            "ContentLength": len(obj["Body"]),
+            "LastModified": obj["LastModified"],
+        }
+
+    def head_object(self, Bucket, Key, **_):
+        self._call('head_object')
+        obj = self._get(Bucket, Key, 'HeadObject')
+        return {
+            "ETag": obj["ETag"],
+            "Metadata": dict(obj["Metadata"]),
+            "ContentType": obj["ContentType"],
+            "ContentLength": len(obj["Body"]),
+        }
+
+    def copy_object(self, Bucket, CopySource, Key, **_):
+        self._call('copy_object')
+        source = self._get(CopySource['Bucket'], CopySource['Key'], 'CopyObject')
+        with self.lock:
+            self.objects[(Bucket, Key)] = self._object(source["Body"], source["Metadata"], source["ContentType"])
+        return {"CopyObjectResult": {"ETag": source["ETag"]}}
+
+    def delete_object(self, Bucket, Key, **_):
+        self._call('delete_object')
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **_):
+        self._call('delete_objects')
+        with self.lock:
+            for item in Delete['Objects']:
+                self.objects.pop((Bucket, item['Key']), None)
+        return {} if Delete.get('Quiet') else {"Deleted": [{"Key": item['Key']} for item in Delete['Objects']]}
+
+    def create_multipart_upload(self, Bucket, Key, Metadata=None, ContentType=None, **_):
+        self._call('create_multipart_upload')
+        upload_id = uuid.uuid4().hex
+        with self.lock:
+            self.uploads[upload_id] = {"bucket": Bucket, "key": Key, "parts": {}, "metadata": Metadata, "content_type": ContentType}
+        return {"UploadId": upload_id}
+
+    def _upload(self, upload_id, operation):
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+        if upload is None:
+            raise client_error('NoSuchUpload', operation, 'The specified upload does not exist.')
+        return upload
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **_):
+        self._call('upload_part')
+        data = bytes(Body)
+        self._upload(UploadId, 'UploadPart')["parts"][PartNumber] = data
+        return {"ETag": f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def upload_part_copy(self, Bucket, Key, UploadId, PartNumber, CopySource, CopySourceRange=None, CopySourceIfMatch=None, **_):
+        self._call('upload_part_copy')
+        source = self._get(CopySource['Bucket'], CopySource['Key'], 'UploadPartCopy')
+        if CopySourceIfMatch and CopySourceIfMatch != source["ETag"]:
+            raise client_error('PreconditionFailed', 'UploadPartCopy', 'At least one of the pre-conditions you specified did not hold')
+        data = source["Body"]
+        if CopySourceRange:
+            start, end = (int(n) for n in CopySourceRange[len('bytes='):].split('-'))
+            data = data[start:end + 1]
+        self._upload(UploadId, 'UploadPartCopy')["parts"][PartNumber] = data
+        return {"CopyPartResult": {"ETag": f'"{hashlib.md5(data).hexdigest()}"'}}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **_):
+        self._call('complete_multipart_upload')
+        upload = self._upload(UploadId, 'CompleteMultipartUpload')
+        body = b''.join(upload["parts"][part['PartNumber']] for part in MultipartUpload['Parts'])
+        with self.lock:
+            self.objects[(Bucket, Key)] = self._object(body, upload["metadata"], upload["content_type"])
+            del self.uploads[UploadId]
+        return {"Key": Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **_):
+        self._call('abort_multipart_upload')
+        with self.lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+    def get_paginator(self, operation):
+        if operation == 'list_objects_v2':
+            return FakePaginator(self._list_objects_page)
+        if operation == 'list_parts':
+            return FakePaginator(self._list_parts_page)
+        raise NotImplementedError(operation)
+
+    def _list_objects_page(self, token, Bucket, Prefix='', Delimiter=None, **_):
+        self._call('list_objects_v2')
+        with self.lock:
+            keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        contents, prefixes = [], []
+        for key in keys:
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                prefix = Prefix + rest.split(Delimiter, 1)[0] + Delimiter
+                if prefix not in prefixes:
+                    prefixes.append(prefix)
+            else:
+                contents.append(key)
+        entries = [("object", key) for key in contents] + [("prefix", prefix) for prefix in prefixes]
+        start = int(token or 0)
+        batch = entries[start:start + self.PAGE_SIZE]
+        page = {"Contents": [], "CommonPrefixes": []}
+        for kind, value in batch:
+            if kind == "prefix":
+                page["CommonPrefixes"].append({"Prefix": value})
+                continue
+            obj = self.objects[(Bucket, value)]
+            page["Contents"].append({
+                "Key": value,
+                "Size": len(obj["Body"]),
+                "ETag": obj["ETag"],
+                "LastModified": obj["LastModified"],
+            })
+        next_token = str(start + self.PAGE_SIZE) if start + self.PAGE_SIZE < len(entries) else None
+        return page, next_token
+
+    def _list_parts_page(self, token, Bucket, Key, UploadId, **_):
+        self._call('list_parts')
+        parts = self._upload(UploadId, 'ListParts')["parts"]
+        return {"Parts": [
+            {"PartNumber": n, "ETag": f'"{hashlib.md5(d).hexdigest()}"', "Size": len(d)} for n, d in sorted(parts.items())
+        ]}, None
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None, headers=None):
+        self.status_code = status_code
+        self._payload = payload
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(json.dumps(self._payload))
+
+class FakeHTTP:
+    """ requests.Session stand-in answering the Telegram sendMessage and Wikipedia summary endpoints """
+
+    def __init__(self, latency_ms=0, summary_words=120):
+        self.latency_ms = latency_ms
+        self.summary_words = summary_words
+        self.sent = 0
+        self.lock = threading.Lock()
+
+    def post(self, url, json=None, timeout=None, **_):
+        pause(self.latency_ms)
+        if '/sendMessage' not in url:
+            return FakeResponse(404, {"ok": False, "description": "Not Found"})
+        with self.lock:
+            self.sent += 1
+            message_id = self.sent
+        return FakeResponse(200, {"ok": True, "result": {"message_id": message_id, "chat": {"id": json["chat_id"]}}})
+
+    def get(self, url, headers=None, timeout=None, **_):
+        pause(self.latency_ms)
+        topic = url.rsplit('/', 1)[-1]
+        etag = f'"{hashlib.md5(topic.encode("utf-8")).hexdigest()}"'
+        if (headers or {}).get('If-None-Match') == etag:
+            return FakeResponse(304, headers={"ETag": etag})
+        extract = " ".join(itertools.islice(itertools.cycle(topic.replace('_', ' ').split()), self.summary_words))
+        return FakeResponse(200, {"title": topic, "extract": extract}, {"ETag": etag})
+
+    def mount(self, *_):
+        pass
+
+class FakeLambda:
+    """ Lambda client stand-in for the website: invoke() takes `latency_ms`, like a function's run time, and answers like get_info """
+
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+        self.invocations = 0
+        self.lock = threading.Lock()
+
+    def invoke(self, FunctionName, Payload, **_):
+        pause(self.latency_ms)
+        event = json.loads(Payload)
+        topics = event.get('topics') or [event.get('topic')]
+        with self.lock:
+            self.invocations += 1
+        body = {
+            "statusCode": 200,
+            "body": f"{FunctionName} handled {len(topics)} topics",
+            "results": [{"topic": topic, "status": "appended"} for topic in topics]
+        }
+        return {"StatusCode": 200, "Payload": io.BytesIO(json.dumps(body).encode('utf-8'))}
+
+# --- GitLab ---
+
+class GitlabError(Exception):
+    def __init__(self, error_message='', response_code=None):
+        super().__init__(error_message)
+        self.error_message = error_message
+        self.response_code = response_code
+
+class GitlabCreateError(GitlabError):
+    pass
+
+class GitlabHttpError(GitlabError):
+    pass
+
+def gitlab_module():
+    """ Module-shaped stand-in for python-gitlab; serve it with startup.override('module:gitlab', ...) """
+    return types.SimpleNamespace(
+        Gitlab=FakeGitlab,
+        REPORTER=20,
+        const=types.SimpleNamespace(AccessLevel=types.SimpleNamespace(REPORTER=20)),
+        exceptions=types.SimpleNamespace(
+            GitlabError=GitlabError,
+            GitlabCreateError=GitlabCreateError,
+            GitlabHttpError=GitlabHttpError,
+        ),
+    )
+
+class FakeGitlab:
+    """ Users, groups, projects, files and commits kept in memory; every call costs latency_ms """
+
+    def __init__(self, url='https://gitlab.example', private_token=None, latency_ms=0):
+        self.url = url
+        self.latency_ms = latency_ms
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.calls = 0
+        self.users = FakeUsers(self)
+        self.projects = FakeProjects(self)
+        self.groups = FakeGroups(self)
+
+    def call(self):
+        pause(self.latency_ms)
+        with self.lock:
+            self.calls += 1
+
+    def next_id(self):
+        with self.lock:
+            return next(self.ids)
+
+class FakeUsers:
+    def __init__(self, gl):
+        self.gl = gl
+        self.by_username = {}
+
+    def create(self, data):
+        self.gl.call()
+        with self.gl.lock:
+            if data['username'] in self.by_username:
+                raise GitlabCreateError('Username has already been taken', 409)
+        user = types.SimpleNamespace(id=self.gl.next_id(), **{k: v for k, v in data.items() if k != 'password'})
+        with self.gl.lock:
+            self.by_username[data['username']] = user
+        return user
+
+    def list(self, username=None, **_):
+        self.gl.call()
+        user = self.by_username.get(username)
+        return [user] if user else []
+
+class FakeGroups:
+    def __init__(self, gl):
+        self.gl = gl
+
+    def get(self, group_id, lazy=False):
+        if not lazy:
+            self.gl.call()
+        return types.SimpleNamespace(id=group_id, name=f"group-{group_id}", members=FakeMembers(self.gl))
+
+class FakeMembers:
+    def __init__(self, gl):
+        self.gl = gl
+
+    def create(self, data):
+        self.gl.call()
+        return types.SimpleNamespace(**data)
+
+class FakeProjects:
+    def __init__(self, gl):
+        self.gl = gl
+        self.by_id = {}
+
+    def create(self, data):
+        self.gl.call()
+        project_id = self.gl.next_id()
+        project = FakeProject(self.gl, project_id, data['name'], data.get('namespace_id'))
+        with self.gl.lock:
+            if any(p.name == project.name and p.namespace == project.namespace for p in self.by_id.values()):
+                raise GitlabCreateError({'name': ['has already been taken']}, 400)
+            self.by_id[project_id] = project
+        return project
+
+    def list(self, search=None, **_):
+        self.gl.call()
+        with self.gl.lock:
+            return [p for p in self.by_id.values() if search is None or search in p.name]
+
+    def get(self, project_id, lazy=False):
+        if not lazy:
+            self.gl.call()
+        return self.by_id.get(project_id) or FakeProject(self.gl, project_id, str(project_id))
+
+class FakeProject:
+    def __init__(self, gl, project_id, name, namespace_id=None):
+        self.id = project_id
+        self.name = name
+        self.namespace = {"id": namespace_id}
+        self.web_url = f"{gl.url}/{name}"
+        self.http_url_to_repo = f"{self.web_url}.git"
+        self.files = types.SimpleNamespace(create=lambda data: gl.call())
+        self.commits = types.SimpleNamespace(create=lambda data: gl.call())
+
+class Env:
+    """ One set of fakes, wired into the Lambdas' shared clients, for the benchmarks and tests """
+
+    def __init__(self, latency_ms=0):
+        # Lambda modules: only importable once lambda-functions/shared is on sys.path
+        import notifier
+        import startup
+        self.s3 = FakeS3(latency_ms)
+        self.http = FakeHTTP(latency_ms)
+        self.gl = FakeGitlab(latency_ms=latency_ms)
+        self.counter = itertools.count()
+        startup.reset()
+        startup.override('client:s3', self.s3)
+        startup.override('module:gitlab', gitlab_module())
+        startup.override('gitlab:client', self.gl)
+        startup.override('gitlab:group', self.gl.groups.get(2, lazy=True))
+        notifier.set_sink(notifier.MemorySink())
+
+    def unique(self, prefix):
+        """ Fresh names per iteration, so idempotency and caches don't turn runs into replays """
+        return f"{prefix}-{os.getpid()}-{next(self.counter)}"
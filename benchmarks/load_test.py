@@ -0,0 +1,224 @@
+""" Load test of the website: the threaded Flask server against the async Quart/Hypercorn app.
+
+Each mode is served by a child process with the Lambda and S3 clients swapped for in-memory fakes
+(benchmarks/fakes.py) that take --latency-ms per call, so only the serving model differs. With
+--invoker local the real handlers run instead, in the website's local Lambda pool (website/invoker.py),
+with their own S3, HTTP, GitLab and Telegram clients faked: the whole stack, without a network. Then
+--clients concurrent keep-alive clients post to the route for --duration seconds and we report
+throughput, latency percentiles, errors, and the server's peak thread count and memory.
+Every request uses a new topic, so the Lambda response cache never answers for the backend.
+
+    python3 benchmarks/load_test.py [--modes threaded async] [--clients 100 200] [--duration 10] [--latency-ms 50]
+    python3 benchmarks/load_test.py --invoker local --latency-ms 20
+"""
+import argparse
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEBSITE_DIR = os.path.join(ROOT, "website")
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+MODES = ("threaded", "async")
+INVOKERS = ("fake", "local")
+# Placeholders for settings the handlers read, as in benchmarks/run.py
+PLACEHOLDER_ENV = {
+    "TELEGRAM_BOT_TOKEN": "0:benchmark",
+    "TELEGRAM_CHAT_ID": "0",
+    "ADMIN_CHAT_ID": "0",
+    "GITLAB_TOKEN": "benchmark",
+    "AWS_DEFAULT_REGION": "eu-central-1",
+}
+ROUTES = {
+    # Blocking backend call per request
+    "wikipedia": ("POST", "/wikipedia", lambda n: {"topic": f"load-test-{n}"}),
+    # No backend call, only the serving overhead
+    "metrics": ("GET", "/metrics", None),
+}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def install_handler_fakes():
+    """ Runs in every local Lambda worker: point the handlers' clients at the fakes """
+    sys.path.insert(0, BENCHMARKS_DIR)
+    import fakes
+    import get_info
+    import notifier
+    import send_whatsapp
+    import startup
+    latency_ms = float(os.environ["LOAD_TEST_LATENCY_MS"])
+    gl = fakes.FakeGitlab(latency_ms=latency_ms)
+    startup.override('client:s3', fakes.FakeS3(latency_ms))
+    startup.override('module:gitlab', fakes.gitlab_module())
+    startup.override('gitlab:client', gl)
+    startup.override('gitlab:group', gl.groups.get(2, lazy=True))
+    get_info.http = send_whatsapp.session = fakes.FakeHTTP(latency_ms)
+    notifier.set_sink(notifier.MemorySink())
+
+def serve(mode, port, latency_ms, invoker):
+    """ Runs in the child: swap in the fakes, then serve the app until killed """
+    sys.path[:0] = [WEBSITE_DIR, BENCHMARKS_DIR]
+    os.environ["LOAD_TEST_LATENCY_MS"] = str(latency_ms)
+    import fakes
+    import app as wsgi
+    if invoker == "local":
+        from invoker import LocalLambdaClient
+        wsgi.lambda_client.client = LocalLambdaClient(worker_setup=install_handler_fakes)
+    else:
+        wsgi.lambda_client.client = fakes.FakeLambda(latency_ms)
+    wsgi.s3.client = fakes.FakeS3(latency_ms)
+    if mode == "threaded":
+        # What `flask run` serves with: the Werkzeug server, one thread per request
+        from werkzeug.serving import make_server
+        make_server("127.0.0.1", port, wsgi.app, threaded=True).serve_forever()
+    else:
+        import asyncio
+        from hypercorn.asyncio import serve as hypercorn_serve
+        from hypercorn.config import Config
+        import asgi
+        config = Config()
+        config.bind = [f"127.0.0.1:{port}"]
+        config.backlog = 1024
+        asyncio.run(hypercorn_serve(asgi.app, config))
+
+def process_status(pid):
+    """ Current thread count and peak RSS (MB) of a process, from /proc; None where unavailable """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["Threads"]), int(fields["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def start_server(mode, latency_ms, blocking_workers, invoker):
+    port = free_port()
+    env = dict(PLACEHOLDER_ENV, **os.environ)
+    if blocking_workers:
+        env["BLOCKING_WORKERS"] = str(blocking_workers)
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", mode, "--port", str(port),
+         "--latency-ms", str(latency_ms), "--invoker", invoker],
+        env=env, cwd=WEBSITE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"{base_url}/metrics", timeout=1)
+            return server, base_url
+        except requests.exceptions.RequestException:
+            if server.poll() is not None:
+                raise RuntimeError(f"{mode} server exited with {server.returncode}")
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+def run_load(base_url, route, clients, duration, server_pid):
+    method, path, body_for = ROUTES[route]
+    counter = itertools.count()
+    latencies, errors, lock = [], [0], threading.Lock()
+    peak_threads = [0]
+    start = threading.Barrier(clients + 1)
+    stop_at = [0.0]
+
+    def client():
+        session = requests.Session()
+        own = []
+        failed = 0
+        start.wait()
+        while time.monotonic() < stop_at[0]:
+            began = time.perf_counter()
+            try:
+                response = session.request(method, f"{base_url}{path}", json=body_for(next(counter)) if body_for else None, timeout=30)
+                ok = response.status_code < 400
+            except requests.exceptions.RequestException:
+                ok = False
+            own.append((time.perf_counter() - began) * 1000)
+            failed += not ok
+        with lock:
+            latencies.extend(own)
+            errors[0] += failed
+
+    def monitor():
+        while time.monotonic() < stop_at[0]:
+            threads, _ = process_status(server_pid)
+            peak_threads[0] = max(peak_threads[0], threads or 0)
+            time.sleep(0.1)
+
+    workers = [threading.Thread(target=client) for _ in range(clients)]
+    for worker in workers:
+        worker.start()
+    stop_at[0] = time.monotonic() + duration
+    started = time.perf_counter()
+    start.wait()
+    watcher = threading.Thread(target=monitor)
+    watcher.start()
+    for worker in workers:
+        worker.join()
+    watcher.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    pick = lambda q: round(latencies[min(len(latencies) - 1, int(len(latencies) * q))], 1) if latencies else None
+    _, peak_rss_mb = process_status(server_pid)
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "peak_threads": peak_threads[0] or None,
+        "peak_rss_mb": round(peak_rss_mb, 1) if peak_rss_mb else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the website in threaded and async serving modes")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--clients", nargs="+", type=int, default=[100, 200], help="concurrent clients, one run per value")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per run")
+    parser.add_argument("--latency-ms", type=float, default=50, help="time every fake Lambda/S3 call takes")
+    parser.add_argument("--route", choices=sorted(ROUTES), default="wikipedia")
+    parser.add_argument("--blocking-workers", type=int, help="BLOCKING_WORKERS for the async server")
+    parser.add_argument("--invoker", choices=INVOKERS, default="fake",
+                        help="fake: a stand-in Lambda client; local: the real handlers in the local Lambda pool")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--serve", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.latency_ms, args.invoker)
+        return
+
+    results = []
+    print(f"{args.route}: {args.invoker} Lambda invoker, backend latency {args.latency_ms:g} ms, {args.duration:g}s per run")
+    print(f"{'mode':<9} {'clients':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'threads':>8} {'rss MB':>7}")
+    for clients in args.clients:
+        for mode in args.modes:
+            server, base_url = start_server(mode, args.latency_ms, args.blocking_workers, args.invoker)
+            try:
+                # Warm up connections, pools and lazy imports before measuring
+                run_load(base_url, args.route, min(clients, 20), 1, server.pid)
+                result = dict(run_load(base_url, args.route, clients, args.duration, server.pid), mode=mode, clients=clients)
+            finally:
+                server.kill()
+                server.wait()
+            results.append(result)
+            print(f"{mode:<9} {clients:>7} {result['rps']:>8} {result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} "
+                  f"{result['errors']:>7} {result['peak_threads'] or '-':>8} {result['peak_rss_mb'] or '-':>7}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"route": args.route, "invoker": args.invoker, "latency_ms": args.latency_ms, "duration": args.duration, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
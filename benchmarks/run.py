@@ -0,0 +1,272 @@
+""" Offline benchmarks for every Lambda handler, against the in-process fakes in fakes.py.
+
+Each scenario builds its input in the fake S3 (untimed), invokes lambda_handler and records
+latency; one extra run under tracemalloc gives peak memory. Results are compared with
+benchmarks/baseline.json and anything slower or bigger than the tolerance is flagged.
+
+    python3 benchmarks/run.py                          # all scenarios, compare with the baseline
+    python3 benchmarks/run.py send_whatsapp --param send_whatsapp.contacts=5000
+    python3 benchmarks/run.py --quick --fail-on-regression
+    python3 benchmarks/run.py --update-baseline        # after an intended change
+
+Needs the Lambdas' requirements installed (requests, botocore, pandas, XlsxWriter).
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "lambda-functions")
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+BUCKET = "tasty-kfc-bucket"
+# Lower is better for these; items_per_s is higher-is-better
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "peak_mem_mb")
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("TELEGRAM_CHAT_ID", "0")
+os.environ.setdefault("ADMIN_CHAT_ID", "0")
+os.environ.setdefault("GITLAB_TOKEN", "benchmark")
+for name in ["shared"] + sorted(os.listdir(LAMBDA_DIR)):
+    path = os.path.join(LAMBDA_DIR, name)
+    if os.path.isdir(path) and path not in sys.path:
+        sys.path.append(path)
+
+import fakes  # noqa: E402
+
+# --- scenarios: setup(env, params) -> (module, event, items) ---
+
+def csv_rows(rows, columns):
+    rng = random.Random(rows)
+    start = date(2020, 1, 1)
+    header = ",".join(f"col{c}" for c in range(columns))
+    lines = [header]
+    for r in range(rows):
+        values = []
+        for c in range(columns):
+            kind = c % 4
+            if kind == 0:
+                values.append(str(r))
+            elif kind == 1:
+                values.append(f"{rng.random() * 1000:.3f}")
+            elif kind == 2:
+                values.append((start + timedelta(days=r % 3650)).isoformat())
+            else:
+                values.append(f"text-{rng.randint(0, 10 ** 6)}")
+        lines.append(",".join(values))
+    return "\n".join(lines) + "\n"
+
+def setup_csv_to_excel(env, params):
+    module = importlib.import_module("csv_to_excel")
+    module.CACHE_ENABLED = False
+    if not hasattr(env, "csv_body"):
+        env.csv_body = csv_rows(params["rows"], params["columns"])
+    env.s3.seed(BUCKET, "csv/bench.csv", env.csv_body)
+    event = {"Records": [{"s3": {"bucket": {"name": BUCKET}, "object": {"key": "csv/bench.csv"}}}]}
+    return module, event, params["rows"]
+
+def setup_backup(env, params):
+    module = importlib.import_module("backup")
+    env.s3.clear()
+    body = os.urandom(params["object_kb"] * 1024)
+    for i in range(params["objects"]):
+        env.s3.seed(BUCKET, f"{module.SOURCE_PREFIX}file-{i:06d}.bin", body)
+    return module, {}, params["objects"]
+
+def setup_send_whatsapp(env, params):
+    module = importlib.import_module("send_whatsapp")
+    module.session = env.http
+    # Telegram's real limits would make this a benchmark of sleep(); measure the send path instead
+    module.global_bucket = module.TokenBucket(params["global_rate"])
+    module.chat_buckets.clear()
+    contacts = [str(100000 + i) for i in range(params["contacts"])]
+    event = {"body": json.dumps({"contacts": contacts, "message": "Benchmark message"})}
+    return module, event, params["contacts"]
+
+def setup_get_info_fetch(env, params):
+    module = importlib.import_module("get_info")
+    module.http = env.http
+    module.memory_cache.clear()
+    prefix = env.unique("Topic")
+    return module, {"topics": [f"{prefix}_{i}" for i in range(params["topics"])]}, params["topics"]
+
+def setup_get_info_compact(env, params):
+    module = importlib.import_module("get_info")
+    env.s3.clear()
+    line = "Topic: Benchmark\nSummary: " + "lorem ipsum " * 20 + "\n\n"
+    env.s3.seed(BUCKET, module.WIKIPEDIA_FILE_KEY, line * params["history_entries"])
+    old = time.time_ns() - (module.COMPACTION_GRACE_SECONDS + 60) * 10 ** 9
+    for i in range(params["segments"]):
+        env.s3.seed(BUCKET, f"{module.SEGMENT_PREFIX}{old + i:020d}-{i}.txt", line)
+    return module, {"action": "compact"}, params["segments"]
+
+def setup_new_project(env, params):
+    module = importlib.import_module("new_project")
+    prefix = env.unique("bench-project")
+    projects = [{"project_name": f"{prefix}-{i}"} for i in range(params["projects"])]
+    return module, {"projects": projects}, params["projects"]
+
+def setup_create_user(env, params):
+    module = importlib.import_module("create_user")
+    prefix = env.unique("bench")
+    users = [
+        {"name": f"User {prefix} {i}", "username": f"{prefix}-{i}", "email": f"{prefix}-{i}@example.com", "password": "password123"}
+        for i in range(params["users"])
+    ]
+    return module, {"users": users}, params["users"]
+
+SCENARIOS = {
+    "csv_to_excel": (setup_csv_to_excel, {"rows": 50000, "columns": 8}, {"rows": 5000}),
+    "backup": (setup_backup, {"objects": 2000, "object_kb": 4}, {"objects": 200}),
+    "send_whatsapp": (setup_send_whatsapp, {"contacts": 1000, "global_rate": 1000000}, {"contacts": 100}),
+    "get_info_fetch": (setup_get_info_fetch, {"topics": 100}, {"topics": 20}),
+    "get_info_compact": (setup_get_info_compact, {"history_entries": 50000, "segments": 500}, {"history_entries": 5000, "segments": 50}),
+    "new_project": (setup_new_project, {"projects": 50}, {"projects": 10}),
+    "create_user": (setup_create_user, {"users": 200}, {"users": 20}),
+}
+
+def percentile(sorted_values, p):
+    """ Nearest-rank percentile """
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+def status_of(response):
+    return response.get("statusCode") if isinstance(response, dict) else None
+
+def run_scenario(name, params, iterations, latency_ms, verbose=False):
+    with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO()):
+        return measure(name, params, iterations, latency_ms)
+
+def measure(name, params, iterations, latency_ms):
+    setup = SCENARIOS[name][0]
+    env = fakes.Env(latency_ms)
+    module, event, _ = setup(env, params)
+    module.lambda_handler(event, None)  # warm-up: imports, lazy clients, thread pools
+
+    latencies, statuses, items_total = [], [], 0
+    for _ in range(iterations):
+        module, event, items = setup(env, params)
+        started = time.perf_counter()
+        response = module.lambda_handler(event, None)
+        latencies.append(time.perf_counter() - started)
+        statuses.append(status_of(response))
+        items_total += items
+
+    module, event, _ = setup(env, params)
+    tracemalloc.start()
+    module.lambda_handler(event, None)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    ordered = sorted(latencies)
+    total = sum(latencies)
+    return {
+        "params": dict(params, latency_ms=latency_ms),
+        "iterations": iterations,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+        "mean_ms": round(total / iterations * 1000, 2),
+        "invocations_per_s": round(iterations / total, 2),
+        "items_per_s": round(items_total / total, 1),
+        "peak_mem_mb": round(peak / 1024 ** 2, 2),
+        "statuses": sorted(set(statuses), key=str),
+        "s3_calls": dict(env.s3.calls),
+    }
+
+def compare(results, baseline, tolerance):
+    """ Regressions as (scenario, metric, baseline, current) tuples; scenarios run with other params are skipped """
+    regressions, skipped = [], []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if previous["params"] != current["params"]:
+            skipped.append(name)
+            continue
+        for metric in LOWER_IS_BETTER:
+            if current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append((name, metric, previous[metric], current[metric]))
+        if current["items_per_s"] < previous["items_per_s"] * (1 - tolerance):
+            regressions.append((name, "items_per_s", previous["items_per_s"], current["items_per_s"]))
+    return regressions, skipped
+
+def parse_params(pairs):
+    overrides = {}
+    for pair in pairs:
+        key, value = pair.split("=", 1)
+        scenario, param = key.split(".", 1)
+        overrides.setdefault(scenario, {})[param] = float(value) if "." in value else int(value)
+    return overrides
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Lambda handler benchmarks")
+    parser.add_argument("scenarios", nargs="*", help=f"scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=2, help="simulated latency of every fake API call")
+    parser.add_argument("--param", action="append", default=[], help="override a parameter, e.g. backup.objects=5000")
+    parser.add_argument("--quick", action="store_true", help="smaller payloads, for CI")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed slowdown before flagging, as a fraction")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit 1 when a regression is flagged")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show what the handlers print")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    overrides = parse_params(args.param)
+
+    results = {}
+    for name in args.scenarios or SCENARIOS:
+        _, defaults, quick = SCENARIOS[name]
+        params = dict(defaults, **(quick if args.quick else {}), **overrides.get(name, {}))
+        # Quick and full runs use different payloads, so each has its own baseline entry
+        key = f"{name}@quick" if args.quick else name
+        results[key] = result = run_scenario(name, params, args.iterations, args.latency_ms, args.verbose)
+        print(
+            f"{key:<24} p50 {result['p50_ms']:>9.1f} ms  p95 {result['p95_ms']:>9.1f} ms  p99 {result['p99_ms']:>9.1f} ms  "
+            f"{result['items_per_s']:>10.1f} items/s  peak {result['peak_mem_mb']:>7.1f} MB  status {result['statuses']}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline updated: {args.baseline}")
+        return
+
+    if not baseline:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one.")
+        return
+    regressions, skipped = compare(results, baseline, args.tolerance)
+    for name in skipped:
+        print(f"{name}: parameters differ from the baseline, not compared")
+    for name, metric, previous, current in regressions:
+        print(f"REGRESSION {name}.{metric}: {previous} -> {current} (tolerance {args.tolerance:.0%})")
+    if not regressions:
+        print("No regressions against the baseline.")
+    elif args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
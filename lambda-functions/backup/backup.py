@@ -1,63 +1,321 @@
-import boto3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import json
 import os
-import requests
+import time
+from notifier import DELIVERY_TIMEOUT, flush_after, notify
+import metrics
+import startup
 
-s3 = boto3.client('s3')
+COPY_WORKERS = int(os.environ.get('COPY_WORKERS', 16))
+PART_COPY_WORKERS = int(os.environ.get('PART_COPY_WORKERS', 8))
+# copy_object is limited to 5 GB; anything above the threshold goes through upload_part_copy
+MULTIPART_THRESHOLD = int(os.environ.get('MULTIPART_THRESHOLD', 1024 ** 3))
+COPY_PART_SIZE = int(os.environ.get('COPY_PART_SIZE', 512 * 1024 ** 2))
 
-TELEGRAM_BOT_TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
-TELEGRAM_CHAT_ID = os.environ['TELEGRAM_CHAT_ID']
+# One client shared by every copy thread, with a connection pool big enough for all of them
+s3 = startup.client('s3', max_pool_connections=COPY_WORKERS + PART_COPY_WORKERS)
 
 SOURCE_PREFIX = "files_to_backup/"
 BACKUP_PREFIX = "backups/"
 DATE_FORMAT = "%d-%m-%Y"
+MANIFEST_NAME = "_manifest.json"
+RESTORE_PREFIX = "restored/"
 
-def send_telegram_message(message):
-    """ Send a notification to Telegram """
-    try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        payload = {"chat_id": TELEGRAM_CHAT_ID, "text": message}
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to send Telegram notification: {e}")
+# Retention: newest N daily folders, latest folder of the newest N weeks and of the newest N months
+KEEP_DAILY = int(os.environ.get('KEEP_DAILY', 7))
+KEEP_WEEKLY = int(os.environ.get('KEEP_WEEKLY', 4))
+KEEP_MONTHLY = int(os.environ.get('KEEP_MONTHLY', 12))
+# Opt-in: until enabled, each backup only reports what retention would delete
+RETENTION_ENABLED = os.environ.get('RETENTION_ENABLED', 'false').lower() == 'true'
+DELETE_BATCH_SIZE = 1000
+
+part_executor = ThreadPoolExecutor(max_workers=PART_COPY_WORKERS)
 
 def list_files_in_prefix(bucket_name, prefix):
-    """ List all files in the given bucket and prefix """
-    response = s3.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-    files = response.get("Contents", [])
-    return [file["Key"] for file in files if file["Key"] != prefix]
+    """ List all objects (key, size, etag, last-modified) in the given bucket and prefix, across every page """
+    paginator = s3.get_paginator('list_objects_v2')
+    files = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        files.extend(obj for obj in page.get("Contents", []) if obj["Key"] != prefix)
+    return files
+
+def copy_large_object(bucket_name, source_key, target_key, size, etag=None):
+    """ Server-side copy of an object of any size with parallel upload_part_copy calls.
+    Keeps the source's content type and metadata, and fails if the source changes from `etag` (default: its current ETag) """
+    source = s3.head_object(Bucket=bucket_name, Key=source_key)
+    etag = etag or source['ETag']
+    upload_id = s3.create_multipart_upload(
+        Bucket=bucket_name,
+        Key=target_key,
+        ContentType=source.get('ContentType', 'binary/octet-stream'),
+        Metadata=source.get('Metadata', {})
+    )['UploadId']
+    try:
+        def copy_part(part_number, start):
+            end = min(start + COPY_PART_SIZE, size) - 1
+            response = s3.upload_part_copy(
+                Bucket=bucket_name,
+                Key=target_key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                CopySource={'Bucket': bucket_name, 'Key': source_key},
+                CopySourceRange=f"bytes={start}-{end}",
+                CopySourceIfMatch=etag
+            )
+            return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+
+        futures = [
+            part_executor.submit(copy_part, number, start)
+            for number, start in enumerate(range(0, size, COPY_PART_SIZE), start=1)
+        ]
+        parts = [future.result() for future in futures]
+        s3.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=target_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+    except Exception:
+        s3.abort_multipart_upload(Bucket=bucket_name, Key=target_key, UploadId=upload_id)
+        raise
+
+def copy_file(bucket_name, source_key, target_key, size, etag=None):
+    """ Server-side copy, switching to multipart above MULTIPART_THRESHOLD """
+    if size > MULTIPART_THRESHOLD:
+        copy_large_object(bucket_name, source_key, target_key, size, etag)
+    else:
+        s3.copy_object(
+            Bucket=bucket_name,
+            CopySource={'Bucket': bucket_name, 'Key': source_key},
+            Key=target_key
+        )
+    return size
+
+def copy_files(bucket_name, copies):
+    """ Run (source_key, target_key, size[, etag]) copies across the thread pool and report throughput """
+    start = time.monotonic()
+    with metrics.stage('copy'), ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+        copied_bytes = sum(executor.map(lambda copy: copy_file(bucket_name, *copy), copies))
+    elapsed = time.monotonic() - start
+    metrics.add('objects_copied', len(copies))
+    metrics.add('bytes_copied', copied_bytes)
+    return {
+        "objects": len(copies),
+        "bytes": copied_bytes,
+        "seconds": round(elapsed, 3),
+        "objects_per_sec": round(len(copies) / elapsed, 1) if elapsed else len(copies),
+        "bytes_per_sec": round(copied_bytes / elapsed) if elapsed else copied_bytes
+    }
+
+def list_backup_dates(bucket_name):
+    """ Dates that have a backup folder, oldest first """
+    paginator = s3.get_paginator('list_objects_v2')
+    dates = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=BACKUP_PREFIX, Delimiter='/'):
+        for common_prefix in page.get("CommonPrefixes", []):
+            folder = common_prefix["Prefix"][len(BACKUP_PREFIX):].rstrip('/')
+            try:
+                dates.append(datetime.strptime(folder, DATE_FORMAT))
+            except ValueError:
+                continue
+    return sorted(dates)
+
+def manifest_key_for(date):
+    return f"{BACKUP_PREFIX}{date.strftime(DATE_FORMAT)}/{MANIFEST_NAME}"
+
+def load_manifest(bucket_name, date):
+    """ Load a day's manifest; folders from before manifests existed are read as full copies """
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=manifest_key_for(date))
+        return json.loads(response['Body'].read().decode('utf-8'))
+    except s3.exceptions.NoSuchKey:
+        folder = f"{BACKUP_PREFIX}{date.strftime(DATE_FORMAT)}/"
+        return {
+            "date": date.strftime(DATE_FORMAT),
+            "files": {
+                obj["Key"][len(folder):]: {
+                    "etag": obj["ETag"],
+                    "size": obj["Size"],
+                    "last_modified": obj["LastModified"].isoformat(),
+                    "backup_key": obj["Key"]
+                }
+                for obj in list_files_in_prefix(bucket_name, folder)
+            }
+        }
+
+def latest_manifest(bucket_name, up_to):
+    """ The most recent manifest on or before `up_to`, or an empty one """
+    dates = [date for date in list_backup_dates(bucket_name) if date.date() <= up_to.date()]
+    if not dates:
+        return {"files": {}}
+    return load_manifest(bucket_name, dates[-1])
 
 def backup_files(bucket_name):
-    """ Back up files from SOURCE_PREFIX to BACKUP_PREFIX """
+    """ Incrementally back up files from SOURCE_PREFIX to BACKUP_PREFIX, copying only new or changed ones """
     today = datetime.now()
     backup_folder = f"{BACKUP_PREFIX}{today.strftime(DATE_FORMAT)}/"
-    files_to_backup = list_files_in_prefix(bucket_name, SOURCE_PREFIX)
+    with metrics.stage('list'):
+        files_to_backup = list_files_in_prefix(bucket_name, SOURCE_PREFIX)
     if not files_to_backup:
         error_message = f"No files found in prefix '{SOURCE_PREFIX}' to back up."
-        send_telegram_message(error_message)
+        notify(error_message)
         print(error_message)
-        return
-    for file_key in files_to_backup:
-        file_name = file_key[len(SOURCE_PREFIX):]
-        backup_key = f"{backup_folder}{file_name}"
-        s3.copy_object(
+        return error_message
+
+    with metrics.stage('load_manifest'):
+        previous = latest_manifest(bucket_name, today)["files"]
+    manifest = {"date": today.strftime(DATE_FORMAT), "created_at": today.isoformat(), "files": {}}
+    copies = []
+    for file in files_to_backup:
+        file_name = file["Key"][len(SOURCE_PREFIX):]
+        entry = {
+            "etag": file["ETag"],
+            "size": file["Size"],
+            "last_modified": file["LastModified"].isoformat()
+        }
+        old = previous.get(file_name)
+        if old and old["etag"] == entry["etag"] and old["size"] == entry["size"]:
+            # Unchanged: point at the copy an earlier backup already holds
+            entry["backup_key"] = old["backup_key"]
+        else:
+            entry["backup_key"] = f"{backup_folder}{file_name}"
+            copies.append((file["Key"], entry["backup_key"], file["Size"], file["ETag"]))
+        manifest["files"][file_name] = entry
+
+    stats = copy_files(bucket_name, copies)
+    print(f"Backed up {stats['objects']} new or changed files to '{backup_folder}': {stats}")
+    # The manifest goes last, so a failed run never hides changes from the next one
+    with metrics.stage('write_manifest'):
+        s3.put_object(
             Bucket=bucket_name,
-            CopySource={'Bucket': bucket_name, 'Key': file_key},
-            Key=backup_key
+            Key=manifest_key_for(today),
+            Body=json.dumps(manifest, indent=2),
+            ContentType='application/json'
         )
-        print(f"Backed up '{file_key}' to '{backup_key}'")
+    metrics.add('objects_unchanged', len(files_to_backup) - len(copies))
 
-    success_message = f"Backup completed for {len(files_to_backup)} files."
-    send_telegram_message(success_message)
+    success_message = (
+        f"Backup completed for {len(files_to_backup)} files: {len(copies)} copied, "
+        f"{len(files_to_backup) - len(copies)} unchanged "
+        f"({stats['objects_per_sec']} objects/sec, {stats['bytes_per_sec'] / 1024 ** 2:.1f} MB/sec)."
+    )
+    notify(success_message)
     print(success_message)
+    return success_message
+
+def restore_view(bucket_name, date):
+    """ The full set of files as of a backup date: file name -> key of the backup copy holding it """
+    manifest = load_manifest(bucket_name, date)
+    return {name: entry["backup_key"] for name, entry in manifest["files"].items()}
+
+def restore_files(bucket_name, date, target_prefix):
+    """ Rebuild a day's full view under target_prefix from the manifests """
+    files = load_manifest(bucket_name, date)["files"]
+    if not files:
+        raise ValueError(f"No backup found for {date.strftime(DATE_FORMAT)}")
+    copies = [(entry["backup_key"], f"{target_prefix}{name}", entry["size"]) for name, entry in files.items()]
+    stats = copy_files(bucket_name, copies)
+    return f"Restored {stats['objects']} files from {date.strftime(DATE_FORMAT)} to '{target_prefix}'."
+
+def index_backups(bucket_name):
+    """ Every object under BACKUP_PREFIX grouped by its backup date, from a single listing """
+    index = {}
+    for obj in list_files_in_prefix(bucket_name, BACKUP_PREFIX):
+        folder = obj["Key"][len(BACKUP_PREFIX):].split('/', 1)[0]
+        try:
+            date = datetime.strptime(folder, DATE_FORMAT)
+        except ValueError:
+            continue
+        index.setdefault(date, []).append(obj)
+    return index
+
+def retained_dates(dates):
+    """ Daily, weekly and monthly keep-sets in one pass over the dates, newest first """
+    keep = set()
+    daily = 0
+    weeks = set()
+    months = set()
+    for date in sorted(dates, reverse=True):
+        week = date.isocalendar()[:2]
+        month = (date.year, date.month)
+        if daily < KEEP_DAILY:
+            daily += 1
+            keep.add(date)
+        if week not in weeks and len(weeks) < KEEP_WEEKLY:
+            weeks.add(week)
+            keep.add(date)
+        if month not in months and len(months) < KEEP_MONTHLY:
+            months.add(month)
+            keep.add(date)
+    return keep
+
+def delete_objects(bucket_name, keys):
+    """ Delete keys in batches of up to 1000, returning the keys S3 refused to delete """
+    errors = []
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[i:i + DELETE_BATCH_SIZE]
+        response = s3.delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+        )
+        errors.extend(error["Key"] for error in response.get("Errors", []))
+    return errors
+
+def apply_retention(bucket_name, dry_run=False):
+    """ Delete backup folders outside the keep-sets, sparing objects that kept manifests still reference """
+    with metrics.stage('retention'):
+        return expire_backups(bucket_name, dry_run)
+
+def expire_backups(bucket_name, dry_run):
+    index = index_backups(bucket_name)
+    keep = retained_dates(index)
+    referenced = set()
+    for date in keep:
+        referenced.update(entry["backup_key"] for entry in load_manifest(bucket_name, date)["files"].values())
+
+    expired = [
+        obj for date, objects in index.items() if date not in keep
+        for obj in objects if obj["Key"] not in referenced
+    ]
+    reclaimed_bytes = sum(obj["Size"] for obj in expired)
+    errors = [] if dry_run else delete_objects(bucket_name, [obj["Key"] for obj in expired])
+    if not dry_run:
+        metrics.add('objects_deleted', len(expired) - len(errors))
+        metrics.add('bytes_reclaimed', reclaimed_bytes)
+
+    return (
+        f"{'Dry run: would delete' if dry_run else 'Deleted'} {len(expired) - len(errors)} backup objects "
+        f"from {len(index) - len(keep)} expired days, reclaiming {reclaimed_bytes / 1024 ** 2:.1f} MB"
+        + (f" ({len(errors)} failed)." if errors else ".")
+    )
 
+# Nightly job: nobody waits on the response, so make sure the report is delivered before freezing
+@metrics.instrumented
+@flush_after(wait=DELIVERY_TIMEOUT)
 def lambda_handler(event, context):
     bucket_name = "tasty-kfc-bucket"
+    action = event.get('action', 'backup')
     try:
-        backup_files(bucket_name)
+        if action == 'restore':
+            date = datetime.strptime(event['date'], DATE_FORMAT)
+            target_prefix = event.get('target_prefix', f"{RESTORE_PREFIX}{event['date']}/")
+            message = restore_files(bucket_name, date, target_prefix)
+            notify(message)
+            print(message)
+        elif action == 'retention':
+            message = apply_retention(bucket_name, dry_run=event.get('dry_run', False))
+            notify(message)
+            print(message)
+        else:
+            message = backup_files(bucket_name)
+            dry_run = event.get('dry_run', False) or not RETENTION_ENABLED
+            retention_message = apply_retention(bucket_name, dry_run=dry_run)
+            print(retention_message)
+            message = f"{message} {retention_message}"
+        return {"statusCode": 200, "body": message}
     except Exception as e:
         error_message = f"❌ Error: {str(e)}"
-        send_telegram_message(error_message)
+        notify(error_message)
         print(error_message)
         raise
@@ -1,70 +1,234 @@
-import gitlab
+import hashlib
+import json
 import os
-import requests
-
-TELEGRAM_BOT_TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
-TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from notifier import flush_after, notify
+import idempotency
+import metrics
+import startup
 
 GITLAB_URL = os.environ.get('GITLAB_URL', '')
-PRIVATE_TOKEN = os.environ.get('GITLAB_TOKEN', '')
 MAIN_GROUP_ID = 2
+BUCKET_NAME = 'tasty-kfc-bucket'
+CHECKPOINT_PREFIX = 'provisioning/'
+PROVISION_WORKERS = int(os.environ.get('PROVISION_WORKERS', 8))
+MAX_RETRIES = int(os.environ.get('MAX_RETRIES', 4))
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_MAX_SECONDS = 30
+CHECKPOINT_INTERVAL_SECONDS = float(os.environ.get('CHECKPOINT_INTERVAL_SECONDS', 2))
+# Stop starting new users this long before Lambda's timeout; the rest is left for a rerun
+TIME_MARGIN_SECONDS = 30
+STEPS = ('user', 'member', 'project')
 
-def send_telegram_message(chat_id, message):
-    """ Sends a Telegram message to a specific chat ID """
-    payload = {
-        "chat_id": chat_id,
-        "text": message,
-    }
-    response = requests.post(TELEGRAM_API_URL, json=payload)
-    return response.json()
+# Imported and connected on first use, then reused while the container stays warm
+gitlab = startup.module('gitlab')
+gl = startup.lazy('gitlab:client', lambda: gitlab.Gitlab(GITLAB_URL, private_token=os.environ.get('GITLAB_TOKEN', '')))
+# lazy=True gives a group object without an API call; members.create only needs its ID
+group = startup.lazy('gitlab:group', lambda: gl.groups.get(MAIN_GROUP_ID, lazy=True))
+s3 = startup.client('s3')
+idempotency_store = idempotency.S3Store(s3, BUCKET_NAME)
 
 def send_operation_notification(message):
     """Send success/failure notification to a Telegram chat"""
-    admin_chat_id = os.environ['ADMIN_CHAT_ID']
-    send_telegram_message(admin_chat_id, message)
+    notify(message, chat_id=os.environ['ADMIN_CHAT_ID'])
+
+def backoff_delay(attempt):
+    """ Exponential backoff with full jitter """
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+def with_backoff(call):
+    """ Run a GitLab call, retrying rate limits (429) and server errors with backoff """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            with metrics.stage('gitlab'):
+                return call()
+        except gitlab.exceptions.GitlabError as e:
+            if attempt == MAX_RETRIES or not (e.response_code == 429 or (e.response_code or 0) >= 500):
+                raise
+            metrics.add('retries')
+            time.sleep(backoff_delay(attempt))
+
+def already_exists(error):
+    return error.response_code == 409 or 'has already been taken' in str(error.error_message)
+
+def create_or_find_user(user):
+    """ Create the user, or adopt it if a previous run created it without recording it """
+    try:
+        return with_backoff(lambda: gl.users.create({
+            'name': user['name'],
+            'username': user['username'],
+            'email': user['email'],
+            'password': user['password'],
+            'reset_password': False
+        })).id
+    except gitlab.exceptions.GitlabCreateError as e:
+        if not already_exists(e):
+            raise
+        existing = with_backoff(lambda: gl.users.list(username=user['username']))
+        # Only adopt our own earlier attempt, never someone else's account with the same username
+        if not existing or getattr(existing[0], 'email', None) != user['email']:
+            raise
+        return existing[0].id
+
+def provision_user(user, state, save=lambda: None):
+    """ Run the create-user, add-member and create-project steps that `state` hasn't recorded yet, saving after each """
+    if 'user' not in state:
+        state['user'] = {"user_id": create_or_find_user(user)}
+        save()
+    if 'member' not in state:
+        try:
+            with_backoff(lambda: group.members.create({'user_id': state['user']['user_id'], 'access_level': gitlab.REPORTER}))
+        except gitlab.exceptions.GitlabCreateError as e:
+            if not already_exists(e):
+                raise
+        state['member'] = {}
+        save()
+    if 'project' not in state:
+        project = with_backoff(lambda: gl.projects.create({'name': user['name'], 'namespace_id': MAIN_GROUP_ID}))
+        state['project'] = {"project_id": project.id, "project_url": project.web_url}
+        save()
+    return state
+
+def validate(user):
+    return all(user.get(field) for field in ('name', 'email', 'username', 'password'))
+
+def request_key(event):
+    """ Same user, or same cohort, means same request; None skips idempotency for invalid events """
+    if 'users' in event:
+        return idempotency.derive_key('create_user', event.get('batch_id') or batch_id_for(event['users']))
+    if validate(event):
+        return idempotency.derive_key('create_user', event['username'], event['email'])
+    return None
+
+def batch_id_for(users):
+    usernames = sorted(user.get('username', '') for user in users)
+    return hashlib.sha256(json.dumps(usernames).encode('utf-8')).hexdigest()[:16]
+
+class Checkpoint:
+    """ Per-username step results in S3, saved at most every CHECKPOINT_INTERVAL_SECONDS """
+
+    def __init__(self, batch_id):
+        self.key = f"{CHECKPOINT_PREFIX}{batch_id}.json"
+        self.lock = threading.Lock()
+        self.saved_at = 0
+        try:
+            self.states = json.loads(s3.get_object(Bucket=BUCKET_NAME, Key=self.key)['Body'].read().decode('utf-8'))
+        except s3.exceptions.NoSuchKey:
+            self.states = {}
+
+    def state(self, username):
+        with self.lock:
+            return dict(self.states.get(username, {}))
 
+    def record(self, username, state):
+        with self.lock:
+            self.states[username] = state
+            if time.monotonic() - self.saved_at >= CHECKPOINT_INTERVAL_SECONDS:
+                self._save()
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        s3.put_object(Bucket=BUCKET_NAME, Key=self.key, Body=json.dumps(self.states), ContentType='application/json')
+        self.saved_at = time.monotonic()
+
+def provision_users(users, checkpoint, deadline):
+    """ Provision users on a bounded pool; users not started before the deadline are reported as pending """
+    def run(user):
+        username = user['username']
+        state = checkpoint.state(username)
+        if all(step in state for step in STEPS):
+            return {"username": username, "status": "skipped", **state['project']}
+        if time.monotonic() > deadline:
+            return {"username": username, "status": "pending"}
+        try:
+            state = provision_user(user, state)
+            checkpoint.record(username, state)
+            metrics.add('users_created')
+            return {"username": username, "status": "created", "user_id": state['user']['user_id'], **state['project']}
+        except Exception as e:
+            # Keep the steps that did succeed so a rerun continues from the failed one
+            checkpoint.record(username, state)
+            metrics.add('users_failed')
+            error = getattr(e, 'error_message', None) or str(e)
+            return {"username": username, "status": "failed", "error": str(error)}
+
+    with ThreadPoolExecutor(max_workers=min(PROVISION_WORKERS, len(users))) as executor:
+        results = list(executor.map(run, users))
+    checkpoint.save()
+    return results
+
+def bulk_handler(event, context):
+    users = event['users']
+    invalid = [u.get('username') or f"#{i}" for i, u in enumerate(users) if not validate(u)]
+    if invalid:
+        error_message = f"All fields are required for every user; missing for: {', '.join(invalid)}"
+        send_operation_notification(f"Failure: {error_message}")
+        return {"statusCode": 400, "message": error_message}
+
+    batch_id = event.get('batch_id') or batch_id_for(users)
+    remaining = context.get_remaining_time_in_millis() / 1000 if context is not None else 900
+    deadline = time.monotonic() + max(remaining - TIME_MARGIN_SECONDS, 0)
+    results = provision_users(users, Checkpoint(batch_id), deadline)
+
+    counts = {status: sum(1 for r in results if r['status'] == status) for status in ('created', 'skipped', 'failed', 'pending')}
+    message = (
+        f"Provisioned batch {batch_id}: {counts['created']} created, {counts['skipped']} already done, "
+        f"{counts['failed']} failed, {counts['pending']} pending."
+    )
+    if counts['failed'] or counts['pending']:
+        message += " Rerun with the same users to resume."
+    send_operation_notification(f"{'Success' if not counts['failed'] else 'Partial failure'}: {message}")
+    return {
+        "statusCode": 200 if not (counts['failed'] or counts['pending']) else 207,
+        "message": message,
+        "batch_id": batch_id,
+        "counts": counts,
+        "results": results
+    }
+
+@metrics.instrumented
+@flush_after
+@idempotency.idempotent(idempotency_store, request_key)
 def lambda_handler(event, context):
+    """
+    Create a GitLab user, add it to the main group and create its project.
+    Pass `users` (a list of name/email/username/password) to provision a whole cohort;
+    progress is checkpointed per batch so a rerun resumes instead of starting over.
+    A retried request replays its stored response, or resumes from its first incomplete step.
+    """
     try:
-        name = event.get('name')
-        email = event.get('email')
-        username = event.get('username')
-        password = event.get('password')
+        if 'users' in event:
+            return bulk_handler(event, context)
 
-        if not all([name, email, username, password]):
+        if not validate(event):
             error_message = "All fields are required."
             send_operation_notification(f"Failure: {error_message}")
             return {"statusCode": 400, "message": error_message}
 
-        gl = gitlab.Gitlab(GITLAB_URL, private_token=PRIVATE_TOKEN)
-
-        user_data = {
-            'name': name,
-            'username': username,
-            'email': email,
-            'password': password,
-            'reset_password': False
-        }
-        user = gl.users.create(user_data)
-
-        group = gl.groups.get(MAIN_GROUP_ID)
-        group.members.create({'user_id': user.id, 'access_level': gitlab.REPORTER})
-
-        project = gl.projects.create({
-            'name': name,
-            'namespace_id': group.id
-        })
+        run = idempotency.current()
+        state = provision_user(event, run.steps, run.save)
+        metrics.add('users_created')
 
-        success_message = f"User and project created successfully!\nUser ID: {user.id}\nProject ID: {project.id}\nProject URL: {project.web_url}"
+        success_message = (
+            f"User and project created successfully!\nUser ID: {state['user']['user_id']}\n"
+            f"Project ID: {state['project']['project_id']}\nProject URL: {state['project']['project_url']}"
+        )
         send_operation_notification(f"Success: {success_message}")
 
         return {
             "statusCode": 200,
             "message": "User and repository created successfully!",
             "details": {
-                "user_id": user.id,
-                "user_email": user.email,
-                "project_id": project.id,
-                "project_url": project.web_url
+                "user_id": state['user']['user_id'],
+                "user_email": event['email'],
+                "project_id": state['project']['project_id'],
+                "project_url": state['project']['project_url']
             }
         }
 
@@ -76,4 +240,4 @@ def lambda_handler(event, context):
     except Exception as e:
         error_message = f"An unexpected error occurred: {str(e)}"
         send_operation_notification(f"Failure: {error_message}")
-        return {"statusCode": 500, "message": error_message}
\ No newline at end of file
+        return {"statusCode": 500, "message": error_message}
@@ -1,63 +1,466 @@
-import boto3
+from botocore.exceptions import ClientError
+import codecs
+import hashlib
+import json
 import os
 import csv
+import resource
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import unquote_plus
 from xlsxwriter.workbook import Workbook
-import requests
+from notifier import DELIVERY_TIMEOUT, flush_after, notify
+import metrics
+import startup
 
-s3 = boto3.client('s3')
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 4))
+PART_WORKERS = int(os.environ.get('PART_WORKERS', 2))
 
-TELEGRAM_BOT_TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
-TELEGRAM_CHAT_ID = os.environ['TELEGRAM_CHAT_ID']
+s3 = startup.client('s3', max_pool_connections=MAX_WORKERS * (PART_WORKERS + 1))
+# Imports pandas, which takes most of the cold start and is only needed for typed conversion
+typed_columns = startup.module('typed_columns')
 
-def send_telegram_message(message):
-    """ Send a notification to Telegram """
+READ_CHUNK_SIZE = int(os.environ.get('READ_CHUNK_SIZE', 1024 * 1024))
+UPLOAD_PART_SIZE = int(os.environ.get('UPLOAD_PART_SIZE', 8 * 1024 * 1024))  # S3 minimum is 5 MB
+CHUNK_ROWS = int(os.environ.get('CHUNK_ROWS', 50000))
+# Opt-in: typing cells costs pandas' import, a pass per chunk column and more memory than writing text
+TYPED_COLUMNS = os.environ.get('TYPED_COLUMNS', 'false').lower() == 'true'
+EXCEL_DATE_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_COLS = 16384
+ROWS_PER_SHEET = min(int(os.environ.get('ROWS_PER_SHEET', EXCEL_MAX_ROWS)), EXCEL_MAX_ROWS)
+# Past ROWS_PER_SHEET rows, 'files' rolls over into _partN objects and 'sheets' into new sheets of one workbook
+SPLIT_MODE = os.environ.get('SPLIT_MODE', 'files')
+# xlsxwriter spools every sheet's uncompressed XML to files here until its workbook is closed, so
+# /tmp use grows with the output. Each of the MAX_WORKERS conversions gets an equal share of 80% of
+# the function's ephemeral storage, halved because closing a part copies its sheets once more.
+SPOOL_DIR = os.environ.get('SPOOL_DIR', tempfile.gettempdir())
+EPHEMERAL_STORAGE_MB = int(os.environ.get('EPHEMERAL_STORAGE_MB', 512))
+SPOOL_BUDGET_BYTES = int(EPHEMERAL_STORAGE_MB * 1024 * 1024 * 0.8 / MAX_WORKERS / 2)
+SPOOL_CHECK_ROWS = 1000
+CACHE_ENABLED = os.environ.get('CACHE_ENABLED', 'true').lower() == 'true'
+CONVERTER_VERSION = 5  # bump whenever the output for the same input and options changes
+
+cache_stats = {"hits": 0, "misses": 0}  # totals across warm invocations of this container
+
+class S3MultipartWriter:
+    """ Write-only file object that streams its content to S3 as a multipart upload """
+
+    def __init__(self, bucket_name, key, part_size=UPLOAD_PART_SIZE, metadata=None):
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.parts = []
+        self.bytes_written = 0
+        response = s3.create_multipart_upload(Bucket=bucket_name, Key=key, Metadata=metadata or {})
+        self.upload_id = response['UploadId']
+
+    def write(self, data):
+        self.buffer += data
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _upload_part(self, data):
+        part_number = len(self.parts) + 1
+        with metrics.stage('upload'):
+            response = s3.upload_part(
+                Bucket=self.bucket_name,
+                Key=self.key,
+                UploadId=self.upload_id,
+                PartNumber=part_number,
+                Body=data
+            )
+        metrics.add('bytes_uploaded', len(data))
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+
+    def close(self):
+        """ Upload the remaining buffer as the last part and complete the upload """
+        if self.buffer or not self.parts:
+            self._upload_part(bytes(self.buffer))
+            self.buffer = bytearray()
+        with metrics.stage('upload'):
+            s3.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={'Parts': self.parts}
+            )
+
+    def abort(self):
+        s3.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id)
+
+def iter_lines(body, chunk_size=READ_CHUNK_SIZE):
+    """ Yield decoded lines (with their line endings) from a streaming S3 body """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    while True:
+        chunk = body.read(chunk_size)
+        if not chunk:
+            break
+        pending += decoder.decode(chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+def iter_text_rows(body):
+    """ Yield every CSV row as a list of strings """
+    yield from csv.reader(iter_lines(body))
+
+def peak_rss_mb():
+    """ Peak resident set size of this process, in MB """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class WorkbookPart:
+    """ One .xlsx object being streamed to S3, rolling rows over Excel's sheet limits """
+
+    def __init__(self, bucket_name, key, header, metadata=None):
+        self.key = key
+        self.header = header
+        self.writer = S3MultipartWriter(bucket_name, key, metadata=metadata)
+        # constant_memory writes every row out to the sheet's spool file as soon as the next one starts
+        self.workbook = Workbook(self.writer, {
+            'constant_memory': True,
+            'tmpdir': SPOOL_DIR,
+            'default_date_format': EXCEL_DATE_FORMAT,
+            'remove_timezone': True
+        })
+        self.rows = 0
+        self.sheets = 0
+        self.worksheets = []
+        self.bands = []  # worksheets of the current sheet, one per EXCEL_MAX_COLS columns
+        self.sheet_row = ROWS_PER_SHEET
+        self.spooled = 0
+
+    def spooled_bytes(self):
+        """ Size of the sheet XML spooled to SPOOL_DIR for this part, remeasured every SPOOL_CHECK_ROWS rows """
+        if self.rows % SPOOL_CHECK_ROWS == 0:
+            total = 0
+            for worksheet in self.worksheets:
+                try:
+                    total += os.path.getsize(worksheet.row_data_filename)
+                except (OSError, TypeError):
+                    pass
+            self.spooled = total
+        return self.spooled
+
+    def sheet_full(self):
+        return self.sheet_row >= ROWS_PER_SHEET
+
+    def add_sheet(self):
+        """ Start a new sheet and repeat the header on it """
+        self.sheets += 1
+        self.bands = []
+        self.sheet_row = 0
+        if self.header is not None:
+            self._write(self.header)
+
+    def _band(self, index):
+        while len(self.bands) <= index:
+            name = f"Sheet{self.sheets}"
+            if self.bands:
+                name += f" cols {len(self.bands) + 1}"
+            self.bands.append(self.workbook.add_worksheet(name))
+            self.worksheets.append(self.bands[-1])
+        return self.bands[index]
+
+    def _write(self, row):
+        for start in range(0, max(len(row), 1), EXCEL_MAX_COLS):
+            self._band(start // EXCEL_MAX_COLS).write_row(self.sheet_row, 0, row[start:start + EXCEL_MAX_COLS])
+        self.sheet_row += 1
+
+    def write_row(self, row):
+        self._write(row)
+        self.rows += 1
+
+    def close(self):
+        """ Finish the workbook and complete its upload """
+        try:
+            self.workbook.close()
+            self.writer.close()
+        except Exception:
+            self.writer.abort()
+            raise
+        return {"key": self.key, "rows": self.rows, "sheets": self.sheets, "bytes": self.writer.bytes_written}
+
+    def abort(self):
+        self.writer.abort()
+
+def part_key(converted_key, number):
+    """ The first part keeps the plain converted key, later ones get a _partN suffix """
+    if number == 1:
+        return converted_key
+    base, ext = os.path.splitext(converted_key)
+    return f"{base}_part{number}{ext}"
+
+def manifest_key_for(converted_key):
+    return f"{os.path.splitext(converted_key)[0]}_manifest.json"
+
+def conversion_options():
+    """ Everything besides the source bytes that affects the converted output """
+    return {
+        "version": CONVERTER_VERSION,
+        "typed_columns": TYPED_COLUMNS,
+        "split_mode": SPLIT_MODE,
+        "rows_per_sheet": ROWS_PER_SHEET
+    }
+
+def cache_metadata(source_etag):
+    """ Metadata stored on converted objects so unchanged sources can be recognised later """
+    options = json.dumps(conversion_options(), sort_keys=True)
+    return {
+        "source-etag": source_etag.strip('"'),
+        "options-hash": hashlib.sha256(options.encode('utf-8')).hexdigest()[:16]
+    }
+
+def source_etag_for(bucket_name, object_key, event_etag=None):
+    if event_etag:
+        return event_etag
+    return s3.head_object(Bucket=bucket_name, Key=object_key)['ETag']
+
+def find_cached_conversion(bucket_name, converted_key, metadata):
+    """ Look for a previous conversion with matching metadata, returning (hit, manifest_key) """
+    manifest_key = manifest_key_for(converted_key)
+    for key in (manifest_key, converted_key):
+        try:
+            response = s3.head_object(Bucket=bucket_name, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                continue
+            raise
+        if response.get('Metadata', {}) == metadata:
+            return True, manifest_key if key == manifest_key else None
+    return False, None
+
+def listed_part_keys(bucket_name, manifest_key):
+    """ The part keys an existing manifest lists, or [] when there is none """
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        payload = {"chat_id": TELEGRAM_CHAT_ID, "text": message}
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to send Telegram notification: {e}")
+        response = s3.get_object(Bucket=bucket_name, Key=manifest_key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return []
+        raise
+    return [part["key"] for part in json.loads(response['Body'].read())["parts"]]
 
-def lambda_handler(event, context):
+def replace_manifest(bucket_name, object_key, converted_key, parts, metadata):
+    """ Write the manifest of a split conversion, or delete the one an earlier split run left behind,
+    then delete that run's parts this one didn't overwrite; otherwise they'd pass for a cached result """
+    manifest_key = manifest_key_for(converted_key)
+    stale_keys = set(listed_part_keys(bucket_name, manifest_key)) - {part["key"] for part in parts}
+    if len(parts) > 1:
+        manifest = {"source_key": object_key, "parts": parts}
+        s3.put_object(
+            Bucket=bucket_name,
+            Key=manifest_key,
+            Body=json.dumps(manifest, indent=2),
+            ContentType='application/json',
+            Metadata=metadata or {}
+        )
+    else:
+        s3.delete_object(Bucket=bucket_name, Key=manifest_key)
+        manifest_key = None
+    if stale_keys:
+        s3.delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': [{'Key': key} for key in sorted(stale_keys)], 'Quiet': True}
+        )
+    return manifest_key
+
+def convert_csv_stream(bucket_name, object_key, converted_key, metadata=None):
+    """
+    Stream a CSV object from S3 into one or more .xlsx objects. Neither the CSV nor the .xlsx is stored
+    in /tmp, but xlsxwriter spools each open part's sheet XML to SPOOL_DIR. The output is split only
+    at ROWS_PER_SHEET, and a conversion fails rather than spool more than SPOOL_BUDGET_BYTES.
+    """
+    with metrics.stage('download'):
+        source = s3.get_object(Bucket=bucket_name, Key=object_key)
+    # Set by the website on upload, linking this conversion to the request that stored the file
+    if source.get('Metadata', {}).get('correlation-id'):
+        metrics.set_property('upload_correlation_id', source['Metadata']['correlation-id'])
+    body = metrics.MeteredReader(source['Body'])
+    start = time.monotonic()
+    rows_source = typed_columns.iter_typed_rows(iter_lines(body), CHUNK_ROWS) if TYPED_COLUMNS else iter_text_rows(body)
+    pending = []
+    closing_spool = []  # spool size of each part in `pending` when it was handed over to be closed
+    peak_spool = 0
+    part = None
     try:
-        bucket_name = event['Records'][0]['s3']['bucket']['name']
-        object_key = event['Records'][0]['s3']['object']['key']
-        
-        download_path = f"/tmp/{os.path.basename(object_key)}"
-        upload_path = f"/tmp/{os.path.splitext(os.path.basename(object_key))[0]}.xlsx"
+        with ThreadPoolExecutor(max_workers=PART_WORKERS) as part_executor:
+            header = next(rows_source, None)
+            part = WorkbookPart(bucket_name, converted_key, header, metadata)
+            for row in rows_source:
+                spooled = part.spooled_bytes()
+                live_spool = spooled + sum(size for f, size in zip(pending, closing_spool) if not f.done())
+                peak_spool = max(peak_spool, live_spool)
+                if live_spool > SPOOL_BUDGET_BYTES:
+                    raise ValueError(
+                        f"Output needs more than {SPOOL_BUDGET_BYTES // 1024 ** 2} MB of spool in {SPOOL_DIR}; "
+                        f"raise the function's ephemeral storage and EPHEMERAL_STORAGE_MB"
+                    )
+                if part.sheet_full():
+                    if SPLIT_MODE == 'files' and part.sheets:
+                        # Finish this part in the background while the next one is being filled
+                        closing_spool.append(spooled)
+                        pending.append(part_executor.submit(part.close))
+                        part = None
+                        while sum(not f.done() for f in pending) >= PART_WORKERS:
+                            wait(pending, return_when=FIRST_COMPLETED)
+                        part = WorkbookPart(bucket_name, part_key(converted_key, len(pending) + 1), header, metadata)
+                    part.add_sheet()
+                part.write_row(row)
+            pending.append(part_executor.submit(part.close))
+            part = None
+            parts = [f.result() for f in pending]
+    except Exception:
+        if part is not None:
+            part.abort()
+        # Don't leave finished parts of a failed conversion behind to be mistaken for a cached result
+        for f in pending:
+            if f.done() and not f.exception():
+                s3.delete_object(Bucket=bucket_name, Key=f.result()["key"])
+        raise
+    finally:
+        body.close()
 
-        s3.download_file(bucket_name, object_key, download_path)
+    manifest_key = replace_manifest(bucket_name, object_key, converted_key, parts, metadata)
 
-        workbook = Workbook(upload_path)
-        worksheet = workbook.add_worksheet()
+    elapsed = time.monotonic() - start
+    rows = sum(p["rows"] for p in parts)
+    return {
+        "rows": rows,
+        "parts": len(parts),
+        "sheets": sum(p["sheets"] for p in parts),
+        "manifest_key": manifest_key,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed, 1) if elapsed else rows,
+        "bytes_uploaded": sum(p["bytes"] for p in parts),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "peak_spool_mb": round(peak_spool / 1024 ** 2, 1)
+    }
 
-        with open(download_path, 'rt', encoding='utf8') as f:
-            reader = csv.reader(f)
-            for r, row in enumerate(reader):
-                for c, col in enumerate(row):
-                    worksheet.write(r, c, col)
-        workbook.close()
+def extract_objects(event):
+    """ Flatten direct S3 records and SQS-wrapped S3 notifications into (message_id, bucket, key, etag) tuples """
+    objects = []
+    for record in event.get('Records', []):
+        if record.get('eventSource') == 'aws:sqs':
+            item_id = record['messageId']
+            try:
+                s3_records = json.loads(record['body']).get('Records', [])
+            except (ValueError, AttributeError):
+                objects.append((item_id, None, None, None))
+                continue
+        else:
+            item_id = None  # only SQS messages can be reported back as batch item failures
+            s3_records = [record]
+        for s3_record in s3_records:
+            objects.append((
+                item_id,
+                s3_record['s3']['bucket']['name'],
+                unquote_plus(s3_record['s3']['object']['key']),
+                s3_record['s3']['object'].get('eTag')
+            ))
+    return objects
 
+def convert_object(item_id, bucket_name, object_key, event_etag=None):
+    """ Convert a single CSV object, unless an identical conversion already exists, and describe the outcome """
+    result = {"item_id": item_id, "source_key": object_key}
+    try:
+        if not object_key:
+            raise ValueError("Record does not describe an S3 object")
         converted_key = f"converted/{os.path.splitext(os.path.basename(object_key))[0]}.xlsx"
-        s3.upload_file(upload_path, bucket_name, converted_key)
+        with metrics.stage('cache_lookup'):
+            metadata = cache_metadata(source_etag_for(bucket_name, object_key, event_etag))
+            hit, manifest_key = find_cached_conversion(bucket_name, converted_key, metadata) if CACHE_ENABLED else (False, None)
+        if hit:
+            print(f"Cache hit for {object_key}, reusing {converted_key}")
+            result.update({"status": "cached", "converted_key": converted_key, "manifest_key": manifest_key})
+            return result
+        # Includes the download and upload time, which are also reported on their own
+        with metrics.stage('conversion'):
+            stats = convert_csv_stream(bucket_name, object_key, converted_key, metadata)
+        metrics.add('rows', stats['rows'])
+        print(f"Converted {object_key}: {stats}")
+        result.update({"status": "converted", "converted_key": converted_key, "stats": stats})
+    except Exception as e:
+        print(f"Failed to convert {object_key}: {e}")
+        result.update({"status": "failed", "error": str(e)})
+    return result
 
-        success_message = (
-            f"✅ File conversion successful!\n"
-            f"📄 Source File: {object_key}\n"
-            f"📥 Converted File: {converted_key}"
-        )
-        send_telegram_message(success_message)
-        
+@metrics.instrumented
+# S3 invokes this asynchronously, so nothing would thaw the container to send what's still queued
+@flush_after(wait=DELIVERY_TIMEOUT)
+def lambda_handler(event, context):
+    try:
+        objects = extract_objects(event)
+        if not objects:
+            raise ValueError("Event contains no S3 records")
+
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(objects))) as executor:
+            results = list(executor.map(lambda item: convert_object(*item), objects))
+
+        converted = [r for r in results if r["status"] == "converted"]
+        cached = [r for r in results if r["status"] == "cached"]
+        failed = [r for r in results if r["status"] == "failed"]
+        failed_items = list(dict.fromkeys(r["item_id"] for r in failed if r["item_id"]))
+
+        cache = {"hits": len(cached), "misses": len(converted) + len(failed)}
+        cache_stats["hits"] += cache["hits"]
+        cache_stats["misses"] += cache["misses"]
+        metrics.add('files_converted', len(converted))
+        metrics.add('files_cached', len(cached))
+        metrics.add('files_failed', len(failed))
+        print(f"Conversion cache: {cache} this invocation, {cache_stats} since cold start")
+
+        lines = []
+        for r in converted:
+            stats = r["stats"]
+            message = (
+                f"✅ File conversion successful!\n"
+                f"📄 Source File: {r['source_key']}\n"
+                f"📥 Converted File: {r['converted_key']}\n"
+            )
+            if stats['manifest_key']:
+                message += f"🧩 {stats['parts']} parts listed in {stats['manifest_key']}\n"
+            message += (
+                f"⏱️ {stats['rows']} rows in {stats['sheets']} sheet(s) at {stats['rows_per_sec']} rows/sec, "
+                f"peak RSS {stats['peak_rss_mb']} MB, peak /tmp spool {stats['peak_spool_mb']} MB"
+            )
+            lines.append(message)
+        for r in cached:
+            lines.append(f"♻️ {r['source_key']} is unchanged, reusing {r['manifest_key'] or r['converted_key']}")
+        for r in failed:
+            lines.append(f"❌ Error converting {r['source_key']}: {r['error']}")
+        notify("\n\n".join(lines))
+
+        if not failed:
+            status_code = 200
+        elif converted or cached:
+            status_code = 207
+        else:
+            status_code = 500
         return {
-            "statusCode": 200,
-            "body": f"Successfully converted {object_key} to {converted_key}"
+            "statusCode": status_code,
+            "body": f"Converted {len(converted) + len(cached)} of {len(results)} files ({len(cached)} from cache)",
+            "results": results,
+            "cache": cache,
+            "batchItemFailures": [{"itemIdentifier": item_id} for item_id in failed_items]
         }
-    
+
     except Exception as e:
         error_message = f"❌ Error: {str(e)}"
-        send_telegram_message(error_message)   
+        notify(error_message)
         return {
             "statusCode": 500,
             "body": error_message
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,79 @@
+""" Typed cells for CSV to Excel conversion, shared by the csv_to_excel Lambda and scripts/csv_to_excel.py.
+
+Rows are parsed by csv.reader like the text conversion's, so ragged rows keep their own length and
+headers are written as they are. Every cell is read as text and a chunk column only becomes numbers,
+bools or dates when all of its values convert without changing what the cell shows. Blank cells
+become empty, but 'NA', 'null' and the like stay text. A value with a leading zero or a leading '+'
+(ZIP codes, phone numbers), with more significant digits than Excel keeps (15, so long IDs would be
+rounded), or out of a float's range ('1e400') keeps its column as text.
+"""
+import csv
+import itertools
+import re
+import numpy as np
+import pandas as pd
+
+EXCEL_MAX_DIGITS = 15
+# No leading zeros and no '+', so only numbers that read back exactly as written
+NUMBER = r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?'
+ISO_DATE = r'\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?(?:Z|[-+]\d{2}:?\d{2})?'
+BOOLS = {'true': True, 'false': False}
+
+def fits_excel_precision(values):
+    # Only values longer than EXCEL_MAX_DIGITS characters can have too many digits
+    long_values = values[values.str.len() > EXCEL_MAX_DIGITS]
+    if long_values.empty:
+        return True
+    mantissa = long_values.str.replace(r'[eE].*$', '', regex=True).str.replace(r'[-.]', '', regex=True)
+    return bool((mantissa.str.lstrip('0').str.len() <= EXCEL_MAX_DIGITS).all())
+
+def matches(values, pattern):
+    # The first value rules out most text columns without a pass over the whole chunk
+    return re.fullmatch(pattern, values.iloc[0]) is not None and values.str.fullmatch(pattern).all()
+
+def typed_values(values):
+    """ The non-blank text values of a column as numbers, bools or dates, or None if they must stay text """
+    if matches(values, NUMBER) and fits_excel_precision(values):
+        numbers = pd.to_numeric(values)
+        if np.isfinite(numbers).all():
+            return numbers
+    if values.iloc[0].lower() in BOOLS:
+        lowered = values.str.lower()
+        if lowered.isin(BOOLS).all():
+            return lowered.map(BOOLS)
+    if matches(values, ISO_DATE):
+        parsed = pd.to_datetime(values, errors='coerce', format='ISO8601')
+        # Mixed UTC offsets come back as objects; leave those as written
+        if pd.api.types.is_datetime64_any_dtype(parsed) and parsed.notna().all():
+            return parsed
+    return None
+
+def infer_column(series):
+    """ Turn one chunk column of text into native values, blanks into None """
+    filled = series != ''
+    values = series[filled]
+    if values.empty:
+        return [None] * len(series)
+    typed = typed_values(values)
+    cells = (values if typed is None else typed).astype(object).reindex(series.index)
+    return cells.where(filled, None).tolist()
+
+def iter_typed_rows(lines, chunk_rows):
+    """ Yield the header, then rows of typed values, inferring column types once per chunk of rows.
+    `lines` is anything csv.reader reads, e.g. a text file; cells a short row lacks don't count towards the types """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    yield header
+    while True:
+        chunk = list(itertools.islice(reader, chunk_rows))
+        if not chunk:
+            return
+        width = max(len(row) for row in chunk)
+        columns = [
+            infer_column(pd.Series([row[c] if c < len(row) else '' for row in chunk], dtype=object))
+            for c in range(width)
+        ]
+        for i, row in enumerate(chunk):
+            yield tuple(column[i] for column in columns[:len(row)])
@@ -1,72 +1,306 @@
 import json
 import os
-import boto3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote
 import requests
+from requests.adapters import HTTPAdapter
+from notifier import DELIVERY_TIMEOUT, flush_after, notify
+import metrics
+import startup
 
-s3 = boto3.client('s3')
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', 8))
+
+s3 = startup.client('s3')
+# One keep-alive connection pool to Wikipedia, shared by every fetch worker
+http = requests.Session()
+http.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=FETCH_WORKERS))
 BUCKET_NAME = 'tasty-kfc-bucket'
 WIKIPEDIA_FILE_KEY = 'wikipedia.txt'
+SEGMENT_PREFIX = 'wikipedia/segments/'
+# Segments younger than this are left for the next compaction, so a slow in-flight put is never skipped
+COMPACTION_GRACE_SECONDS = int(os.environ.get('COMPACTION_GRACE_SECONDS', 60))
+DELETE_BATCH_SIZE = 1000
+COMPACTION_ATTEMPTS = 5
+SUMMARY_URL = 'https://en.wikipedia.org/api/rest_v1/page/summary/{}'
+CACHE_PREFIX = 'wikipedia/cache/'
+CACHE_TTL_SECONDS = int(os.environ.get('CACHE_TTL_SECONDS', 3600))
+MEMORY_CACHE_SIZE = int(os.environ.get('MEMORY_CACHE_SIZE', 256))
 
-TELEGRAM_BOT_TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
-TELEGRAM_CHAT_ID = os.environ['TELEGRAM_CHAT_ID']
+# topic -> {"summary", "etag", "fetched_at"}, kept across warm invocations of this container
+memory_cache = OrderedDict()
+cache_lock = threading.Lock()
 
 """ test devops goofy niv, devops goofy """
 
-def send_telegram_message(message):
-    """ Send a notification to Telegram """
+def append_summaries(summaries):
+    """ Store a batch of (topic, summary) pairs as one immutable segment object, so appends never rewrite the log """
+    segment_key = f"{SEGMENT_PREFIX}{time.time_ns():020d}-{uuid.uuid4().hex}.txt"
+    body = ''.join(f'\n\n{topic}:\n{summary}' for topic, summary in summaries)
+    with metrics.stage('append'):
+        s3.put_object(Bucket=BUCKET_NAME, Key=segment_key, Body=body)
+    metrics.add('bytes_appended', len(body.encode('utf-8')))
+    return segment_key
+
+def list_segments():
+    """ All segment keys in append order (keys start with a zero-padded timestamp) """
+    paginator = s3.get_paginator('list_objects_v2')
+    keys = []
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=SEGMENT_PREFIX):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []))
+    return sorted(keys)
+
+def delete_keys(keys):
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[i:i + DELETE_BATCH_SIZE]
+        s3.delete_objects(
+            Bucket=BUCKET_NAME,
+            Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+        )
+
+def compact_once():
+    """ One compaction pass, returning the number of segments merged,
+    or None if another compaction replaced the consolidated file meanwhile """
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        payload = {"chat_id": TELEGRAM_CHAT_ID, "text": message}
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to send Telegram notification: {e}")
+        s3_response = s3.get_object(Bucket=BUCKET_NAME, Key=WIKIPEDIA_FILE_KEY)
+        existing_content = s3_response['Body'].read().decode('utf-8')
+        last_segment = s3_response.get('Metadata', {}).get('last-segment', '')
+        # Only replace the version this merge was built on
+        condition = {'IfMatch': s3_response['ETag']}
+    except s3.exceptions.NoSuchKey:
+        existing_content = ''
+        last_segment = ''
+        condition = {'IfNoneMatch': '*'}
+
+    cutoff = f"{SEGMENT_PREFIX}{time.time_ns() - COMPACTION_GRACE_SECONDS * 10**9:020d}"
+    segments = [key for key in list_segments() if key < cutoff]
+    # Segments at or before last-segment were merged by a compaction that died before deleting them
+    merged = [key for key in segments if key <= last_segment]
+    pending = [key for key in segments if key > last_segment]
+
+    if pending:
+        contents = [existing_content]
+        for key in pending:
+            contents.append(s3.get_object(Bucket=BUCKET_NAME, Key=key)['Body'].read().decode('utf-8'))
+        try:
+            s3.put_object(
+                Bucket=BUCKET_NAME,
+                Key=WIKIPEDIA_FILE_KEY,
+                Body=''.join(contents),
+                Metadata={'last-segment': pending[-1]},
+                **condition
+            )
+        except s3.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                return None
+            raise
+    delete_keys(merged + pending)
+    return len(pending)
+
+def compact_segments():
+    """ Merge pending segments into the consolidated file, then delete them. Overlapping compactions
+    (a duplicate scheduled event, a manual run) can't overwrite each other's merge: the write is
+    conditional on the version read, and the loser starts over from the winner's file """
+    for _ in range(COMPACTION_ATTEMPTS):
+        compacted = compact_once()
+        if compacted is not None:
+            return compacted
+        metrics.add('compaction_conflicts')
+    raise RuntimeError(f"Compaction lost to concurrent compactions {COMPACTION_ATTEMPTS} times in a row")
+
+def new_cache_stats():
+    return {"memory_hits": 0, "s3_hits": 0, "revalidated": 0, "fetched": 0, "evictions": 0}
+
+def cache_key(topic):
+    return f"{CACHE_PREFIX}{quote(topic.strip().replace(' ', '_'), safe='')}.json"
+
+def is_fresh(entry):
+    return time.time() - entry["fetched_at"] < CACHE_TTL_SECONDS
+
+def count(stats, name):
+    with cache_lock:
+        stats[name] += 1
+
+def remember(topic, entry, stats):
+    """ Put an entry in the in-process LRU, evicting the least recently used ones """
+    with cache_lock:
+        memory_cache[topic] = entry
+        memory_cache.move_to_end(topic)
+        while len(memory_cache) > MEMORY_CACHE_SIZE:
+            memory_cache.popitem(last=False)
+            stats["evictions"] += 1
+
+def load_cached_entry(topic):
+    try:
+        s3_response = s3.get_object(Bucket=BUCKET_NAME, Key=cache_key(topic))
+        return json.loads(s3_response['Body'].read().decode('utf-8'))
+    except s3.exceptions.NoSuchKey:
+        return None
+
+def store_cached_entry(topic, entry):
+    s3.put_object(
+        Bucket=BUCKET_NAME,
+        Key=cache_key(topic),
+        Body=json.dumps(entry),
+        ContentType='application/json'
+    )
+
+def get_summary(topic, stats):
+    """ Summary for a topic from memory, then S3, then Wikipedia (revalidating stale entries by ETag).
+    Returns None when Wikipedia has no usable answer """
+    with cache_lock:
+        entry = memory_cache.get(topic)
+        if entry and is_fresh(entry):
+            memory_cache.move_to_end(topic)
+            stats["memory_hits"] += 1
+            return entry["summary"]
+
+    if entry is None:
+        entry = load_cached_entry(topic)
+        if entry and is_fresh(entry):
+            remember(topic, entry, stats)
+            count(stats, "s3_hits")
+            return entry["summary"]
+
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    with metrics.stage('wikipedia'):
+        response = http.get(SUMMARY_URL.format(topic), headers=headers, timeout=10)
+    if response.status_code == 304 and entry:
+        entry = dict(entry, fetched_at=time.time())
+        count(stats, "revalidated")
+    elif response.status_code == 200:
+        data = response.json()
+        entry = {
+            "summary": data.get('extract', 'No summary available.'),
+            "etag": response.headers.get('ETag'),
+            "fetched_at": time.time()
+        }
+        count(stats, "fetched")
+    else:
+        return None
 
+    remember(topic, entry, stats)
+    store_cached_entry(topic, entry)
+    return entry["summary"]
+
+def log_cache_stats(stats):
+    lookups = stats["memory_hits"] + stats["s3_hits"] + stats["revalidated"] + stats["fetched"]
+    hits = stats["memory_hits"] + stats["s3_hits"] + stats["revalidated"]
+    ratio = hits / lookups if lookups else 0.0
+    print(f"Summary cache: {stats}, hit ratio {ratio:.2f}, {len(memory_cache)} topics in memory")
+    for name, value in stats.items():
+        metrics.add(f"cache_{name}", value)
+
+def fetch_topic(topic, stats):
+    """ Fetch one topic, turning failures into an error entry instead of an exception """
+    start = time.monotonic()
+    try:
+        with metrics.stage('fetch'):
+            summary = get_summary(topic, stats)
+        error = None if summary is not None else f"Failed to fetch Wikipedia summary for {topic}."
+    except Exception as e:
+        summary, error = None, f"Error: {str(e)}"
+    return {
+        "topic": topic,
+        "summary": summary,
+        "error": error,
+        "elapsed_ms": round((time.monotonic() - start) * 1000, 1)
+    }
+
+def fetch_topics(topics, stats):
+    """ Fetch topics on a bounded thread pool; results are listed in completion order """
+    with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(topics))) as executor:
+        futures = [executor.submit(fetch_topic, topic, stats) for topic in topics]
+        return [future.result() for future in as_completed(futures)]
+
+def requested_topics(event):
+    """ Accept a single `topic`, a `topics` list, or both; blanks and duplicates are dropped """
+    topics = list(event.get('topics') or [])
+    if event.get('topic'):
+        topics.insert(0, event['topic'])
+    return list(dict.fromkeys(t.strip() for t in topics if isinstance(t, str) and t.strip()))
+
+# Run every 5 minutes by the get-info-compaction EventBridge rule (README setup step 10); nobody waits
+# on its result, so deliver its notifications before returning
+@flush_after(wait=DELIVERY_TIMEOUT)
+def compact():
+    try:
+        with metrics.stage('compact'):
+            compacted = compact_segments()
+        metrics.add('segments_compacted', compacted)
+        message = f"Compacted {compacted} segments into 's3://{BUCKET_NAME}/{WIKIPEDIA_FILE_KEY}'."
+        print(message)
+        return {"statusCode": 200, "body": message}
+    except Exception as e:
+        error_message = f"Compaction error: {str(e)}"
+        notify(error_message)
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'message': error_message})
+        }
+
+@metrics.instrumented
+@flush_after
 def lambda_handler(event, context):
-    topic = event.get('topic')
-    if not topic:
+    if event.get('action') == 'compact' or event.get('source') == 'aws.events':
+        return compact()
+
+    topics = requested_topics(event)
+    if not topics:
         error_message = "Topic is required"
-        send_telegram_message(error_message)
+        notify(error_message)
         return {
             'statusCode': 400,
             'body': json.dumps({'message': error_message})
         }
 
-    url = f'https://en.wikipedia.org/api/rest_v1/page/summary/{topic}'
+    stats = new_cache_stats()
     try:
-        response = requests.get(url)
-        if response.status_code != 200:
-            error_message = f"Failed to fetch Wikipedia summary for {topic}."
-            send_telegram_message(error_message)
+        results = fetch_topics(topics, stats)
+        log_cache_stats(stats)
+        fetched = sorted((r for r in results if r["summary"] is not None), key=lambda r: topics.index(r["topic"]))
+        failed = [r for r in results if r["summary"] is None]
+        if not fetched:
+            error_message = failed[0]["error"] if len(failed) == 1 else "Failed to fetch any of the Wikipedia summaries."
+            notify(error_message)
             return {
                 'statusCode': 500,
-                'body': json.dumps({'message': error_message})
+                'body': json.dumps({'message': error_message}),
+                'results': [{"topic": r["topic"], "status": "failed", "error": r["error"]} for r in failed]
             }
 
-        data = response.json()
-        summary = data.get('extract', 'No summary available.')
-
-        try:
-            s3_response = s3.get_object(Bucket=BUCKET_NAME, Key=WIKIPEDIA_FILE_KEY)
-            existing_content = s3_response['Body'].read().decode('utf-8')
-        except s3.exceptions.NoSuchKey:
-            existing_content = ''
-
-        updated_content = existing_content + f'\n\n{topic}:\n{summary}'
-
-        s3.put_object(Bucket=BUCKET_NAME, Key=WIKIPEDIA_FILE_KEY, Body=updated_content)
+        segment_key = append_summaries([(r["topic"], r["summary"]) for r in fetched])
 
-        success_message = f"File uploaded to S3 at 's3://{BUCKET_NAME}/{WIKIPEDIA_FILE_KEY}'."
-        send_telegram_message(success_message)
+        success_message = (
+            f"{len(fetched)} summaries appended as 's3://{BUCKET_NAME}/{segment_key}', "
+            f"merged into 's3://{BUCKET_NAME}/{WIKIPEDIA_FILE_KEY}' on the next compaction."
+        )
+        if failed:
+            success_message += f" Failed topics: {', '.join(r['topic'] for r in failed)}."
+        notify(success_message)
 
         return {
-            "statusCode": 200,
-            "body": success_message
+            "statusCode": 207 if failed else 200,
+            "body": success_message,
+            "results": [
+                {
+                    "topic": r["topic"],
+                    "status": "failed" if r["summary"] is None else "stored",
+                    "error": r["error"],
+                    "elapsed_ms": r["elapsed_ms"]
+                }
+                for r in results
+            ]
         }
 
     except Exception as e:
         error_message = f"Error: {str(e)}"
-        send_telegram_message(error_message)
+        notify(error_message)
         return {
             'statusCode': 500,
             'body': json.dumps({'message': error_message})
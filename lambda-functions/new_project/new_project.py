@@ -1,63 +1,197 @@
-import gitlab
+import json
 import os
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from notifier import flush_after, notify
+import idempotency
+import metrics
+import scaffold
+import startup
 
 GITLAB_URL = "https://gitlab.com"
-PRIVATE_TOKEN = os.environ['GITLAB_TOKEN']
-TELEGRAM_BOT_TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
-TELEGRAM_CHAT_ID = os.environ['TELEGRAM_CHAT_ID']
+BUCKET_NAME = 'tasty-kfc-bucket'
+PROJECT_WORKERS = int(os.environ.get('PROJECT_WORKERS', 4))
 
-def send_telegram_message(message):
-    """ Send a notification to Telegram """
+# Imported and connected on first use, then reused while the container stays warm
+gitlab = startup.module('gitlab')
+gl = startup.lazy('gitlab:client', lambda: gitlab.Gitlab(GITLAB_URL, private_token=startup.setting('GITLAB_TOKEN')))
+s3 = startup.client('s3')
+idempotency_store = idempotency.S3Store(s3, BUCKET_NAME)
+
+def manifest_etag(manifest_key):
+    """ The manifest object's current ETag, so an edited manifest is a new request; None if it's missing """
+    try:
+        return s3.head_object(Bucket=BUCKET_NAME, Key=manifest_key)['ETag']
+    except s3.exceptions.ClientError:
+        return None
+
+def request_key(event):
+    """ Everything that decides what gets created: the project specs, or the manifest's key and content """
+    if event.get('projects'):
+        return idempotency.derive_key('new_project', event['projects'])
+    if event.get('manifest_key'):
+        return idempotency.derive_key('new_project', event['manifest_key'], manifest_etag(event['manifest_key']))
+    project_name = event.get('project_name')
+    if not project_name:
+        return None
+    return idempotency.derive_key(
+        'new_project', project_name, event.get('template', scaffold.DEFAULT_TEMPLATE),
+        event.get('variables'), event.get('namespace_id')
+    )
+
+def already_exists(error):
+    return error.response_code == 409 or 'already' in str(error.error_message)
+
+def create_or_find_project(spec):
+    """ Create the project, or adopt it if a previous run created it without recording it """
+    attributes = {'name': spec['project_name']}
+    if spec.get('namespace_id'):
+        attributes['namespace_id'] = spec['namespace_id']
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        payload = {"chat_id": TELEGRAM_CHAT_ID, "text": message}
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to send Telegram notification: {e}")
+        return gl.projects.create(attributes)
+    except gitlab.exceptions.GitlabCreateError as e:
+        if not already_exists(e):
+            raise
+        # Only a project this token is a member of, with exactly this name, in the requested namespace
+        for project in gl.projects.list(search=spec['project_name'], membership=True, get_all=True):
+            if project.name == spec['project_name'] and (
+                    not spec.get('namespace_id') or project.namespace['id'] == spec['namespace_id']):
+                return project
+        raise
+
+def provision_project(spec, steps, save=lambda: None):
+    """
+    Create the project, then push its whole rendered template as one commit: two GitLab calls
+    however many files the template has. Steps already in `steps` are skipped.
+    """
+    project_name = spec['project_name']
+    files = scaffold.render(spec.get('template', scaffold.DEFAULT_TEMPLATE), project_name, spec.get('variables'))
+    if 'project' not in steps:
+        with metrics.stage('gitlab_project'):
+            created = create_or_find_project(spec)
+        metrics.add('projects_created')
+        steps['project'] = {"project_id": created.id, "project_url": created.web_url}
+        save()
+    if 'scaffold' not in steps:
+        with metrics.stage('gitlab_scaffold'):
+            try:
+                gl.projects.get(steps['project']['project_id'], lazy=True).commits.create({
+                    'branch': 'main',
+                    'commit_message': f"Initial commit: scaffold {project_name}",
+                    'actions': scaffold.commit_actions(files)
+                })
+            except gitlab.exceptions.GitlabCreateError as e:
+                # An adopted project may already hold the scaffold from the run that created it
+                if not already_exists(e):
+                    raise
+        metrics.add('files_scaffolded', len(files))
+        steps['scaffold'] = {"files": len(files)}
+        save()
+    return steps
+
+def load_manifest(event):
+    """ Project specs from `projects`, or from a JSON manifest in S3 at `manifest_key` """
+    if event.get('projects'):
+        return event['projects']
+    body = s3.get_object(Bucket=BUCKET_NAME, Key=event['manifest_key'])['Body'].read().decode('utf-8')
+    manifest = json.loads(body)
+    return manifest['projects'] if isinstance(manifest, dict) else manifest
+
+def provision_projects(specs):
+    """ Provision every spec on a bounded pool, recording each project's steps under its name """
+    run = idempotency.current()
+    lock = threading.Lock()
+
+    def provision(spec):
+        name = spec['project_name']
+        with lock:
+            steps = dict(run.steps.get(name, {}))
+
+        def save():
+            with lock:
+                run.steps[name] = dict(steps)
+                run.save()
+
+        try:
+            provision_project(spec, steps, save)
+            return {"project_name": name, "status": "created", **steps['project']}
+        except Exception as e:
+            metrics.add('projects_failed')
+            error = getattr(e, 'error_message', None) or str(e)
+            return {"project_name": name, "status": "failed", "error": str(error)}
 
+    with ThreadPoolExecutor(max_workers=min(PROJECT_WORKERS, len(specs))) as executor:
+        return list(executor.map(provision, specs))
+
+def bulk_handler(event):
+    specs = load_manifest(event)
+    invalid = [f"#{i}" for i, spec in enumerate(specs) if not spec.get('project_name')]
+    if invalid:
+        error_message = f"project_name is required for every project; missing for: {', '.join(invalid)}"
+        notify(f"❌ Error: {error_message}")
+        return {"statusCode": 400, "message": error_message}
+    for spec in specs:
+        scaffold.render(spec.get('template', scaffold.DEFAULT_TEMPLATE), spec['project_name'], spec.get('variables'))
+
+    results = provision_projects(specs)
+    failed = [r for r in results if r['status'] == 'failed']
+    message = f"Created {len(results) - len(failed)} of {len(results)} projects."
+    if failed:
+        message += f" Failed: {', '.join(r['project_name'] for r in failed)}. Retry the same request to resume."
+    notify(f"{'✅' if not failed else '⚠️'} {message}")
+    return {"statusCode": 207 if failed else 200, "message": message, "results": results}
+
+@metrics.instrumented
+@flush_after
+@idempotency.idempotent(idempotency_store, request_key)
 def lambda_handler(event, context):
+    """
+    Create a GitLab project scaffolded from a template (`template`, default 'python') in one commit.
+    Pass `projects` (a list of {project_name, template, variables}) or `manifest_key` to create many.
+    A retry replays the result or resumes after the last completed step.
+    """
     try:
+        if event.get('projects') or event.get('manifest_key'):
+            return bulk_handler(event)
+
         project_name = event.get('project_name')
         if not project_name:
             error_message = "Project name is required."
-            send_telegram_message(f"❌ Error: {error_message}")
+            notify(f"❌ Error: {error_message}")
             return {"statusCode": 400, "message": error_message}
-        
-        gl = gitlab.Gitlab(GITLAB_URL, private_token=PRIVATE_TOKEN)
-        project = gl.projects.create({'name': project_name})
-        
-        readme_content = f"# {project_name}\n\nHello, World!"
-        project.files.create({
-            'file_path': 'README.md',
-            'branch': 'main',
-            'content': readme_content,
-            'commit_message': 'Initial commit: Add README.md'
-        })
-        
+
+        run = idempotency.current()
+        steps = provision_project(event, run.steps, run.save)
+        project = steps['project']
+
         success_message = (
             f"✅ Project '{project_name}' created successfully!\n"
-            f"📄 Project ID: {project.id}\n"
-            f"🌐 URL: {project.web_url}"
+            f"📄 Project ID: {project['project_id']}\n"
+            f"🌐 URL: {project['project_url']}"
         )
-        send_telegram_message(success_message)
-        
+        notify(success_message)
+
         return {
             "statusCode": 200,
             "message": success_message,
             "details": {
-                "project_id": project.id,
-                "project_url": project.web_url
+                "project_id": project['project_id'],
+                "project_url": project['project_url'],
+                "files": steps['scaffold']['files']
             }
         }
-    
+
+    except ValueError as e:
+        error_message = str(e)
+        notify(f"❌ Error: {error_message}")
+        return {"statusCode": 400, "message": error_message}
+
     except gitlab.exceptions.GitlabCreateError as e:
         error_message = f"GitLab API error: {e.error_message}"
-        send_telegram_message(f"❌ Error: {error_message}")
+        notify(f"❌ Error: {error_message}")
         return {"statusCode": 400, "message": error_message}
-    
+
     except Exception as e:
         error_message = f"An unexpected error occurred: {str(e)}"
-        send_telegram_message(f"❌ Error: {error_message}")
-        return {"statusCode": 500, "message": error_message}
\ No newline at end of file
+        notify(f"❌ Error: {error_message}")
+        return {"statusCode": 500, "message": error_message}
@@ -0,0 +1,77 @@
+""" Project templates, rendered into commit actions so a whole scaffold lands in one GitLab commit """
+import re
+from datetime import datetime
+
+PLACEHOLDER = re.compile(r'{{\s*(\w+)\s*}}')
+
+GITIGNORE = """__pycache__/
+*.py[cod]
+.venv/
+.env
+.pytest_cache/
+dist/
+*.egg-info/
+"""
+
+TEMPLATES = {
+    "readme": {
+        "README.md": "# {{ project_name }}\n\nHello, World!\n",
+    },
+    "python": {
+        "README.md": (
+            "# {{ project_name }}\n\n{{ description }}\n\n"
+            "## Setup\n\n```bash\npython3 -m venv .venv\nsource .venv/bin/activate\npip install -r requirements.txt\n```\n\n"
+            "## Run\n\n```bash\npython3 -m {{ package }}.main\n```\n"
+        ),
+        ".gitignore": GITIGNORE,
+        ".gitlab-ci.yml": (
+            "image: python:3.12-slim\n\n"
+            "stages:\n  - test\n\n"
+            "test:\n  stage: test\n  script:\n"
+            "    - pip install -r requirements.txt pytest\n"
+            "    - PYTHONPATH=src pytest -q\n"
+        ),
+        "requirements.txt": "",
+        "src/{{ package }}/__init__.py": "",
+        "src/{{ package }}/main.py": (
+            "def main():\n    print(\"Hello from {{ project_name }}!\")\n\n\n"
+            "if __name__ == \"__main__\":\n    main()\n"
+        ),
+        "tests/test_main.py": (
+            "from {{ package }}.main import main\n\n\n"
+            "def test_main(capsys):\n    main()\n    assert \"{{ project_name }}\" in capsys.readouterr().out\n"
+        ),
+    },
+}
+DEFAULT_TEMPLATE = "python"
+
+def package_name(project_name):
+    """ A valid Python package name for the project, e.g. 'My-App 2' -> 'my_app_2' """
+    name = re.sub(r'\W+', '_', project_name.strip().lower()).strip('_') or 'app'
+    return f"_{name}" if name[0].isdigit() else name
+
+def render_text(text, variables):
+    return PLACEHOLDER.sub(lambda m: str(variables.get(m.group(1), m.group(0))), text)
+
+def render(template_name, project_name, variables=None):
+    """ {path: content} for a template, with {{ placeholders }} filled in paths and contents """
+    if template_name not in TEMPLATES:
+        raise ValueError(f"Unknown template '{template_name}'; available: {', '.join(sorted(TEMPLATES))}")
+    context = {
+        "project_name": project_name,
+        "package": package_name(project_name),
+        "description": f"{project_name} project.",
+        "year": datetime.now().year,
+        **(variables or {}),
+    }
+    return {
+        render_text(path, context): render_text(content, context)
+        for path, content in TEMPLATES[template_name].items()
+    }
+
+def commit_actions(files):
+    """ Commits API actions creating every file in `files` """
+    return [
+        {"action": "create", "file_path": path, "content": content}
+        for path, content in sorted(files.items())
+    ]
@@ -1,47 +1,176 @@
 import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import metrics
 
-TELEGRAM_BOT_TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
-TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+TELEGRAM_API_URL = "https://api.telegram.org/bot{token}/sendMessage"
 
-def send_telegram_message(chat_id, message):
-    """ Sends a Telegram message to a specific chat ID """
+SEND_WORKERS = int(os.environ.get('SEND_WORKERS', 16))
+# Telegram allows ~30 messages/sec overall and ~1/sec per chat for bots; raise GLOBAL_RATE for paid broadcasts
+GLOBAL_RATE = float(os.environ.get('GLOBAL_RATE', 30))
+PER_CHAT_RATE = float(os.environ.get('PER_CHAT_RATE', 1))
+MAX_RETRIES = int(os.environ.get('MAX_RETRIES', 3))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8
+# API Gateway gives up after 29 seconds; stop starting new sends before that
+SEND_BUDGET_SECONDS = float(os.environ.get('SEND_BUDGET_SECONDS', 25))
+# A chat's bucket is dropped once unused this long and refilled, since a new one would behave the same
+CHAT_BUCKET_IDLE_SECONDS = float(os.environ.get('CHAT_BUCKET_IDLE_SECONDS', 60))
+
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=SEND_WORKERS))
+
+class TokenBucket:
+    """ Thread-safe token bucket; acquire() blocks until a token is free or the deadline would pass """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, deadline=None):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def idle(self, seconds):
+        """ Whether no token was taken for `seconds` and the bucket is full again """
+        with self.lock:
+            elapsed = time.monotonic() - self.updated
+            return elapsed >= seconds and self.tokens + elapsed * self.rate >= self.capacity
+
+    def pause(self, seconds):
+        """ Hold back every caller for `seconds`, e.g. after a 429 retry_after """
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+global_bucket = TokenBucket(GLOBAL_RATE)
+chat_buckets = OrderedDict()  # least recently used first, so idle buckets are evicted from the front
+chat_buckets_lock = threading.Lock()
+
+def chat_bucket(chat_id):
+    with chat_buckets_lock:
+        bucket = chat_buckets.pop(chat_id, None) or TokenBucket(PER_CHAT_RATE, capacity=1)
+        while chat_buckets and next(iter(chat_buckets.values())).idle(CHAT_BUCKET_IDLE_SECONDS):
+            chat_buckets.popitem(last=False)
+        chat_buckets[chat_id] = bucket
+        return bucket
+
+def backoff_delay(attempt):
+    """ Exponential backoff with full jitter """
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+def send_telegram_message(chat_id, message, deadline=None):
+    """ Sends a Telegram message to a specific chat ID, respecting rate limits and retrying transient failures """
     payload = {
         "chat_id": chat_id,
         "text": message,
     }
-    response = requests.post(TELEGRAM_API_URL, json=payload)
-    return response.json()
+    bucket = chat_bucket(chat_id)
+    result = {"ok": False, "description": "Not sent"}
+    for attempt in range(MAX_RETRIES + 1):
+        if not bucket.acquire(deadline) or not global_bucket.acquire(deadline):
+            if attempt:
+                return result
+            return {"ok": False, "unsent": True, "description": "Send budget exhausted before this contact was reached"}
+        try:
+            with metrics.stage('telegram'):
+                response = session.post(TELEGRAM_API_URL.format(token=os.environ['TELEGRAM_BOT_TOKEN']), json=payload, timeout=(3, 10))
+            result = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            result = {"ok": False, "description": str(e)}
+            delay = backoff_delay(attempt)
+        else:
+            if response.status_code == 429:
+                metrics.add('rate_limited')
+                delay = result.get("parameters", {}).get("retry_after", backoff_delay(attempt))
+                bucket.pause(delay)
+            elif response.status_code >= 500:
+                delay = backoff_delay(attempt)
+            else:
+                return result
+        if attempt == MAX_RETRIES or (deadline is not None and time.monotonic() + delay > deadline):
+            return result
+        metrics.add('retries')
+        time.sleep(delay)
+    return result
 
+def send_deadline(context):
+    """ Monotonic time after which no new send is started """
+    budget = SEND_BUDGET_SECONDS
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        budget = min(budget, context.get_remaining_time_in_millis() / 1000 - 1)
+    return time.monotonic() + budget
+
+@metrics.instrumented
 def lambda_handler(event, context):
     """
     Lambda handler to send Telegram messages to multiple contacts.
     Expects `contacts` and `message` from the HTML form via API Gateway.
+    Returns 207 with the `failed` and `unsent` contacts when not every message went out.
     """
     try:
         body = json.loads(event.get("body", "{}"))
         contacts = body.get("contacts", [])
         message = body.get("message", "")
-        
+
         if not contacts or not message:
             return {
                 "statusCode": 400,
                 "body": json.dumps({"error": "Contacts and message are required."})
             }
-        
-        results = []
-        for contact in contacts:
-            result = send_telegram_message(contact, message)
-            results.append({"contact": contact, "result": result})
-        
+
+        deadline = send_deadline(context)
+        with ThreadPoolExecutor(max_workers=min(SEND_WORKERS, len(contacts))) as executor:
+            sent = executor.map(lambda contact: send_telegram_message(contact, message, deadline), contacts)
+            # map() yields in input order, whatever order the sends finish in
+            results = [{"contact": contact, "result": result} for contact, result in zip(contacts, sent)]
+        # Unsent contacts were never tried because the send budget ran out; failed ones were tried and refused
+        unsent = [r["contact"] for r in results if r["result"].get("unsent")]
+        failed = [r["contact"] for r in results if not r["result"].get("ok") and not r["result"].get("unsent")]
+        delivered = len(results) - len(failed) - len(unsent)
+        metrics.add('messages_sent', delivered)
+        metrics.add('messages_failed', len(failed))
+        metrics.add('messages_unsent', len(unsent))
+
+        message = "Messages sent."
+        if failed or unsent:
+            message = (f"Sent {delivered} of {len(results)} messages: {len(failed)} failed, "
+                       f"{len(unsent)} not sent before the time budget ran out.")
         return {
-            "statusCode": 200,
-            "body": json.dumps({"message": "Messages sent.", "details": results})
+            "statusCode": 200 if not (failed or unsent) else 207,
+            "body": json.dumps({
+                "message": message,
+                "sent": delivered,
+                "failed": failed,
+                "unsent": unsent,
+                "details": results
+            })
         }
-    
+
     except Exception as e:
         return {
             "statusCode": 500,
             "body": json.dumps({"error": str(e)})
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,170 @@
+""" Idempotency keys for Lambdas that mutate external state.
+
+Each request key (client-supplied `idempotency_key`, or derived from the event) owns a record
+in a durable store with the outcome of every completed step and, once the handler succeeds,
+its response. A retry of a finished request replays the stored response without running the
+handler; a retry of a failed, partial (207) or interrupted one runs the handler again, and steps()
+hands it the recorded step results so it resumes from the first incomplete step.
+"""
+import contextvars
+import functools
+import hashlib
+import json
+import os
+import time
+import metrics
+
+TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+# An in-progress record older than this is treated as abandoned (the invocation died) and resumed
+LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', 900))
+
+_current = contextvars.ContextVar('idempotency_run', default=None)
+
+def derive_key(scope, *values):
+    body = json.dumps([scope, *values], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+class MemoryStore:
+    """ Records kept in this process, for tests and offline runs """
+
+    def __init__(self):
+        self.records = {}
+
+    def create(self, key, record):
+        """ Store `record` only if `key` has none yet; returns whether it was stored """
+        if key in self.records:
+            return False
+        self.records[key] = json.loads(json.dumps(record))
+        return True
+
+    def get(self, key):
+        record = self.records.get(key)
+        return json.loads(json.dumps(record)) if record else None
+
+    def put(self, key, record):
+        self.records[key] = json.loads(json.dumps(record))
+
+class S3Store:
+    """ Records as JSON objects in S3; the first write is conditional, so two invocations can't both claim a key """
+
+    def __init__(self, s3, bucket_name, prefix='idempotency/'):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def create(self, key, record):
+        try:
+            self.s3.put_object(IfNoneMatch='*', **self._object(key, record))
+            return True
+        except self.s3.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                return False
+            raise
+
+    def get(self, key):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket_name, Key=f"{self.prefix}{key}.json")
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(response['Body'].read().decode('utf-8'))
+
+    def put(self, key, record):
+        self.s3.put_object(**self._object(key, record))
+
+    def _object(self, key, record):
+        return {
+            'Bucket': self.bucket_name,
+            'Key': f"{self.prefix}{key}.json",
+            'Body': json.dumps(record),
+            'ContentType': 'application/json'
+        }
+
+class Run:
+    """ The record of one request key while its handler runs """
+
+    def __init__(self, store, key, record):
+        self.store = store
+        self.key = key
+        self.record = record
+
+    @property
+    def steps(self):
+        """ Results of the steps completed so far, by step name; mutate it and call save() """
+        return self.record['steps']
+
+    def save(self):
+        self.record['updated_at'] = time.time()
+        self.store.put(self.key, self.record)
+
+    def finish(self, response, status):
+        self.record.update(status=status, response=response if status == 'completed' else None)
+        self.save()
+
+class NoRun:
+    """ Stand-in when a handler runs without a key: steps are kept in memory only """
+
+    def __init__(self):
+        self.steps = {}
+
+    def save(self):
+        pass
+
+def current():
+    """ The running request's Run, or a NoRun when the handler isn't behind idempotent() """
+    return _current.get() or NoRun()
+
+def claim(store, key):
+    """ Returns (run, replay_response); exactly one of them is set, or neither if another invocation holds the key """
+    now = time.time()
+    record = {"status": "in_progress", "steps": {}, "response": None, "created_at": now, "updated_at": now}
+    if store.create(key, record):
+        return Run(store, key, record), None
+    existing = store.get(key) or record
+    age = now - existing.get('updated_at', 0)
+    if existing['status'] == 'completed' and now - existing.get('created_at', 0) < TTL_SECONDS and succeeded(existing['response']):
+        return None, existing['response']
+    if existing['status'] == 'in_progress' and age < LEASE_SECONDS:
+        return None, None
+    if existing['status'] == 'completed':
+        # Expired: the key may be reused for a brand new request
+        existing['steps'] = {}
+    existing.update(status="in_progress", response=None)
+    run = Run(store, key, existing)
+    run.save()
+    return run, None
+
+def succeeded(response):
+    """ Only a complete success is final; a 207 partial result must stay resumable """
+    return isinstance(response, dict) and response.get('statusCode', 200) == 200
+
+def idempotent(store, key_for):
+    """
+    Decorator for lambda_handler(event, context). key_for(event) returns the request key, or None
+    to run without idempotency (e.g. the event is invalid). Successful responses are stored and
+    replayed with "replayed": true (only 200s, not 207 partial results); anything else leaves the steps recorded for the retry to resume.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            key = event.get('idempotency_key') or key_for(event)
+            if not key:
+                return handler(event, context)
+            with metrics.stage('idempotency'):
+                run, replay = claim(store, key)
+            if replay is not None:
+                metrics.set_property('replayed', True)
+                return dict(replay, replayed=True)
+            if run is None:
+                return {"statusCode": 409, "message": "An identical request is already in progress."}
+            token = _current.set(run)
+            try:
+                response = handler(event, context)
+            except Exception:
+                run.finish(None, 'failed')
+                raise
+            finally:
+                _current.reset(token)
+            run.finish(response, 'completed' if succeeded(response) else 'failed')
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,138 @@
+""" Per-invocation timings and counters, emitted as one CloudWatch Embedded Metric Format line.
+
+@instrumented starts a record for each invocation; inside it, `with stage('upload'):` adds the
+block's duration to that stage and add('bytes_uploaded', n) adds to a counter. Stages and counters
+are summed across threads, so a stage run by a worker pool reports total work, not wall time.
+When the handler finishes, a single JSON line carrying the function name, correlation ID,
+cold-start flag, total duration and every stage and counter is printed; CloudWatch turns the
+listed fields into metrics and the rest stays searchable in Logs Insights.
+A Lambda container runs one invocation at a time, so the record is module state and worker
+threads need nothing passed to them.
+"""
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'AutomationLambdas')
+ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+CORRELATION_HEADER = 'X-Correlation-Id'
+
+_lock = threading.Lock()
+_record = None
+_cold_start = True
+
+def _unit(name):
+    if name.endswith('_ms'):
+        return 'Milliseconds'
+    if name.startswith('bytes'):
+        return 'Bytes'
+    return 'Count'
+
+def correlation_id_for(event, context):
+    """ The caller's correlation ID (payload field or HTTP header), else this invocation's request ID """
+    if isinstance(event, dict):
+        if event.get('correlation_id'):
+            return event['correlation_id']
+        headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+        if headers.get(CORRELATION_HEADER.lower()):
+            return headers[CORRELATION_HEADER.lower()]
+    return getattr(context, 'aws_request_id', None) or uuid.uuid4().hex
+
+def correlation_id():
+    return _record['correlation_id'] if _record else None
+
+class _Stage:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        add(f"{self.name}_ms", (time.perf_counter() - self.started) * 1000)
+        return False
+
+def stage(name):
+    """ Context manager adding the block's duration to `<name>_ms` """
+    return _Stage(name)
+
+def add(name, value=1):
+    """ Add to a counter (bytes_*, *_ms, or a plain count) of the running invocation; no-op outside one """
+    with _lock:
+        if _record is not None:
+            _record['values'][name] = _record['values'].get(name, 0) + value
+
+def set_property(name, value):
+    """ Attach a non-metric field (searchable, not aggregated) to this invocation's line """
+    if _record is not None:
+        _record['properties'][name] = value
+
+def emit(function_name, correlation_id, values, properties):
+    values = {name: round(value, 3) if isinstance(value, float) else value for name, value in values.items()}
+    line = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": NAMESPACE,
+                "Dimensions": [["FunctionName"]],
+                "Metrics": [{"Name": name, "Unit": _unit(name)} for name in values]
+            }]
+        },
+        "FunctionName": function_name,
+        "correlation_id": correlation_id,
+        **properties,
+        **values
+    }
+    print(json.dumps(line, default=str))
+
+def instrumented(handler):
+    """ Decorator for lambda_handler(event, context): time the invocation and emit its metrics line """
+    function_name = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', handler.__module__)
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _record, _cold_start
+        if not ENABLED:
+            return handler(event, context)
+        _record = {"correlation_id": correlation_id_for(event, context), "values": {}, "properties": {}}
+        cold_start, _cold_start = _cold_start, False
+        started = time.perf_counter()
+        status = None
+        try:
+            response = handler(event, context)
+            status = response.get('statusCode') if isinstance(response, dict) else None
+            return response
+        except Exception:
+            status = 'exception'
+            raise
+        finally:
+            with _lock:
+                record, _record = _record, None
+            record['values']['duration_ms'] = (time.perf_counter() - started) * 1000
+            emit(function_name, record['correlation_id'], record['values'],
+                 dict(record['properties'], cold_start=cold_start, status=status))
+    return wrapper
+
+class MeteredReader:
+    """ File-like wrapper adding read time to `<stage>_ms` and bytes read to `counter`, e.g. for S3 bodies """
+
+    def __init__(self, fileobj, stage_name='download', counter='bytes_downloaded'):
+        self._fileobj = fileobj
+        self._stage_name = stage_name
+        self._counter = counter
+
+    def read(self, *args):
+        with stage(self._stage_name):
+            data = self._fileobj.read(*args)
+        add(self._counter, len(data))
+        return data
+
+    def __iter__(self):
+        return iter(lambda: self.read(64 * 1024), b'')
+
+    def __getattr__(self, attribute):
+        return getattr(self._fileobj, attribute)
@@ -0,0 +1,118 @@
+""" Telegram notifications shared by every Lambda.
+
+Messages raised during an invocation are buffered by notify() and coalesced by flush()
+into a single message per chat, which a background thread delivers over a pooled
+keep-alive session with strict timeouts. Lambda freezes the container once a handler returns,
+and may never thaw it, so flush() waits for delivery: up to NOTIFY_WAIT_SECONDS, by default
+DELIVERY_TIMEOUT, the most one send can take. That costs one Telegram round trip when there is
+something to send and nothing otherwise. NOTIFY_WAIT_SECONDS=0 returns at once and leaves queued
+messages to the next thaw, if there is one; handlers whose result nobody waits on (S3 events,
+schedules) keep waiting anyway with @flush_after(wait=DELIVERY_TIMEOUT).
+"""
+import functools
+import os
+import queue
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+TELEGRAM_API_URL = "https://api.telegram.org/bot{token}/sendMessage"
+MAX_MESSAGE_LENGTH = 4096
+CONNECT_TIMEOUT = float(os.environ.get('NOTIFY_CONNECT_TIMEOUT', 2))
+READ_TIMEOUT = float(os.environ.get('NOTIFY_READ_TIMEOUT', 5))
+DELIVERY_TIMEOUT = CONNECT_TIMEOUT + READ_TIMEOUT
+FLUSH_WAIT_SECONDS = float(os.environ.get('NOTIFY_WAIT_SECONDS', DELIVERY_TIMEOUT))
+
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+def telegram_sink(chat_id, text):
+    """ Default sink: deliver a message through the Telegram Bot API """
+    url = TELEGRAM_API_URL.format(token=os.environ['TELEGRAM_BOT_TOKEN'])
+    response = session.post(url, json={"chat_id": chat_id, "text": text}, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+    response.raise_for_status()
+
+class MemorySink:
+    """ Local sink that keeps (chat_id, text) pairs in a list, for tests and offline runs """
+
+    def __init__(self):
+        self.messages = []
+
+    def __call__(self, chat_id, text):
+        self.messages.append((chat_id, text))
+
+_sink = telegram_sink
+_pending = {}  # chat_id -> messages raised since the last flush
+_pending_lock = threading.Lock()
+_outbox = queue.Queue()
+_in_flight = 0
+_in_flight_done = threading.Condition()
+_worker = None
+
+def set_sink(sink):
+    """ Replace where messages are delivered, e.g. with a MemorySink """
+    global _sink
+    _sink = sink
+
+def notify(message, chat_id=None):
+    """ Queue a message for this invocation; nothing is sent until flush() """
+    chat_id = chat_id or os.environ['TELEGRAM_CHAT_ID']
+    with _pending_lock:
+        _pending.setdefault(chat_id, []).append(message)
+
+def _split(text):
+    return [text[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(text), MAX_MESSAGE_LENGTH)]
+
+def _send_loop():
+    global _in_flight
+    while True:
+        chat_id, text = _outbox.get()
+        try:
+            _sink(chat_id, text)
+        except Exception as e:
+            print(f"Failed to send Telegram notification: {e}")
+        finally:
+            with _in_flight_done:
+                _in_flight -= 1
+                _in_flight_done.notify_all()
+
+def _ensure_worker():
+    global _worker
+    if _worker is None or not _worker.is_alive():
+        _worker = threading.Thread(target=_send_loop, name="notifier", daemon=True)
+        _worker.start()
+
+def flush(wait=None):
+    """ Coalesce queued messages into one per chat and hand them to the background sender.
+    Waits up to `wait` seconds (default NOTIFY_WAIT_SECONDS) for delivery """
+    global _in_flight
+    with _pending_lock:
+        batches = list(_pending.items())
+        _pending.clear()
+    for chat_id, messages in batches:
+        for text in _split("\n\n".join(messages)):
+            with _in_flight_done:
+                _in_flight += 1
+            _outbox.put((chat_id, text))
+    if batches:
+        _ensure_worker()
+    wait = FLUSH_WAIT_SECONDS if wait is None else wait
+    if wait > 0:
+        with _in_flight_done:
+            _in_flight_done.wait_for(lambda: _in_flight == 0, timeout=wait)
+
+def flush_after(handler=None, wait=None):
+    """ Decorator for lambda handlers: flush notifications once the handler returns or raises.
+    Use @flush_after(wait=DELIVERY_TIMEOUT) for asynchronously invoked handlers (S3 events, schedules) """
+    if handler is None:
+        return functools.partial(flush_after, wait=wait)
+
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            with metrics.stage('notify'):
+                flush(wait)
+    return wrapper
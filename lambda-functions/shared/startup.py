@@ -0,0 +1,83 @@
+""" Lazy construction of the heavy objects a Lambda needs, shared by every function.
+
+Module-level `s3 = startup.client('s3')` or `pd = startup.module('pandas')` costs nothing at
+import; the real client or module is built on first attribute access and then reused for
+every warm invocation. Validation failures and other early returns never pay for it.
+How long each first construction took is recorded, so cold-start cost shows up in logs
+and in benchmarks/cold_start.py rather than only in latency graphs.
+"""
+import importlib
+import os
+import threading
+import time
+
+_instances = {}
+_overrides = {}
+_timings = {}  # name -> seconds spent building it
+_lock = threading.RLock()
+
+def get(name, factory):
+    """ Build factory() once per container under `name` and return the cached instance """
+    if name in _overrides:
+        return _overrides[name]
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                started = time.perf_counter()
+                instance = _instances[name] = factory()
+                _timings[name] = time.perf_counter() - started
+    return instance
+
+class Lazy:
+    """ Stand-in that builds the real object on first attribute access """
+
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+
+    def __getattr__(self, attribute):
+        return getattr(get(self._name, self._factory), attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._name in _instances or self._name in _overrides else "not loaded"
+        return f"<lazy {self._name} ({state})>"
+
+def lazy(name, factory):
+    return Lazy(name, factory)
+
+def client(service, **config):
+    """ Lazy boto3 client; keyword arguments go to botocore's Config (e.g. max_pool_connections) """
+    def build():
+        import boto3
+        from botocore.config import Config
+        return boto3.client(service, config=Config(**config)) if config else boto3.client(service)
+    return Lazy(f"client:{service}", build)
+
+def module(module_name):
+    """ Lazy module import, for dependencies only some code paths need """
+    return Lazy(f"module:{module_name}", lambda: importlib.import_module(module_name))
+
+def setting(name, default=None):
+    """ Read an environment variable when it's needed, so a missing one fails the call, not the import """
+    value = os.environ.get(name, default)
+    if value is None:
+        raise KeyError(f"Environment variable {name} is not set")
+    return value
+
+def override(name, instance):
+    """ Serve `instance` instead of building `name`, e.g. a fake client in benchmarks """
+    _overrides[name] = instance
+
+def reset(name=None):
+    """ Forget built instances and overrides (all of them, or one), to simulate a cold container """
+    with _lock:
+        for registry in (_instances, _overrides, _timings):
+            if name is None:
+                registry.clear()
+            else:
+                registry.pop(name, None)
+
+def timings():
+    return dict(_timings)
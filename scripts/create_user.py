@@ -1,6 +1,12 @@
 import gitlab
 import gspread
+import json
 import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from oauth2client.service_account import ServiceAccountCredentials
 from dotenv import load_dotenv
 
@@ -11,6 +17,11 @@ GROUP_ID = os.getenv("GROUP_ID")
 GITLAB_TOKEN = os.getenv("GITLAB_SERVER_TOKEN")
 GOOGLE_SHEET_NAME = "Python script GitLab"
 CREDNTIALS = "credentials.json"
+CHECKPOINT_FILE = "create_user_checkpoint.json"
+WORKERS = int(os.getenv("PROVISION_WORKERS", 8))
+MAX_RETRIES = 4
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_MAX_SECONDS = 30
 
 def initialize_gitlab():
     return gitlab.Gitlab(GITLAB_URL, private_token=GITLAB_TOKEN)
@@ -27,47 +38,115 @@ def parse_google_sheet():
     employees = sheet.get_all_records()
     return employees
 
+def with_backoff(call):
+    """ Run a GitLab call, retrying rate limits (429) and server errors with jittered exponential backoff """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return call()
+        except gitlab.exceptions.GitlabError as e:
+            if attempt == MAX_RETRIES or not (e.response_code == 429 or (e.response_code or 0) >= 500):
+                raise
+            time.sleep(random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)))
+
+class Checkpoint:
+    """ Finished steps per username in a local JSON file, so a rerun skips what's already done """
+
+    def __init__(self, path=CHECKPOINT_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.states = json.load(f)
+        except FileNotFoundError:
+            self.states = {}
+
+    def state(self, username):
+        with self.lock:
+            return dict(self.states.get(username, {}))
+
+    def record(self, username, state):
+        with self.lock:
+            self.states[username] = state
+            # Write to a temp file and rename, so an interrupted run never leaves a truncated checkpoint
+            with open(f"{self.path}.tmp", "w") as f:
+                json.dump(self.states, f, indent=2)
+            os.replace(f"{self.path}.tmp", self.path)
+
+def already_exists(error):
+    return error.response_code == 409 or 'has already been taken' in str(error.error_message)
+
 def create_gitlab_user(gl, employee):
+    """ Create the user, or adopt it if a previous run created it without checkpointing it """
     try:
-        user = gl.users.create({
+        user = with_backoff(lambda: gl.users.create({
             'email': employee['Email'],
-            'password': employee['Password'],  
+            'password': employee['Password'],
             'username': employee['Username'],
             'name': employee['Name'],
-        })
-        print(f"User {employee['Username']} created successfully.")
-        return user
+        }))
     except gitlab.exceptions.GitlabCreateError as e:
-        print(f"Failed to create user {employee['Username']}: {e}")
-        return None
+        if not already_exists(e):
+            raise
+        existing = with_backoff(lambda: gl.users.list(username=employee['Username']))
+        # Only adopt our own earlier attempt, never someone else's account with the same username
+        if not existing or getattr(existing[0], 'email', None) != employee['Email']:
+            raise
+        print(f"User {employee['Username']} already exists, continuing with it.")
+        return existing[0].id
+    print(f"User {employee['Username']} created successfully.")
+    return user.id
 
-def add_user_to_group(gl, user):
+def add_user_to_group(group, user_id, username):
     try:
-        group = gl.groups.get(GROUP_ID)
-        group.members.create({'user_id': user.id, 'access_level': gitlab.const.AccessLevel.REPORTER})
-        print(f"User {user.username} added to group with Reporter role.")
+        with_backoff(lambda: group.members.create({'user_id': user_id, 'access_level': gitlab.const.AccessLevel.REPORTER}))
+        print(f"User {username} added to group with Reporter role.")
     except gitlab.exceptions.GitlabCreateError as e:
-        print(f"Failed to add user {user.username} to the group: {e}")
+        if not already_exists(e):
+            raise
 
-def create_user_repository(gl, user):
+def create_user_repository(gl, group, username):
+    project = with_backoff(lambda: gl.projects.create({
+        'name': username,
+        'namespace_id': group.id,
+    }))
+    print(f"Repository {project.name} created successfully in group {group.name}.")
+    return project.id
+
+def provision_employee(gl, group, checkpoint, employee):
+    """ Create the user, add it to the group and create its repository, skipping steps already checkpointed """
+    username = employee['Username']
+    state = checkpoint.state(username)
     try:
-        group = gl.groups.get(GROUP_ID) 
-        project = gl.projects.create({
-            'name': user.username,
-            'namespace_id': group.id,
-        })
-        print(f"Repository {project.name} created successfully in group {group.name}.")
-    except gitlab.exceptions.GitlabCreateError as e:
-        print(f"Failed to create repository for {user.username}: {e}")
+        if 'user_id' not in state:
+            state['user_id'] = create_gitlab_user(gl, employee)
+            checkpoint.record(username, state)
+        if not state.get('member'):
+            add_user_to_group(group, state['user_id'], username)
+            state['member'] = True
+            checkpoint.record(username, state)
+        if 'project_id' not in state:
+            state['project_id'] = create_user_repository(gl, group, username)
+            checkpoint.record(username, state)
+        return True
+    except gitlab.exceptions.GitlabError as e:
+        print(f"Failed to provision {username}: {e}")
+        return False
 
 def main():
     gl_client = initialize_gitlab()
+    group = gl_client.groups.get(GROUP_ID)  # resolved once for the whole cohort
+    checkpoint = Checkpoint()
     employees = parse_google_sheet()
-    for employee in employees:
-        user = create_gitlab_user(gl_client, employee)
-        if user:
-            add_user_to_group(gl_client, user)
-            create_user_repository(gl_client, user)
+    pending = [e for e in employees if not {'user_id', 'member', 'project_id'} <= checkpoint.state(e['Username']).keys()]
+    print(f"{len(employees) - len(pending)} of {len(employees)} employees already provisioned.")
+    if not pending:
+        return
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        futures = [executor.submit(provision_employee, gl_client, group, checkpoint, e) for e in pending]
+        succeeded = sum(1 for f in as_completed(futures) if f.result())
+    print(f"Provisioned {succeeded} of {len(pending)} employees; failures are retried on the next run.")
+    if succeeded < len(pending):
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,20 +1,103 @@
-import pandas as pd
+import json
 import os
 import sys
+from xlsxwriter.workbook import Workbook
 
-def convert_csv_to_excel(csv_file):
-    """ Converts a CSV file to an Excel file """
+# The csv_to_excel Lambda's type inference, so both convert the same CSV to the same cells
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda-functions', 'csv_to_excel'))
+from typed_columns import iter_typed_rows  # noqa: E402
+
+CHUNK_ROWS = 50000
+EXCEL_DATE_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_COLS = 16384
+
+class ExcelPart:
+    """ One .xlsx file, rolling rows over to new sheets and wide rows into column bands """
+
+    def __init__(self, excel_file, header):
+        self.excel_file = excel_file
+        self.header = header
+        self.workbook = Workbook(excel_file, {
+            'constant_memory': True,
+            'default_date_format': EXCEL_DATE_FORMAT,
+            'remove_timezone': True
+        })
+        self.rows = 0
+        self.sheets = 0
+        self.bands = []
+        self.sheet_row = EXCEL_MAX_ROWS
+
+    def sheet_full(self):
+        return self.sheet_row >= EXCEL_MAX_ROWS
+
+    def add_sheet(self):
+        self.sheets += 1
+        self.bands = []
+        self.sheet_row = 0
+        self._write(self.header)
+
+    def _write(self, row):
+        for start in range(0, max(len(row), 1), EXCEL_MAX_COLS):
+            band = start // EXCEL_MAX_COLS
+            while len(self.bands) <= band:
+                name = f"Sheet{self.sheets}" + (f" cols {len(self.bands) + 1}" if self.bands else "")
+                self.bands.append(self.workbook.add_worksheet(name))
+            self.bands[band].write_row(self.sheet_row, 0, row[start:start + EXCEL_MAX_COLS])
+        self.sheet_row += 1
+
+    def write_row(self, row):
+        self._write(row)
+        self.rows += 1
+
+    def close(self):
+        self.workbook.close()
+        return {"file": self.excel_file, "rows": self.rows, "sheets": self.sheets}
+
+def convert_csv_to_excel(csv_file, split_files=False):
+    """ Converts a CSV file to an Excel file, chunk by chunk with typed columns.
+    Rows beyond Excel's limits roll over to new sheets, or to <name>_partN.xlsx files with `split_files` """
     try:
         dir_name = os.path.dirname(csv_file)
         base_name = os.path.splitext(os.path.basename(csv_file))[0]
-        excel_file = os.path.join(dir_name, f"{base_name}.xlsx")       
-        pd.read_csv(csv_file).to_excel(excel_file, index=False)
-        print(f"Successfully converted '{csv_file}' to '{excel_file}'")
+        excel_file = os.path.join(dir_name, f"{base_name}.xlsx")
+        parts = []
+        part = None
+        with open(csv_file, newline='', encoding='utf-8') as source:
+            rows = iter_typed_rows(source, CHUNK_ROWS)
+            header = next(rows, None)
+            if header is not None:
+                part = ExcelPart(excel_file, header)
+            for row in rows:
+                if part.sheet_full():
+                    if split_files and part.sheets:
+                        parts.append(part.close())
+                        part_file = os.path.join(dir_name, f"{base_name}_part{len(parts) + 1}.xlsx")
+                        part = ExcelPart(part_file, part.header)
+                    part.add_sheet()
+                part.write_row(row)
+        if part is None:
+            print(f"'{csv_file}' has no rows; no Excel file written")
+            return
+        if not part.sheets:
+            # Header only: still write it, so the workbook shows the CSV's columns
+            part.add_sheet()
+        parts.append(part.close())
+        if len(parts) > 1:
+            manifest_file = os.path.join(dir_name, f"{base_name}_manifest.json")
+            with open(manifest_file, "w") as f:
+                json.dump({"source_file": csv_file, "parts": parts}, f, indent=2)
+            print(f"Successfully converted '{csv_file}' into {len(parts)} parts listed in '{manifest_file}'")
+        elif not parts[0]["rows"]:
+            print(f"'{csv_file}' has a header but no data rows; wrote a header-only '{excel_file}'")
+        else:
+            print(f"Successfully converted '{csv_file}' to '{excel_file}'")
     except Exception as e:
         print(f"Error: {e}")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python3 csv_to_excel.py <path/to/csv_file.csv>")
+    args = [arg for arg in sys.argv[1:] if arg != "--split-files"]
+    if len(args) != 1:
+        print("Usage: python3 csv_to_excel.py <path/to/csv_file.csv> [--split-files]")
     else:
-        convert_csv_to_excel(sys.argv[1])
+        convert_csv_to_excel(args[0], split_files="--split-files" in sys.argv)
@@ -1,9 +1,15 @@
+import json
 import os
 import sys
 import subprocess
 import gitlab
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+# The new_project Lambda's templates, so a project scaffolded here matches one created from the website
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda-functions', 'new_project'))
+import scaffold  # noqa: E402
+
 # Load environment variables
 load_dotenv()
 
@@ -11,6 +17,7 @@ GITLAB_URL = "https://gitlab.com"
 GITLAB_TOKEN = os.getenv("GITLAB_TOKEN")
 GITLAB_USERNAME = os.getenv("GITLAB_USERNAME")
 GITLAB_LOCAL_DIR = os.path.expanduser("~/GitLab/")
+PROJECT_WORKERS = 4
 
 if not GITLAB_TOKEN or not GITLAB_USERNAME:
     raise ValueError("GitLab token and username must be set in the .env file.")
@@ -21,42 +28,33 @@ def initialize_gitlab():
 
 def create_gitlab_project(gl_client, project_name):
     """Create a new project in GitLab."""
-    try:
-        project = gl_client.projects.create({'name': project_name})
-        print(f"Project '{project_name}' created in GitLab at: {project.web_url}")
-        return project
-    except gitlab.exceptions.GitlabCreateError as e:
-        print(f"Failed to create project in GitLab: {e}")
-        sys.exit(1)
-
-def create_local_folder(project_name):
-    """Create a local folder for the project."""
-    project_dir = os.path.join(GITLAB_LOCAL_DIR, project_name)
-    os.makedirs(project_dir, exist_ok=True)
-    print(f"Created or verified local directory: {project_dir}")
-    return project_dir
+    project = gl_client.projects.create({'name': project_name})
+    print(f"Project '{project_name}' created in GitLab at: {project.web_url}")
+    return project
 
-def create_readme(local_dir, project_name):
-    """Create a README file in the local project directory."""
-    readme_content = f"# {project_name}\n\nHello World from {project_name} project!"
-    readme_path = os.path.join(local_dir, "README.md")
-    with open(readme_path, "w") as readme_file:
-        readme_file.write(readme_content)
-    print(f"README file created at: {readme_path}")
+def push_scaffold(gitlab_project, project_name):
+    """Push the rendered template to GitLab as one commit through the commits API."""
+    files = scaffold.render(scaffold.DEFAULT_TEMPLATE, project_name)
+    gitlab_project.commits.create({
+        'branch': 'main',
+        'commit_message': 'Initial commit',
+        'actions': scaffold.commit_actions(files)
+    })
+    print(f"Pushed {len(files)} files to GitLab in one commit.")
 
-def push_to_gitlab(local_dir, git_url):
-    """Initialize a git repository, commit, and push the files to GitLab."""
-    try:
-        subprocess.run(["git", "init"], cwd=local_dir, check=True)
-        subprocess.run(["git", "add", "."], cwd=local_dir, check=True)
-        subprocess.run(["git", "commit", "-m", "Initial commit"], cwd=local_dir, check=True)
-        subprocess.run(["git", "branch", "-M", "main"], cwd=local_dir, check=True)
-        subprocess.run(["git", "remote", "add", "origin", git_url], cwd=local_dir, check=True)
-        subprocess.run(["git", "push", "-u", "origin", "main"], cwd=local_dir, check=True)
-        print(f"Successfully pushed to GitLab repository: {git_url}")
-    except subprocess.CalledProcessError as e:
-        print(f"Git error occurred: {e}")
-        sys.exit(1)
+def clone_project(local_dir, git_url):
+    """Clone the scaffolded project into the local directory, or pull if it is already a clone of it."""
+    if os.path.exists(local_dir):
+        remote = subprocess.run(
+            ["git", "-C", local_dir, "remote", "get-url", "origin"], capture_output=True, text=True
+        )
+        if remote.returncode != 0 or remote.stdout.strip() != git_url:
+            raise FileExistsError(f"{local_dir} exists and is not a clone of {git_url}")
+        subprocess.run(["git", "-C", local_dir, "pull", "--ff-only"], check=True)
+        print(f"Pulled {git_url} into existing clone {local_dir}")
+        return
+    subprocess.run(["git", "clone", git_url, local_dir], check=True)
+    print(f"Cloned {git_url} into {local_dir}")
 
 def open_in_vscode(local_dir):
     """Open the project folder in VS Code."""
@@ -66,26 +64,51 @@ def open_in_vscode(local_dir):
     except subprocess.CalledProcessError as e:
         print(f"Failed to open VS Code: {e}")
 
-def setup_gitlab_project(project_name):
-    """Complete setup for the GitLab project."""
+def setup_gitlab_project(project_name, gl_client=None, open_editor=True):
+    """Complete setup for the GitLab project; returns {"project_name", "ok", "error"} instead of exiting."""
+    try:
+        gl_client = gl_client or initialize_gitlab()
+
+        # Create project in GitLab and push the whole scaffold as one commit
+        gitlab_project = create_gitlab_project(gl_client, project_name)
+        push_scaffold(gitlab_project, project_name)
+
+        # Clone it locally (or update an existing clone) and open in VS Code
+        local_dir = os.path.join(GITLAB_LOCAL_DIR, project_name)
+        os.makedirs(GITLAB_LOCAL_DIR, exist_ok=True)
+        clone_project(local_dir, gitlab_project.http_url_to_repo)
+    except (gitlab.exceptions.GitlabError, subprocess.CalledProcessError, OSError) as e:
+        print(f"Failed to set up project '{project_name}': {e}")
+        return {"project_name": project_name, "ok": False, "error": str(e)}
+    if open_editor:
+        open_in_vscode(local_dir)
+    return {"project_name": project_name, "ok": True, "error": None}
+
+def setup_from_manifest(manifest_file):
+    """Create every project listed in a JSON manifest: ["name", ...] or {"projects": [{"project_name": ...}]}.
+    Returns one result per project; a failed project doesn't stop the others."""
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    entries = manifest["projects"] if isinstance(manifest, dict) else manifest
+    names = [entry if isinstance(entry, str) else entry["project_name"] for entry in entries]
     gl_client = initialize_gitlab()
-    
-    # Create project in GitLab
-    gitlab_project = create_gitlab_project(gl_client, project_name)
-    git_url = gitlab_project.http_url_to_repo
-    
-    # Set up local folder
-    local_dir = create_local_folder(project_name)
-    create_readme(local_dir, project_name)
-    
-    # Push to GitLab and open in VS Code
-    push_to_gitlab(local_dir, git_url)
-    open_in_vscode(local_dir)
+    with ThreadPoolExecutor(max_workers=PROJECT_WORKERS) as executor:
+        results = list(executor.map(lambda name: setup_gitlab_project(name, gl_client, open_editor=False), names))
+    failed = [r["project_name"] for r in results if not r["ok"]]
+    print(f"Created {len(names) - len(failed)} of {len(names)} projects from {manifest_file}")
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+    return results
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python3 new_project.py <project_name>")
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--manifest":
+        results = setup_from_manifest(sys.argv[2])
+    elif len(sys.argv) == 2:
+        results = [setup_gitlab_project(sys.argv[1])]
+    else:
+        print("Usage: python3 new_project.py <project_name> | --manifest <projects.json>")
         sys.exit(1)
-    
-    project_name = sys.argv[1]
-    setup_gitlab_project(project_name)
\ No newline at end of file
+    sys.exit(0 if all(r["ok"] for r in results) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+""" Shared setup of the tests: the Lambdas' environment and import paths, and the in-process fakes in benchmarks/fakes.py.
+
+The Lambda directories are imported flat, as in the deployed zips, so every one of them goes on sys.path.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "lambda-functions")
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:test")
+os.environ.setdefault("TELEGRAM_CHAT_ID", "0")
+os.environ.setdefault("ADMIN_CHAT_ID", "0")
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+for path in [os.path.join(ROOT, "benchmarks")] + [os.path.join(LAMBDA_DIR, name) for name in ["shared"] + sorted(os.listdir(LAMBDA_DIR))]:
+    if os.path.isdir(path) and path not in sys.path:
+        sys.path.append(path)
+
+@pytest.fixture
+def env():
+    """ Fresh fake S3, HTTP and GitLab, wired into the Lambdas' shared clients; notifications are kept in memory """
+    import fakes
+    return fakes.Env()
@@ -0,0 +1,46 @@
+""" Multipart server-side copies of the backup Lambda, against the in-process fakes in benchmarks/fakes.py.
+
+    python3 -m pytest tests
+"""
+import pytest
+from botocore.exceptions import ClientError
+
+import backup
+
+BUCKET = "test-bucket"
+SOURCE_KEY = "files_to_backup/report.pdf"
+TARGET_KEY = "backups/01-01-2025/report.pdf"
+
+@pytest.fixture
+def s3(env, monkeypatch):
+    s3 = env.s3
+    monkeypatch.setattr(backup, "COPY_PART_SIZE", 4)
+    s3.put_object(Bucket=BUCKET, Key=SOURCE_KEY, Body=b"0123456789", ContentType='application/pdf', Metadata={'owner': 'ops'})
+    return s3
+
+def test_large_copy_keeps_content_type_and_metadata(s3):
+    etag = s3.head_object(Bucket=BUCKET, Key=SOURCE_KEY)["ETag"]
+    backup.copy_large_object(BUCKET, SOURCE_KEY, TARGET_KEY, 10, etag)
+    copy = s3.get_object(Bucket=BUCKET, Key=TARGET_KEY)
+    assert copy["Body"].read() == b"0123456789"
+    assert copy["Metadata"] == {'owner': 'ops'}
+    assert s3.head_object(Bucket=BUCKET, Key=TARGET_KEY)["ContentType"] == 'application/pdf'
+
+def test_large_copy_fails_when_the_source_changed_since_listing(s3):
+    listed_etag = s3.head_object(Bucket=BUCKET, Key=SOURCE_KEY)["ETag"]
+    s3.put_object(Bucket=BUCKET, Key=SOURCE_KEY, Body=b"abcdefghij")
+    with pytest.raises(ClientError):
+        backup.copy_large_object(BUCKET, SOURCE_KEY, TARGET_KEY, 10, listed_etag)
+    assert (BUCKET, TARGET_KEY) not in s3.objects
+    assert not s3.uploads
+
+def test_retention_is_a_dry_run_until_enabled(env, monkeypatch):
+    s3 = env.s3
+    monkeypatch.setattr(backup, "KEEP_DAILY", 0)
+    monkeypatch.setattr(backup, "KEEP_WEEKLY", 0)
+    monkeypatch.setattr(backup, "KEEP_MONTHLY", 0)
+    old_key = f"{backup.BACKUP_PREFIX}01-01-2020/report.pdf"
+    s3.put_object(Bucket="tasty-kfc-bucket", Key=old_key, Body=b"old")
+    response = backup.lambda_handler({}, None)
+    assert "Dry run: would delete 1 backup objects" in response["body"]
+    assert ("tasty-kfc-bucket", old_key) in s3.objects
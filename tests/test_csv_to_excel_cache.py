@@ -0,0 +1,39 @@
+""" Conversion cache of the csv_to_excel Lambda, against the in-process fakes in benchmarks/fakes.py.
+
+    python3 -m pytest tests
+"""
+import csv_to_excel
+
+BUCKET = "test-bucket"
+SOURCE_KEY = "csv/report.csv"
+
+def csv_body(rows):
+    return "id,name\n" + "".join(f"{i},name {i}\n" for i in range(rows))
+
+def upload_and_convert(s3, body):
+    s3.seed(BUCKET, SOURCE_KEY, body)
+    return csv_to_excel.convert_object("1", BUCKET, SOURCE_KEY)["status"]
+
+def test_reupload_does_not_reuse_an_older_split_conversion(env, monkeypatch):
+    s3 = env.s3
+    monkeypatch.setattr(csv_to_excel, "SPLIT_MODE", "files")
+    monkeypatch.setattr(csv_to_excel, "ROWS_PER_SHEET", 1000)
+    large, small = csv_body(3000), csv_body(10)
+
+    # A is split into parts with a manifest, B fits in one object
+    assert upload_and_convert(s3, large) == "converted"
+    assert (BUCKET, "converted/report_manifest.json") in s3.objects
+    assert (BUCKET, "converted/report_part2.xlsx") in s3.objects
+    assert upload_and_convert(s3, small) == "converted"
+    assert (BUCKET, "converted/report_manifest.json") not in s3.objects
+    assert (BUCKET, "converted/report_part2.xlsx") not in s3.objects
+
+    # A again: only B's single object is left, so A is converted afresh instead of served from A's old parts
+    assert upload_and_convert(s3, large) == "converted"
+    assert upload_and_convert(s3, large) == "cached"
+
+def test_file_within_the_sheet_limits_stays_one_workbook(env):
+    s3 = env.s3
+    assert upload_and_convert(s3, csv_body(3000)) == "converted"
+    assert (BUCKET, "converted/report.xlsx") in s3.objects
+    assert (BUCKET, "converted/report_manifest.json") not in s3.objects
@@ -0,0 +1,28 @@
+""" Compaction of the get_info Lambda's segments, against the in-process fakes in benchmarks/fakes.py.
+
+    python3 -m pytest tests
+"""
+import get_info
+
+def test_overlapping_compactions_keep_every_segment(env, monkeypatch):
+    s3 = env.s3
+    monkeypatch.setattr(get_info, "COMPACTION_GRACE_SECONDS", 0)
+    bucket = get_info.BUCKET_NAME
+    s3.seed(bucket, get_info.WIKIPEDIA_FILE_KEY, "base")
+    s3.seed(bucket, f"{get_info.SEGMENT_PREFIX}{1:020d}.txt", " one")
+    s3.seed(bucket, f"{get_info.SEGMENT_PREFIX}{2:020d}.txt", " two")
+    put_object = s3.put_object
+    overlapped = []
+
+    def put_after_another_compaction(**kwargs):
+        # A second compaction starts from the same file, sees one more segment and finishes first
+        if not overlapped:
+            overlapped.append(True)
+            s3.seed(bucket, f"{get_info.SEGMENT_PREFIX}{3:020d}.txt", " three")
+            get_info.compact_segments()
+        return put_object(**kwargs)
+
+    monkeypatch.setattr(s3, "put_object", put_after_another_compaction)
+    get_info.compact_segments()
+    assert s3.get_object(Bucket=bucket, Key=get_info.WIKIPEDIA_FILE_KEY)["Body"].read() == b"base one two three"
+    assert get_info.list_segments() == []
@@ -0,0 +1,73 @@
+""" Idempotency of the GitLab Lambdas, against the in-process fakes in benchmarks/fakes.py.
+
+    python3 -m pytest tests
+"""
+import fakes
+import idempotency
+
+def test_succeeded_only_for_200():
+    assert idempotency.succeeded({"statusCode": 200})
+    assert not idempotency.succeeded({"statusCode": 207})
+    assert not idempotency.succeeded({"statusCode": 400})
+
+def test_claim_does_not_replay_a_stored_partial_result():
+    store = idempotency.MemoryStore()
+    run, _ = idempotency.claim(store, "key")
+    run.finish({"statusCode": 207}, 'completed')
+    run, replay = idempotency.claim(store, "key")
+    assert run is not None and replay is None
+
+def test_bulk_create_user_resumes_after_207(env):
+    gl = env.gl
+    import create_user
+    users = [
+        {"name": f"User {i}", "username": f"resume-{i}", "email": f"resume-{i}@example.com", "password": "password123"}
+        for i in range(2)
+    ]
+    event = {"users": users}
+    create_project = gl.projects.create
+
+    def failing_create(data):
+        if data['name'] == "User 1":
+            raise fakes.GitlabCreateError('Namespace is not ready', 400)
+        return create_project(data)
+
+    gl.projects.create = failing_create
+    first = create_user.lambda_handler(event, None)
+    assert first["statusCode"] == 207
+    assert first["counts"]["created"] == 1 and first["counts"]["failed"] == 1
+
+    gl.projects.create = create_project
+    second = create_user.lambda_handler(event, None)
+    assert "replayed" not in second
+    assert second["statusCode"] == 200
+    assert second["counts"] == {"created": 1, "skipped": 1, "failed": 0, "pending": 0}
+    # The user made by the first run is reused, not created again
+    assert len(gl.users.by_username) == 2
+
+    third = create_user.lambda_handler(event, None)
+    assert third["replayed"] is True and third["statusCode"] == 200
+
+def test_edited_manifest_is_a_new_request(env):
+    s3 = env.s3
+    import new_project
+    s3.seed(new_project.BUCKET_NAME, "m.json", '[{"project_name": "a"}]')
+    first = new_project.lambda_handler({"manifest_key": "m.json"}, None)
+    assert first["statusCode"] == 200
+
+    s3.seed(new_project.BUCKET_NAME, "m.json", '[{"project_name": "b"}, {"project_name": "c"}]')
+    second = new_project.lambda_handler({"manifest_key": "m.json"}, None)
+    assert "replayed" not in second
+    assert [r["project_name"] for r in second["results"]] == ["b", "c"]
+
+def test_single_project_retry_with_another_template_is_a_new_request(env):
+    import new_project
+    assert new_project.request_key({"project_name": "p"}) != new_project.request_key({"project_name": "p", "template": "readme"})
+
+def test_single_project_adopts_a_project_created_but_not_recorded(env):
+    gl = env.gl
+    import new_project
+    gl.projects.create({"name": "orphan"})  # made by a run that died before recording it
+    response = new_project.lambda_handler({"project_name": "orphan"}, None)
+    assert response["statusCode"] == 200
+    assert len(gl.projects.by_id) == 1
@@ -0,0 +1,45 @@
+""" Partial results of the send_whatsapp Lambda, against the in-process fakes in benchmarks/fakes.py.
+
+    python3 -m pytest tests
+"""
+import json
+
+import fakes
+import send_whatsapp
+
+class RefusingHTTP(fakes.FakeHTTP):
+    """ Telegram refuses chat 'blocked' with a 403, like a bot the user has blocked """
+
+    def post(self, url, json=None, timeout=None, **kwargs):
+        if json["chat_id"] == "blocked":
+            return fakes.FakeResponse(403, {"ok": False, "description": "Forbidden: bot was blocked by the user"})
+        return super().post(url, json=json, timeout=timeout, **kwargs)
+
+def send(monkeypatch, contacts, budget_seconds=25):
+    monkeypatch.setattr(send_whatsapp, "session", RefusingHTTP())
+    monkeypatch.setattr(send_whatsapp, "SEND_BUDGET_SECONDS", budget_seconds)
+    send_whatsapp.chat_buckets.clear()
+    response = send_whatsapp.lambda_handler({"body": json.dumps({"contacts": contacts, "message": "hi"})}, None)
+    return response["statusCode"], json.loads(response["body"])
+
+def test_all_sent_is_200(monkeypatch):
+    status, body = send(monkeypatch, ["1", "2"])
+    assert status == 200
+    assert body["sent"] == 2 and body["failed"] == [] and body["unsent"] == []
+
+def test_refused_and_unreached_contacts_are_207(monkeypatch):
+    # Chat '1' allows one message a second, so its second message can't start within the budget
+    status, body = send(monkeypatch, ["1", "blocked", "1"], budget_seconds=0.2)
+    assert status == 207
+    assert body["sent"] == 1
+    assert body["failed"] == ["blocked"]
+    assert body["unsent"] == ["1"]
+
+def test_idle_chat_buckets_are_evicted(monkeypatch):
+    monkeypatch.setattr(send_whatsapp, "CHAT_BUCKET_IDLE_SECONDS", 0)
+    send_whatsapp.chat_buckets.clear()
+    send_whatsapp.chat_bucket("idle")
+    send_whatsapp.chat_bucket("busy").acquire()
+    send_whatsapp.chat_bucket("new")
+    # 'busy' has not refilled since its message, so dropping it would let the chat's next one through early
+    assert list(send_whatsapp.chat_buckets) == ["busy", "new"]
@@ -0,0 +1,37 @@
+""" Type inference of the csv_to_excel conversion: typed cells only where Excel shows the same value.
+
+    python3 -m pytest tests
+"""
+import io
+
+import typed_columns
+
+def rows_of(text):
+    return list(typed_columns.iter_typed_rows(io.StringIO(text, newline=''), 1000))
+
+def test_values_that_would_change_stay_text():
+    header, first, second = rows_of(
+        "zip,phone,id,missing\n"
+        "00123,+15551234567,12345678901234567890,NA\n"
+        "02134,+15551234568,12345678901234567891,null\n"
+    )
+    assert header == ['zip', 'phone', 'id', 'missing']
+    assert first == ('00123', '+15551234567', '12345678901234567890', 'NA')
+    assert second == ('02134', '+15551234568', '12345678901234567891', 'null')
+
+def test_numbers_bools_and_dates_are_typed_and_blanks_empty():
+    _, first, second = rows_of("n,f,flag,day\n7,1.5,true,2024-01-02\n,0.25,False,2024-01-03\n")
+    assert first[:3] == (7, 1.5, True) and first[3].year == 2024
+    assert second[:3] == (None, 0.25, False)
+
+def test_ragged_rows_and_headers_are_kept_as_written():
+    header, short, extra, more = rows_of("a,a\n1\n1,2,3\n4,5,6,7\n")
+    assert header == ['a', 'a']
+    assert short == (1,)
+    assert extra == (1, 2, 3)
+    assert more == (4, 5, 6, 7)
+
+def test_out_of_range_numbers_stay_text():
+    _, first, second = rows_of("big,n\n1e400,1e5\n2,2\n")
+    assert first == ('1e400', 100000.0)
+    assert second == ('2', 2.0)
@@ -1,17 +1,144 @@
-import boto3
 import os
-import requests
+import re
 import json
-from flask import Flask, render_template, request, jsonify
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context, url_for
+from coalesce import CoalescingInvoker
+from gateway import AwsClient, CircuitOpenError, HttpGateway, aws_client
+from jobs import JobRunner, MemoryJobStore, S3JobStore
+import request_metrics
+import uploads
 
 app = Flask(__name__)
+request_metrics.init_app(app)
 
 API_GATEWAY_URL = "https://mr32irnm08.execute-api.eu-central-1.amazonaws.com/prod/send-message"
-lambda_client = boto3.client('lambda')
-s3 = boto3.client('s3')
+INVOKE_WORKERS = int(os.environ.get('INVOKE_WORKERS', 8))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 8))
+# Threads the async server (asgi.py) runs blocking boto3 and HTTP calls on, per worker process
+BLOCKING_WORKERS = int(os.environ.get('BLOCKING_WORKERS', 64))
+# Every outbound call goes through these: pooled connections, timeouts, retries and a circuit breaker.
+# API Gateway gives up on an integration after 29s, so waiting longer than 30s gains nothing
+# Enough pooled connections for every invoke, job and blocking-call thread at once; a synchronous invoke
+# can run for the Lambda's whole 15 minute limit, and is retried once at most since it may not be idempotent
+POOL_SIZE = INVOKE_WORKERS + JOB_WORKERS + BLOCKING_WORKERS
+api_gateway = HttpGateway('api_gateway', timeout=(3.05, 30), pool_size=POOL_SIZE)
+# LAMBDA_INVOKER=local runs the handlers from lambda-functions/ in a warm local process pool instead
+if os.environ.get('LAMBDA_INVOKER', 'aws') == 'local':
+    from invoker import LocalLambdaClient
+    lambda_client = AwsClient('lambda', LocalLambdaClient())
+else:
+    lambda_client = aws_client('lambda', pool_size=POOL_SIZE, read_timeout=900, max_attempts=2)
+s3 = aws_client('s3', pool_size=POOL_SIZE)
 BUCKET_NAME = 'sharon088-lambdas-bucket'
 CSV_PREFIX = 'csv/'
 CONVERTED_PREFIX = 'converted/'
+BACKUP_PREFIX = 'files_to_backup/'
+UPLOAD_PREFIXES = {'csv': CSV_PREFIX, 'backup': BACKUP_PREFIX}
+WIKIPEDIA_BATCH_SIZE = int(os.environ.get('WIKIPEDIA_BATCH_SIZE', 25))
+invoke_executor = ThreadPoolExecutor(max_workers=INVOKE_WORKERS)
+# JOB_MODE=async makes the Lambda-backed routes return a job ID by default; ?mode=async/sync overrides per request
+JOB_MODE = os.environ.get('JOB_MODE', 'sync')
+JOB_STORE = os.environ.get('JOB_STORE', 'memory')  # 'memory' for a single web worker, 's3' to share across workers
+job_store = S3JobStore(s3, BUCKET_NAME) if JOB_STORE == 's3' else MemoryJobStore()
+job_runner = JobRunner(job_store, max_workers=JOB_WORKERS)
+
+class LambdaFunctionError(Exception):
+    """ The function was invoked but raised, timed out or crashed: the invoke response has FunctionError """
+
+def call_lambda(function_name, payload):
+    """ Invoke a Lambda synchronously, returning its invoke status code and decoded payload; raises LambdaFunctionError """
+    # Added here, after coalescing has keyed the payload, so the ID never splits identical requests;
+    # a coalesced follower's ID doesn't reach the Lambda, the leader's does
+    if request_metrics.correlation_id():
+        payload = dict(payload, correlation_id=request_metrics.correlation_id())
+    with request_metrics.stage(f"lambda_{function_name}"):
+        response = lambda_client.invoke(
+            FunctionName=function_name,
+            InvocationType="RequestResponse",
+            Payload=json.dumps(payload)
+        )
+        body = response['Payload'].read()
+    request_metrics.add('lambda_invocations')
+    request_metrics.add('bytes_from_lambda', len(body))
+    response_payload = json.loads(body.decode('utf-8'))
+    # StatusCode is 200 even when the handler failed; the error is in FunctionError and the payload
+    if response.get('FunctionError'):
+        request_metrics.add('lambda_function_errors')
+        error = response_payload if isinstance(response_payload, dict) else {}
+        raise LambdaFunctionError(f"{function_name} failed with {error.get('errorType', response['FunctionError'])}: {error.get('errorMessage', '')}")
+    return response['StatusCode'], response_payload
+
+def lambda_succeeded(status_code, response_payload):
+    """ The invoke succeeded and so did the handler, by the statusCode it returned """
+    return status_code == 200 and response_payload.get('statusCode', 200) < 400
+
+# Identical concurrent invocations share one call. Results are cached only for the functions listed
+# in CACHEABLE_FUNCTIONS, none by default: every handler has side effects (get_info appends each
+# summary it fetches to wikipedia.txt), so serving a repeat from the cache would skip them
+invoke_lambda = CoalescingInvoker(
+    call_lambda,
+    cacheable=[f.strip() for f in os.environ.get('CACHEABLE_FUNCTIONS', '').split(',') if f.strip()],
+    ttl_seconds=int(os.environ.get('LAMBDA_CACHE_TTL', 30)),
+    max_entries=int(os.environ.get('LAMBDA_CACHE_SIZE', 256))
+)
+
+def wants_job(data, args):
+    mode = args.get('mode') or (data or {}).get('mode') or JOB_MODE
+    return mode == 'async'
+
+def run_result(fn, *args):
+    """ fn(*args) -> (body, status), with a failed call turned into an error response """
+    try:
+        return fn(*args)
+    except CircuitOpenError as e:
+        return {"status": "error", "message": f"Service temporarily unavailable: {str(e)}"}, 503
+    except Exception as e:
+        return {"status": "error", "message": f"Failed to invoke Lambda: {str(e)}"}, 500
+
+def respond(data, fn, *args):
+    """ Run fn(*args) -> (body, status) now, or hand it to the job runner and return its job ID """
+    if wants_job(data, request.args):
+        job_id = job_runner.submit(request_metrics.propagate(fn), *args)
+        return jsonify({
+            "status": "accepted",
+            "job_id": job_id,
+            "status_url": url_for('job_status', job_id=job_id)
+        }), 202
+    body, status = run_result(fn, *args)
+    return jsonify(body), status
+
+def parse_topics(data):
+    """ Topics from `topic` and/or `topics` (a list, or a comma/newline separated string) """
+    topics = data.get('topics') or []
+    if isinstance(topics, str):
+        topics = re.split(r'[\n,]', topics)
+    if data.get('topic'):
+        topics = [data['topic']] + list(topics)
+    return list(dict.fromkeys(t.strip() for t in topics if isinstance(t, str) and t.strip()))
+
+def stream_topic_results(topics):
+    """ Yield one NDJSON line per topic as each get_info batch invocation completes """
+    batches = [topics[i:i + WIKIPEDIA_BATCH_SIZE] for i in range(0, len(topics), WIKIPEDIA_BATCH_SIZE)]
+    invoke = request_metrics.propagate(invoke_lambda)
+    futures = {invoke_executor.submit(invoke, "get_info", {"topics": batch}): batch for batch in batches}
+    for future in as_completed(futures):
+        try:
+            _, response_payload = future.result()
+            results = response_payload.get('results') or [
+                {"topic": topic, "status": "failed", "error": response_payload.get('body')} for topic in futures[future]
+            ]
+        except Exception as e:
+            results = [
+                {"topic": topic, "status": "failed", "error": f"Failed to invoke Lambda: {str(e)}"}
+                for topic in futures[future]
+            ]
+        for result in results:
+            yield json.dumps(result) + "\n"
+    yield json.dumps({
+        "status": "done",
+        "download_url": f"https://{BUCKET_NAME}.s3.eu-central-1.amazonaws.com/wikipedia.txt"
+    }) + "\n"
 
 @app.route('/')
 def index():
@@ -24,155 +151,276 @@ def send_message():
     message = request.form['message']
     if not contacts or not message:
         return jsonify({"error": "Contacts or message not provided"}), 400
+    body, status = send_message_result(contacts, message)
+    return jsonify(body), status
+
+def send_message_result(contacts, message):
     payload = {
         'contacts': contacts,
         'message': message
     }
     try:
-        response = requests.post(API_GATEWAY_URL, json=payload)
+        response = api_gateway.post(API_GATEWAY_URL, json=payload, headers={request_metrics.CORRELATION_HEADER: request_metrics.correlation_id() or ''})
         response_data = response.json()
         if response.status_code == 200:
-            return jsonify({"status": "success", "message": "Messages sent successfully!"}), 200
+            return {"status": "success", "message": "Messages sent successfully!"}, 200
+        elif response.status_code == 207:
+            # Some contacts failed or were never reached; sending again only to those is up to the user
+            return {
+                "status": "partial",
+                "message": response_data.get("message", "Some messages were not sent."),
+                "failed": response_data.get("failed", []),
+                "unsent": response_data.get("unsent", [])
+            }, 207
         else:
-            return jsonify({"status": "error", "message": response_data.get("message", "Error sending messages.")}), 500
+            return {"status": "error", "message": response_data.get("message", "Error sending messages.")}, 500
+    except CircuitOpenError as e:
+        return {"status": "error", "message": f"Messaging is temporarily unavailable: {str(e)}"}, 503
     except Exception as e:
-        return jsonify({"status": "error", "message": f"Failed to connect to API: {str(e)}"}), 500
-    
+        return {"status": "error", "message": f"Failed to connect to API: {str(e)}"}, 500
+
+def uploaded_file(files, field):
+    """ The uploaded file in `field`, or (None, error response) """
+    if field not in files:
+        return None, ({"status": "error", "message": "No file part"}, 400)
+    file = files[field]
+    if file.filename == '':
+        return None, ({"status": "error", "message": "No selected file"}, 400)
+    return file, None
+
 @app.route('/upload-csv', methods=['POST'])
 def upload_csv():
     """ Upload CSV file to S3 bucket, to be converted into Excel file """
-    if 'csv-file' not in request.files:
-        return jsonify({"status": "error", "message": "No file part"}), 400
-    file = request.files['csv-file']
-    if file.filename == '':
-        return jsonify({"status": "error", "message": "No selected file"}), 400
-    try:
-        file_key = f"{CSV_PREFIX}{file.filename}"
-        s3.upload_fileobj(file, BUCKET_NAME, file_key)
-        converted_key = f"converted/{os.path.splitext(file.filename)[0]}.xlsx"
-        download_url = f"https://{BUCKET_NAME}.s3.eu-central-1.amazonaws.com/{converted_key}"
-        return jsonify({
-            "status": "success",
-            "message": "File uploaded successfully and will be converted shortly.",
-            "download_url": download_url
-        })
-    except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+    file, error = uploaded_file(request.files, 'csv-file')
+    body, status = error or store_upload(file, f"{CSV_PREFIX}{file.filename}")
+    return jsonify(body), status
 
 @app.route('/wikipedia', methods=['POST'])
 def fetch_wikipedia_summary():
-    """ Get Wikipedia's topic from user to fetch its summary section"""
+    """ Get Wikipedia's topic (or list of topics) from user to fetch its summary section"""
     data = request.get_json()
-    topic = data.get('topic')   
-    if not topic:
+    topics = parse_topics(data)
+    if not topics:
         return jsonify({"status": "error", "message": "Topic is required"}), 400
-    lambda_payload = {"topic": topic}  
-    try:
-        response = lambda_client.invoke(
-            FunctionName="get_info",
-            InvocationType="RequestResponse",
-            Payload=json.dumps(lambda_payload)
-        )
-        response_payload = json.loads(response['Payload'].read().decode('utf-8'))
-        if response['StatusCode'] == 200:
-            return jsonify({
-                "status": "success",
-                "message": response_payload.get('body', 'Wikipedia summary fetched successfully!'),
-                "download_url": f"https://{BUCKET_NAME}.s3.eu-central-1.amazonaws.com/wikipedia.txt"
-            })
-        else:
-            return jsonify({
-                "status": "error",
-                "message": response_payload.get("message", "Failed to fetch summary")
-            }), 500
-    except Exception as e:
-        return jsonify({"status": "error", "message": f"Failed to invoke Lambda: {str(e)}"}), 500
+    if 'topics' in data:
+        return Response(stream_with_context(stream_topic_results(topics)), mimetype='application/x-ndjson')
+    return respond(data, wikipedia_summary_result, topics[0])
+
+def wikipedia_summary_result(topic):
+    status_code, response_payload = invoke_lambda("get_info", {"topic": topic})
+    if lambda_succeeded(status_code, response_payload):
+        return {
+            "status": "success",
+            "message": response_payload.get('body', 'Wikipedia summary fetched successfully!'),
+            "download_url": f"https://{BUCKET_NAME}.s3.eu-central-1.amazonaws.com/wikipedia.txt"
+        }, 200
+    else:
+        return {
+            "status": "error",
+            "message": response_payload.get("message", "Failed to fetch summary")
+        }, 500
     
 @app.route('/upload-backup', methods=['POST'])
 def upload_backup():
     """ Upload file to S3 bucket, to be backed up with Lambda and Cron """
-    if 'backup-file' not in request.files:
-        return jsonify({"status": "error", "message": "No file part"}), 400
-    file = request.files['backup-file']
-    if file.filename == '':
-        return jsonify({"status": "error", "message": "No selected file"}), 400
+    file, error = uploaded_file(request.files, 'backup-file')
+    body, status = error or store_upload(file, f"{BACKUP_PREFIX}{file.filename}")
+    return jsonify(body), status
+
+def store_upload(file, key):
+    """ Stream a file posted to the website into S3 """
     try:
-        file_key = f"files_to_backup/{file.filename}"
-        s3.upload_fileobj(file, BUCKET_NAME, file_key)
-        file_url = f"https://{BUCKET_NAME}.s3.eu-central-1.amazonaws.com/{file_key}"
-        return jsonify({
+        with request_metrics.stage('s3_upload'):
+            s3.upload_fileobj(file, BUCKET_NAME, key, ExtraArgs=upload_metadata())
+        return uploaded_file_response(key), 200
+    except Exception as e:
+        return {"status": "error", "message": str(e)}, 500
+
+def upload_metadata():
+    """ Object metadata tying an upload to this request, so the Lambda it triggers can log the same ID """
+    return {'Metadata': {'correlation-id': request_metrics.correlation_id()}} if request_metrics.correlation_id() else {}
+
+def upload_key(data):
+    """ The S3 key a direct upload may use: one of the upload prefixes plus a bare file name """
+    key = data.get('key', '')
+    if not any(key.startswith(prefix) for prefix in UPLOAD_PREFIXES.values()) or '/' in key.split('/', 1)[1]:
+        raise ValueError("Invalid upload key")
+    return key
+
+def uploaded_file_response(key):
+    """ Same response the proxying upload routes give once a file is in place """
+    if key.startswith(CSV_PREFIX):
+        converted_key = f"{CONVERTED_PREFIX}{os.path.splitext(key[len(CSV_PREFIX):])[0]}.xlsx"
+        return {
+            "status": "success",
+            "message": "File uploaded successfully and will be converted shortly.",
+            "download_url": f"https://{BUCKET_NAME}.s3.eu-central-1.amazonaws.com/{converted_key}"
+        }
+    return {
+        "status": "success",
+        "message": "File uploaded successfully!",
+        "file_url": f"https://{BUCKET_NAME}.s3.eu-central-1.amazonaws.com/{key}"
+    }
+
+@app.route('/uploads/initiate', methods=['POST'])
+def initiate_direct_upload():
+    """ Start a presigned multipart upload so the browser sends the file straight to S3 """
+    body, status = initiate_upload_result(request.get_json())
+    return jsonify(body), status
+
+def initiate_upload_result(data):
+    prefix = UPLOAD_PREFIXES.get(data.get('kind'))
+    filename = os.path.basename(data.get('filename') or '')
+    size = data.get('size')
+    if not prefix or not filename or not isinstance(size, int) or size < 0:
+        return {"status": "error", "message": "kind, filename and size are required"}, 400
+    try:
+        upload = uploads.initiate_upload(
+            s3, BUCKET_NAME, f"{prefix}{filename}", size, data.get('content_type'), upload_metadata().get('Metadata')
+        )
+        return {"status": "success", **upload}, 200
+    except Exception as e:
+        return {"status": "error", "message": str(e)}, 500
+
+@app.route('/uploads/parts', methods=['POST'])
+def resume_direct_upload():
+    """ Parts already uploaded plus fresh URLs for the rest, to resume an interrupted upload """
+    body, status = resume_upload_result(request.get_json())
+    return jsonify(body), status
+
+def resume_upload_result(data):
+    try:
+        key = upload_key(data)
+        done = uploads.uploaded_parts(s3, BUCKET_NAME, key, data['upload_id'])
+        done_numbers = {part['part_number'] for part in done}
+        missing = [n for n in data.get('part_numbers', []) if n not in done_numbers]
+        return {
             "status": "success",
-            "message": "File uploaded successfully!",
-            "file_url": file_url
-        })
+            "uploaded": done,
+            "parts": uploads.presign_parts(s3, BUCKET_NAME, key, data['upload_id'], missing)
+        }, 200
+    except (KeyError, ValueError) as e:
+        return {"status": "error", "message": str(e)}, 400
+    except Exception as e:
+        return {"status": "error", "message": str(e)}, 500
+
+@app.route('/uploads/complete', methods=['POST'])
+def complete_direct_upload():
+    """ Completion callback: stitch the uploaded parts into the final object """
+    body, status = complete_upload_result(request.get_json())
+    return jsonify(body), status
+
+def complete_upload_result(data):
+    try:
+        key = upload_key(data)
+        uploads.complete_upload(s3, BUCKET_NAME, key, data['upload_id'], data['parts'])
+        return uploaded_file_response(key), 200
+    except (KeyError, ValueError) as e:
+        return {"status": "error", "message": str(e)}, 400
+    except Exception as e:
+        return {"status": "error", "message": str(e)}, 500
+
+@app.route('/uploads/abort', methods=['POST'])
+def abort_direct_upload():
+    body, status = abort_upload_result(request.get_json())
+    return jsonify(body), status
+
+def abort_upload_result(data):
+    try:
+        uploads.abort_upload(s3, BUCKET_NAME, upload_key(data), data['upload_id'])
+        return {"status": "success", "message": "Upload aborted."}, 200
+    except (KeyError, ValueError) as e:
+        return {"status": "error", "message": str(e)}, 400
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+        return {"status": "error", "message": str(e)}, 500
 
 @app.route('/create-project', methods=['POST'])
 def create_gitlab_project():
     """ Create a new GitLab project using Lambda function """
-    try:
-        data = request.get_json()
-        project_name = data.get('project_name')
-        if not project_name:
-            return jsonify({"status": "error", "message": "Project name is required"}), 400
-        lambda_payload = {"project_name": project_name}
-        response = lambda_client.invoke(
-            FunctionName="new_project",
-            InvocationType="RequestResponse",
-            Payload=json.dumps(lambda_payload)
-        )
-        response_payload = json.loads(response['Payload'].read().decode('utf-8'))
-        if response['StatusCode'] == 200:
-            return jsonify({
-                "status": "success",
-                "message": response_payload.get('message', 'Project created successfully!'),
-                "details": response_payload.get('details', {})
-            }), 200
-        else:
-            return jsonify({
-                "status": "error",
-                "message": response_payload.get('message', 'Failed to create project.')
-            }), 500
-    except Exception as e:
-        return jsonify({"status": "error", "message": f"Failed to invoke Lambda: {str(e)}"}), 500
+    data = request.get_json()
+    lambda_payload = project_payload(data)
+    if lambda_payload is None:
+        return jsonify({"status": "error", "message": "Project name is required"}), 400
+    return respond(data, create_project_result, with_idempotency_key(lambda_payload, request.headers))
+
+def project_payload(data):
+    """ The new_project event for a request, or None if it's missing the project name """
+    if not data.get('project_name'):
+        return None
+    lambda_payload = {"project_name": data['project_name']}
+    if data.get('template'):
+        lambda_payload['template'] = data['template']
+    return lambda_payload
+
+def with_idempotency_key(payload, headers):
+    """ Forward the client's Idempotency-Key header so the Lambda can replay or resume a retried request """
+    key = headers.get('Idempotency-Key')
+    return dict(payload, idempotency_key=key) if key else payload
+
+def create_project_result(lambda_payload):
+    status_code, response_payload = invoke_lambda("new_project", lambda_payload)
+    if lambda_succeeded(status_code, response_payload):
+        return {
+            "status": "success",
+            "message": response_payload.get('message', 'Project created successfully!'),
+            "details": response_payload.get('details', {})
+        }, 200
+    else:
+        return {
+            "status": "error",
+            "message": response_payload.get('message', 'Failed to create project.')
+        }, 500
 
 @app.route('/create-user', methods=['POST'])
 def create_gitlab_user():
     """ Create a new user in GitLab with a specific role and repository """
-    try:
-        data = request.get_json()
-        name = data.get('name')
-        email = data.get('email')
-        username = data.get('username')
-        password = data.get('password')
-        if not all([name, email, username, password]):
-            return jsonify({"status": "error", "message": "All fields are required"}), 400
-        lambda_payload = {
-            "name": name,
-            "email": email,
-            "username": username,
-            "password": password
-        }
-        response = lambda_client.invoke(
-            FunctionName="create_user",
-            InvocationType="RequestResponse",
-            Payload=json.dumps(lambda_payload)
-        )
-        response_payload = json.loads(response['Payload'].read().decode('utf-8'))
-        if response['StatusCode'] == 200:
-            return jsonify({
-                "status": "success",
-                "message": response_payload.get('message', 'User created successfully!'),
-                "details": response_payload
-            }), 200
-        else:
-            return jsonify({
-                "status": "error",
-                "message": response_payload.get('message', 'Failed to create user.')
-            }), 500
-    except Exception as e:
-        return jsonify({"status": "error", "message": f"Failed to invoke Lambda: {str(e)}"}), 500
+    data = request.get_json()
+    lambda_payload = user_payload(data)
+    if lambda_payload is None:
+        return jsonify({"status": "error", "message": "All fields are required"}), 400
+    return respond(data, create_user_result, with_idempotency_key(lambda_payload, request.headers))
+
+def user_payload(data):
+    """ The create_user event for a request, or None if any field is missing """
+    lambda_payload = {field: data.get(field) for field in ('name', 'email', 'username', 'password')}
+    return lambda_payload if all(lambda_payload.values()) else None
+
+def create_user_result(lambda_payload):
+    status_code, response_payload = invoke_lambda("create_user", lambda_payload)
+    if lambda_succeeded(status_code, response_payload):
+        return {
+            "status": "success",
+            "message": response_payload.get('message', 'User created successfully!'),
+            "details": response_payload
+        }, 200
+    else:
+        return {
+            "status": "error",
+            "message": response_payload.get('message', 'Failed to create user.')
+        }, 500
+
+@app.route('/metrics', methods=['GET'])
+def lambda_metrics():
+    return jsonify(metrics_result())
+
+def metrics_result():
+    """ How many Lambda invocations coalescing and the response cache saved, and each outbound client's health """
+    return {
+        "lambda": invoke_lambda.metrics(),
+        "outbound": {"api_gateway": api_gateway.stats(), "lambda": lambda_client.stats(), "s3": s3.stats()}
+    }
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """ Status of a job started by a Lambda-backed route in async mode """
+    body, status = job_result(job_id)
+    return jsonify(body), status
+
+def job_result(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return {"status": "error", "message": "Job not found"}, 404
+    return job, 200
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,155 @@
+""" Async serving mode: the website's routes as async Quart handlers, served by Hypercorn.
+
+The event loop only parses requests and writes responses. Every blocking call (boto3, the API
+Gateway client, the coalescing invoker) runs through run_blocking() on a bounded thread pool of
+BLOCKING_WORKERS threads per process, so a slow backend ties up pool threads, not the loop, and
+the number of requests in flight is limited by the server's connection limit instead of threads.
+Clients, caches, the job runner and the *_result helpers are shared with the threaded app in app.py.
+
+    hypercorn asgi:app --bind 0.0.0.0:5000 --workers 4
+"""
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from quart import Quart, jsonify, render_template, request, url_for
+import app as wsgi
+import request_metrics
+
+app = Quart(__name__)
+blocking_executor = ThreadPoolExecutor(max_workers=wsgi.BLOCKING_WORKERS, thread_name_prefix='blocking')
+# Only touched from the event loop thread, so no lock
+blocking_stats = {"in_flight": 0, "peak_in_flight": 0}
+
+@app.before_request
+async def start_metrics():
+    request_metrics.start_request(request.headers)
+
+@app.after_request
+async def finish_metrics(response):
+    return request_metrics.finish_request(request, response)
+
+async def run_blocking(fn, *args):
+    """ Run fn(*args) on the blocking pool, keeping this request's metrics and correlation ID """
+    blocking_stats["in_flight"] += 1
+    blocking_stats["peak_in_flight"] = max(blocking_stats["peak_in_flight"], blocking_stats["in_flight"])
+    try:
+        return await asyncio.get_running_loop().run_in_executor(blocking_executor, request_metrics.propagate(fn), *args)
+    finally:
+        blocking_stats["in_flight"] -= 1
+
+async def respond(data, fn, *args):
+    """ Run fn(*args) -> (body, status) off the loop, or hand it to the job runner and return its job ID """
+    if wsgi.wants_job(data, request.args):
+        job_id = await run_blocking(wsgi.job_runner.submit, request_metrics.propagate(fn), *args)
+        return jsonify({
+            "status": "accepted",
+            "job_id": job_id,
+            "status_url": url_for('job_status', job_id=job_id)
+        }), 202
+    body, status = await run_blocking(wsgi.run_result, fn, *args)
+    return jsonify(body), status
+
+async def stream_topic_results(topics):
+    """ Yield one NDJSON line per topic as each get_info batch invocation completes """
+    size = wsgi.WIKIPEDIA_BATCH_SIZE
+    batches = [topics[i:i + size] for i in range(0, len(topics), size)]
+
+    async def invoke(batch):
+        try:
+            _, response_payload = await run_blocking(wsgi.invoke_lambda, "get_info", {"topics": batch})
+            return response_payload.get('results') or [
+                {"topic": topic, "status": "failed", "error": response_payload.get('body')} for topic in batch
+            ]
+        except Exception as e:
+            return [{"topic": topic, "status": "failed", "error": f"Failed to invoke Lambda: {str(e)}"} for topic in batch]
+
+    for finished in asyncio.as_completed([invoke(batch) for batch in batches]):
+        for result in await finished:
+            yield json.dumps(result) + "\n"
+    yield json.dumps({
+        "status": "done",
+        "download_url": f"https://{wsgi.BUCKET_NAME}.s3.eu-central-1.amazonaws.com/wikipedia.txt"
+    }) + "\n"
+
+@app.route('/')
+async def index():
+    return await render_template('index.html')
+
+@app.route('/send-message', methods=['POST'])
+async def send_message():
+    form = await request.form
+    contacts = form.getlist('contacts')
+    message = form['message']
+    if not contacts or not message:
+        return jsonify({"error": "Contacts or message not provided"}), 400
+    body, status = await run_blocking(wsgi.send_message_result, contacts, message)
+    return jsonify(body), status
+
+async def upload(field, prefix):
+    file, error = wsgi.uploaded_file(await request.files, field)
+    body, status = error or await run_blocking(wsgi.store_upload, file, f"{prefix}{file.filename}")
+    return jsonify(body), status
+
+@app.route('/upload-csv', methods=['POST'])
+async def upload_csv():
+    return await upload('csv-file', wsgi.CSV_PREFIX)
+
+@app.route('/upload-backup', methods=['POST'])
+async def upload_backup():
+    return await upload('backup-file', wsgi.BACKUP_PREFIX)
+
+@app.route('/wikipedia', methods=['POST'])
+async def fetch_wikipedia_summary():
+    data = await request.get_json()
+    topics = wsgi.parse_topics(data)
+    if not topics:
+        return jsonify({"status": "error", "message": "Topic is required"}), 400
+    if 'topics' in data:
+        return stream_topic_results(topics), 200, {'Content-Type': 'application/x-ndjson'}
+    return await respond(data, wsgi.wikipedia_summary_result, topics[0])
+
+@app.route('/uploads/initiate', methods=['POST'])
+async def initiate_direct_upload():
+    body, status = await run_blocking(wsgi.initiate_upload_result, await request.get_json())
+    return jsonify(body), status
+
+@app.route('/uploads/parts', methods=['POST'])
+async def resume_direct_upload():
+    body, status = await run_blocking(wsgi.resume_upload_result, await request.get_json())
+    return jsonify(body), status
+
+@app.route('/uploads/complete', methods=['POST'])
+async def complete_direct_upload():
+    body, status = await run_blocking(wsgi.complete_upload_result, await request.get_json())
+    return jsonify(body), status
+
+@app.route('/uploads/abort', methods=['POST'])
+async def abort_direct_upload():
+    body, status = await run_blocking(wsgi.abort_upload_result, await request.get_json())
+    return jsonify(body), status
+
+@app.route('/create-project', methods=['POST'])
+async def create_gitlab_project():
+    data = await request.get_json()
+    lambda_payload = wsgi.project_payload(data)
+    if lambda_payload is None:
+        return jsonify({"status": "error", "message": "Project name is required"}), 400
+    return await respond(data, wsgi.create_project_result, wsgi.with_idempotency_key(lambda_payload, request.headers))
+
+@app.route('/create-user', methods=['POST'])
+async def create_gitlab_user():
+    data = await request.get_json()
+    lambda_payload = wsgi.user_payload(data)
+    if lambda_payload is None:
+        return jsonify({"status": "error", "message": "All fields are required"}), 400
+    return await respond(data, wsgi.create_user_result, wsgi.with_idempotency_key(lambda_payload, request.headers))
+
+@app.route('/metrics', methods=['GET'])
+async def lambda_metrics():
+    # in_flight above workers means calls are queueing for a pool thread
+    return jsonify(dict(wsgi.metrics_result(), blocking_pool=dict(blocking_stats, workers=wsgi.BLOCKING_WORKERS)))
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+async def job_status(job_id):
+    body, status = await run_blocking(wsgi.job_result, job_id)
+    return jsonify(body), status
@@ -0,0 +1,268 @@
+""" Outbound calls from the web tier, behind timeouts, bounded retries and circuit breakers.
+
+HttpGateway sends every request for one backend through a shared keep-alive session, with connect
+and read timeouts and full-jitter retries of transient failures. AwsClient wraps a boto3 client
+built with a sized connection pool, timeouts and botocore's own retries. Both stop calling a backend
+that keeps failing: after BREAKER_FAILURES failed calls in a row the breaker opens and calls raise
+CircuitOpenError at once, until a trial call after BREAKER_RESET_SECONDS succeeds. stats() reports
+calls, failures, fast-failed calls, latency percentiles and how many requests reused a connection.
+"""
+import functools
+import os
+import random
+import threading
+import time
+from collections import deque
+import boto3
+import botocore.exceptions
+import requests
+from botocore.config import Config
+from requests.adapters import HTTPAdapter
+import request_metrics
+
+CONNECT_TIMEOUT = float(os.environ.get('GATEWAY_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('GATEWAY_READ_TIMEOUT', 30))
+MAX_RETRIES = int(os.environ.get('GATEWAY_MAX_RETRIES', 2))
+POOL_SIZE = int(os.environ.get('GATEWAY_POOL_SIZE', 16))
+BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', 5))
+BREAKER_RESET_SECONDS = float(os.environ.get('BREAKER_RESET_SECONDS', 30))
+BACKOFF_BASE_SECONDS = 0.2
+BACKOFF_MAX_SECONDS = 2
+RETRY_STATUSES = {429, 502, 503, 504}
+# Safe to send twice; other methods are only retried when the backend can't have acted on them
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+LATENCY_WINDOW = 1000
+
+class CircuitOpenError(Exception):
+    """ Raised instead of calling a backend whose breaker is open """
+
+def backoff_delay(attempt):
+    """ Exponential backoff with full jitter """
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+class CircuitBreaker:
+    """
+    Counts consecutive failed calls; at `failure_threshold` it opens and before_call() raises
+    CircuitOpenError. After `reset_seconds` a single trial call is let through: success closes
+    the breaker, failure opens it for another `reset_seconds`.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.times_opened = 0
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            retry_in = self.opened_at + self.reset_seconds - time.monotonic()
+            if retry_in > 0 or self.trial:
+                raise CircuitOpenError(f"{self.name} is failing; not calling it again for {max(retry_in, 0):.0f}s")
+            self.trial = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    self.times_opened += 1
+                self.opened_at = time.monotonic()
+                self.trial = False
+
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 'closed'
+            return 'half_open' if self.trial else 'open'
+
+    def stats(self):
+        return {"breaker": self.state(), "breaker_opened": self.times_opened}
+
+class CallStats:
+    """ Call outcomes and a window of recent latencies for one backend """
+
+    def __init__(self):
+        self.counts = {"calls": 0, "failures": 0, "rejected": 0, "retries": 0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+
+    def record(self, seconds, failed=False, retries=0):
+        with self.lock:
+            self.counts["calls"] += 1
+            self.counts["failures"] += failed
+            self.counts["retries"] += retries
+            self.latencies.append(seconds * 1000)
+
+    def rejected(self):
+        with self.lock:
+            self.counts["rejected"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.counts)
+            latencies = sorted(self.latencies)
+        if latencies:
+            stats.update(
+                latency_p50_ms=round(latencies[len(latencies) // 2], 1),
+                latency_p95_ms=round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+                latency_avg_ms=round(sum(latencies) / len(latencies), 1)
+            )
+        return stats
+
+def pool_stats(pool_manager):
+    """ Connections opened vs requests sent over a urllib3 PoolManager's pools """
+    opened = sent = 0
+    if pool_manager is not None:
+        for key in list(pool_manager.pools.keys()):
+            pool = pool_manager.pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                sent += pool.num_requests
+    return {"connections_opened": opened, "connections_reused": max(sent - opened, 0)}
+
+class HttpGateway:
+    """ One backend's HTTP calls: pooled keep-alive session, timeouts, jittered retries and a breaker """
+
+    def __init__(self, name, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), max_retries=MAX_RETRIES, pool_size=POOL_SIZE):
+        self.name = name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker(name)
+        self.call_stats = CallStats()
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+    def _retryable(self, method, response=None, error=None):
+        if error is not None:
+            # A connect timeout never reached the backend; anything later might have
+            if isinstance(error, requests.exceptions.ConnectTimeout):
+                return True
+            return method in IDEMPOTENT_METHODS and isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+        # 429 means the request was turned away before running
+        return response.status_code == 429 or (method in IDEMPOTENT_METHODS and response.status_code in RETRY_STATUSES)
+
+    def request(self, method, url, **kwargs):
+        """ Like Session.request; raises CircuitOpenError without calling while the backend is down """
+        method = method.upper()
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self.call_stats.rejected()
+            raise
+        started = time.perf_counter()
+        attempt = 0
+        with request_metrics.stage(self.name):
+            while True:
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except requests.exceptions.RequestException as e:
+                    if attempt < self.max_retries and self._retryable(method, error=e):
+                        time.sleep(backoff_delay(attempt))
+                        attempt += 1
+                        continue
+                    self.breaker.record_failure()
+                    self.call_stats.record(time.perf_counter() - started, failed=True, retries=attempt)
+                    raise
+                if attempt < self.max_retries and self._retryable(method, response=response):
+                    response.close()
+                    time.sleep(backoff_delay(attempt))
+                    attempt += 1
+                    continue
+                break
+        failed = response.status_code >= 500 or response.status_code == 429
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        self.call_stats.record(time.perf_counter() - started, failed=failed, retries=attempt)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        return dict(self.call_stats.snapshot(), **pool_stats(self.adapter.poolmanager), **self.breaker.stats())
+
+def is_backend_failure(error):
+    """ Errors that say the AWS service is unreachable or failing, as opposed to a bad request """
+    if isinstance(error, (botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError)):
+        return True
+    if isinstance(error, botocore.exceptions.ClientError):
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return status >= 500 or status == 429
+    return False
+
+class AwsClient:
+    """ A boto3 client whose API calls are timed and go through a breaker; everything else passes through """
+
+    # Built locally without a request, or return objects that make their own calls
+    LOCAL_METHODS = {'generate_presigned_url', 'generate_presigned_post', 'get_paginator', 'get_waiter', 'can_paginate', 'close'}
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self.breaker = CircuitBreaker(name)
+        self.call_stats = CallStats()
+
+    def __getattr__(self, attribute):
+        value = getattr(self.client, attribute)
+        if attribute.startswith('_') or attribute in self.LOCAL_METHODS or not callable(value):
+            return value
+
+        @functools.wraps(value)
+        def call(*args, **kwargs):
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self.call_stats.rejected()
+                raise
+            started = time.perf_counter()
+            try:
+                result = value(*args, **kwargs)
+            except Exception as e:
+                failed = is_backend_failure(e)
+                if failed:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                self.call_stats.record(time.perf_counter() - started, failed=failed)
+                raise
+            self.breaker.record_success()
+            # botocore retries inside the call and reports how many times in the response
+            retries = result.get('ResponseMetadata', {}).get('RetryAttempts', 0) if isinstance(result, dict) else 0
+            self.call_stats.record(time.perf_counter() - started, retries=retries)
+            return result
+        return call
+
+    def stats(self):
+        http_session = getattr(getattr(self.client, '_endpoint', None), 'http_session', None)
+        return dict(self.call_stats.snapshot(), **pool_stats(getattr(http_session, '_manager', None)), **self.breaker.stats())
+
+def aws_client(service, pool_size=POOL_SIZE, read_timeout=60, max_attempts=3):
+    """ boto3 client with a pool sized for the web tier's concurrency, keep-alive, timeouts and standard retries """
+    config = Config(
+        max_pool_connections=pool_size,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=read_timeout,
+        tcp_keepalive=True,
+        retries={'total_max_attempts': max_attempts, 'mode': 'standard'}
+    )
+    return AwsClient(service, boto3.client(service, config=config))
@@ -0,0 +1,180 @@
+""" Run the handlers in lambda-functions/ in a local warm process pool instead of AWS Lambda.
+
+LocalLambdaClient has the boto3 Lambda client's invoke(), so the website uses it in place of the
+real client (LAMBDA_INVOKER=local) and everything above it, coalescing, the circuit breaker and
+metrics, is unchanged. Each worker process is laid out like a deployed zip (function directories
+plus shared/), imports the handlers once and keeps startup.py's clients between invocations, so a
+call costs one inter-process round trip instead of an HTTPS request and a possible cold start.
+
+Semantics follow Lambda: the payload is JSON in and JSON out, a handler exception or a timeout
+comes back as StatusCode 200 with FunctionError 'Unhandled' and an errorMessage payload, an
+unknown function or invalid JSON raises ClientError, and InvocationType 'Event' returns 202 at once.
+A worker runs one invocation at a time, like a Lambda container. A timed-out invocation keeps its
+worker busy until the handler returns, since a pool worker can't be stopped on its own.
+The pool starts on the first invoke(), not when the client is built: spawned workers re-import the
+main module, and one that builds a client at import (app.py run as a script) must not start pools there.
+"""
+import io
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from botocore.exceptions import ClientError
+
+LAMBDA_DIR = os.environ.get(
+    'LAMBDA_FUNCTIONS_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda-functions')
+)
+# The handlers mostly wait on S3, GitLab and HTTP, so size for concurrent invocations, not CPUs
+LOCAL_WORKERS = int(os.environ.get('LOCAL_LAMBDA_WORKERS', 8))
+LOCAL_TIMEOUT_SECONDS = float(os.environ.get('LOCAL_LAMBDA_TIMEOUT', 900))
+
+def discover_functions(lambda_dir):
+    """ Function names under lambda_dir: every <name>/<name>.py """
+    return sorted(
+        name for name in os.listdir(lambda_dir)
+        if name != 'shared' and os.path.isfile(os.path.join(lambda_dir, name, f"{name}.py"))
+    )
+
+def lambda_error(error_type, message, stack=None):
+    return {"errorMessage": message, "errorType": error_type, "stackTrace": stack or []}
+
+class LocalContext:
+    """ The parts of the Lambda context object the handlers use """
+
+    def __init__(self, function_name, request_id, timeout_seconds):
+        self.function_name = function_name
+        self.function_version = '$LATEST'
+        self.aws_request_id = request_id
+        self.invoked_function_arn = f"arn:aws:lambda:local:000000000000:function:{function_name}"
+        self.memory_limit_in_mb = 0
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(int((self._deadline - time.monotonic()) * 1000), 0)
+
+# --- inside a worker process ---
+
+def _init_worker(lambda_dir, function_names, worker_setup):
+    sys.path[:0] = [os.path.join(lambda_dir, name) for name in function_names] + [os.path.join(lambda_dir, 'shared')]
+    # Pay the imports here, once per worker, rather than in the first invocation of each function
+    for name in function_names:
+        try:
+            __import__(name)
+        except Exception as e:
+            print(f"Local Lambda worker could not preload {name}: {e}")
+    if worker_setup is not None:
+        worker_setup()
+
+def _run_handler(function_name, payload, request_id, timeout_seconds):
+    """ Returns (response payload bytes, function error or None), like the Lambda runtime would """
+    try:
+        event = json.loads(payload) if payload else {}
+        handler = sys.modules.get(function_name) or __import__(function_name)
+        result = handler.lambda_handler(event, LocalContext(function_name, request_id, timeout_seconds))
+    except Exception as e:
+        error = lambda_error(type(e).__name__, str(e), traceback.format_tb(e.__traceback__))
+        return json.dumps(error).encode('utf-8'), 'Unhandled'
+    try:
+        return json.dumps(result).encode('utf-8'), None
+    except (TypeError, ValueError) as e:
+        return json.dumps(lambda_error('Runtime.MarshalError', f"Unable to marshal response: {e}")).encode('utf-8'), 'Unhandled'
+
+# --- in the website ---
+
+class LocalLambdaClient:
+    """ boto3 Lambda client stand-in whose invoke() runs the handler in a warm local worker """
+
+    def __init__(self, lambda_dir=LAMBDA_DIR, max_workers=LOCAL_WORKERS, timeout_seconds=LOCAL_TIMEOUT_SECONDS, worker_setup=None):
+        self.lambda_dir = lambda_dir
+        self.max_workers = max_workers
+        self.timeout_seconds = timeout_seconds
+        self.worker_setup = worker_setup
+        self.functions = discover_functions(lambda_dir)
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def _start_pool(self):
+        # spawn, not fork: the website process has threads and open connections a fork would copy mid-use
+        pool = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.lambda_dir, self.functions, self.worker_setup)
+        )
+        # Workers start on demand; queue no-op tasks so all of them start and preload now, not on first use
+        for _ in range(self.max_workers):
+            pool.submit(int)
+        return pool
+
+    def _get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = self._start_pool()
+            return self.pool
+
+    def _restart_pool(self, broken):
+        with self.lock:
+            if self.pool is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self.pool = self._start_pool()
+
+    @staticmethod
+    def _response(status_code, request_id, body=b'', function_error=None):
+        response = {
+            "StatusCode": status_code,
+            "ExecutedVersion": "$LATEST",
+            "Payload": io.BytesIO(body),
+            "ResponseMetadata": {"RequestId": request_id, "HTTPStatusCode": status_code, "RetryAttempts": 0}
+        }
+        if function_error:
+            response["FunctionError"] = function_error
+        return response
+
+    def invoke(self, FunctionName, InvocationType='RequestResponse', Payload=b'', **_):
+        function_name = FunctionName.rsplit(':', 1)[-1]
+        if function_name not in self.functions:
+            raise ClientError({
+                'Error': {'Code': 'ResourceNotFoundException', 'Message': f"Function not found: {FunctionName}"},
+                'ResponseMetadata': {'HTTPStatusCode': 404}
+            }, 'Invoke')
+        payload = Payload.read() if hasattr(Payload, 'read') else Payload
+        payload = payload.encode('utf-8') if isinstance(payload, str) else payload
+        try:
+            json.loads(payload or b'{}')
+        except ValueError:
+            raise ClientError({
+                'Error': {'Code': 'InvalidRequestContentException', 'Message': 'Could not parse request body into json'},
+                'ResponseMetadata': {'HTTPStatusCode': 400}
+            }, 'Invoke')
+        request_id = str(uuid.uuid4())
+        if InvocationType == 'DryRun':
+            return self._response(204, request_id)
+
+        pool = self._get_pool()
+        try:
+            future = pool.submit(_run_handler, function_name, payload, request_id, self.timeout_seconds)
+            if InvocationType == 'Event':
+                return self._response(202, request_id)
+            body, function_error = future.result(timeout=self.timeout_seconds)
+        except FutureTimeoutError:
+            message = f"Task timed out after {self.timeout_seconds:.2f} seconds"
+            return self._response(200, request_id, json.dumps(lambda_error('Sandbox.Timedout', message)).encode('utf-8'), 'Unhandled')
+        except BrokenProcessPool:
+            # A worker died (crash, out of memory); start a fresh pool for the next call
+            self._restart_pool(pool)
+            error = lambda_error('Runtime.ExitError', 'The local worker exited before returning a response')
+            return self._response(200, request_id, json.dumps(error).encode('utf-8'), 'Unhandled')
+        return self._response(200, request_id, body, function_error)
+
+    def close(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
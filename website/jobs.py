@@ -0,0 +1,74 @@
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+class MemoryJobStore:
+    """ Jobs kept in this process; enough for a single web worker """
+
+    def __init__(self, ttl_seconds=3600):
+        self.ttl_seconds = ttl_seconds
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def put(self, job):
+        with self.lock:
+            self.jobs[job["id"]] = dict(job)
+            cutoff = time.time() - self.ttl_seconds
+            for job_id in [k for k, v in self.jobs.items() if v["updated_at"] < cutoff]:
+                del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+class S3JobStore:
+    """ Jobs as JSON objects in S3, visible to every web worker and container """
+
+    def __init__(self, s3, bucket_name, prefix='jobs/'):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def put(self, job):
+        self.s3.put_object(
+            Bucket=self.bucket_name,
+            Key=f"{self.prefix}{job['id']}.json",
+            Body=json.dumps(job),
+            ContentType='application/json'
+        )
+
+    def get(self, job_id):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket_name, Key=f"{self.prefix}{job_id}.json")
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(response['Body'].read().decode('utf-8'))
+
+class JobRunner:
+    """ Runs route work on a bounded executor and records its progress in a job store """
+
+    def __init__(self, store, max_workers=8):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, fn, *args):
+        """ Queue fn(*args), which returns (body, http_status), and return the new job's ID """
+        job = {"id": uuid.uuid4().hex, "status": "queued", "created_at": time.time(), "updated_at": time.time()}
+        self.store.put(job)
+        self.executor.submit(self._run, job, fn, args)
+        return job["id"]
+
+    def _run(self, job, fn, args):
+        self._update(job, status="running")
+        try:
+            body, http_status = fn(*args)
+            self._update(job, status="succeeded" if http_status < 400 else "failed", http_status=http_status, result=body)
+        except Exception as e:
+            self._update(job, status="failed", http_status=500, result={"status": "error", "message": str(e)})
+
+    def _update(self, job, **fields):
+        job.update(fields, updated_at=time.time())
+        self.store.put(job)
@@ -0,0 +1,117 @@
+""" Per-request timings and counters for the Flask routes, emitted as one CloudWatch Embedded Metric Format line.
+
+init_app(app) starts a record for every request and gives it a correlation ID: the caller's
+X-Correlation-Id header, or a new one. The ID is echoed in the response header and passed on to
+every Lambda the request invokes, so the route's line and the Lambdas' lines can be joined on it.
+The record lives in a ContextVar; work handed to an executor keeps it by going through propagate().
+The ASGI app (asgi.py) calls start_request() and finish_request() from its own async hooks.
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from flask import request
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'AutomationWebsite')
+ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+CORRELATION_HEADER = 'X-Correlation-Id'
+
+_record = contextvars.ContextVar('request_metrics', default=None)
+
+def _unit(name):
+    if name.endswith('_ms'):
+        return 'Milliseconds'
+    if name.startswith('bytes'):
+        return 'Bytes'
+    return 'Count'
+
+def correlation_id():
+    """ The current request's correlation ID, or None outside a request """
+    record = _record.get()
+    return record['correlation_id'] if record else None
+
+class _Stage:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        add(f"{self.name}_ms", (time.perf_counter() - self.started) * 1000)
+        return False
+
+def stage(name):
+    """ Context manager adding the block's duration to `<name>_ms` """
+    return _Stage(name)
+
+def add(name, value=1):
+    """ Add to a counter of the current request; no-op outside one or once its line is out """
+    record = _record.get()
+    if record is None:
+        return
+    with record['lock']:
+        if not record['emitted']:
+            record['values'][name] = record['values'].get(name, 0) + value
+
+def propagate(fn):
+    """ fn bound to the caller's context, so an executor thread running it adds to the same request """
+    context = contextvars.copy_context()
+    return functools.partial(context.run, fn)
+
+def emit(route, record, properties):
+    with record['lock']:
+        record['emitted'] = True
+        values = {name: round(value, 3) if isinstance(value, float) else value for name, value in record['values'].items()}
+    line = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": NAMESPACE,
+                "Dimensions": [["Route"]],
+                "Metrics": [{"Name": name, "Unit": _unit(name)} for name in values]
+            }]
+        },
+        "Route": route,
+        "correlation_id": record['correlation_id'],
+        **properties,
+        **values
+    }
+    print(json.dumps(line, default=str), flush=True)
+
+def start_request(headers):
+    if ENABLED:
+        _record.set({
+            "correlation_id": headers.get(CORRELATION_HEADER) or uuid.uuid4().hex,
+            "started": time.perf_counter(),
+            "values": {},
+            "lock": threading.Lock(),
+            "emitted": False
+        })
+
+def finish_request(current_request, response):
+    """ Tag the response with the correlation ID and emit the request's line """
+    record = _record.get()
+    if record is None:
+        return response
+    response.headers[CORRELATION_HEADER] = record['correlation_id']
+    add('duration_ms', (time.perf_counter() - record['started']) * 1000)
+    if response.content_length:
+        add('bytes_sent', response.content_length)
+    # A streamed body is still being produced; its line covers the time to the first byte
+    url_rule = current_request.url_rule
+    emit(url_rule.rule if url_rule else current_request.path, record, {
+        "method": current_request.method,
+        "status": response.status_code,
+        "streamed": getattr(response, 'is_streamed', False)
+    })
+    return response
+
+def init_app(app):
+    """ Time every request of a Flask app and emit its metrics line once the response is ready """
+    app.before_request(lambda: start_request(request.headers))
+    app.after_request(lambda response: finish_request(request, response))
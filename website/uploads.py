@@ -0,0 +1,67 @@
+import math
+import os
+
+# Browser uploads go straight to S3 through presigned multipart URLs; the web tier only signs and completes
+MIN_PART_SIZE = 5 * 1024 ** 2  # S3 minimum for every part but the last
+MAX_PARTS = 10000
+PART_SIZE = max(int(os.environ.get('UPLOAD_PART_SIZE', 16 * 1024 ** 2)), MIN_PART_SIZE)
+URL_EXPIRES_SECONDS = int(os.environ.get('UPLOAD_URL_EXPIRES', 3600))
+
+def part_size_for(size):
+    """ Smallest configured part size that still fits the file in S3's 10,000 parts """
+    return max(PART_SIZE, math.ceil(size / MAX_PARTS))
+
+def presign_parts(s3, bucket_name, key, upload_id, part_numbers):
+    return [
+        {
+            "part_number": number,
+            "url": s3.generate_presigned_url(
+                'upload_part',
+                Params={'Bucket': bucket_name, 'Key': key, 'UploadId': upload_id, 'PartNumber': number},
+                ExpiresIn=URL_EXPIRES_SECONDS
+            )
+        }
+        for number in part_numbers
+    ]
+
+def initiate_upload(s3, bucket_name, key, size, content_type=None, metadata=None):
+    """ Start a multipart upload and presign a PUT URL for every part """
+    params = {'Bucket': bucket_name, 'Key': key}
+    if content_type:
+        params['ContentType'] = content_type
+    if metadata:
+        params['Metadata'] = metadata
+    upload_id = s3.create_multipart_upload(**params)['UploadId']
+    part_size = part_size_for(size)
+    part_count = max(1, math.ceil(size / part_size))
+    return {
+        "key": key,
+        "upload_id": upload_id,
+        "part_size": part_size,
+        "parts": presign_parts(s3, bucket_name, key, upload_id, range(1, part_count + 1))
+    }
+
+def uploaded_parts(s3, bucket_name, key, upload_id):
+    """ Parts S3 already holds for an upload, so an interrupted browser can resume """
+    paginator = s3.get_paginator('list_parts')
+    parts = []
+    for page in paginator.paginate(Bucket=bucket_name, Key=key, UploadId=upload_id):
+        parts.extend(
+            {"part_number": part['PartNumber'], "etag": part['ETag'], "size": part['Size']}
+            for part in page.get('Parts', [])
+        )
+    return parts
+
+def complete_upload(s3, bucket_name, key, upload_id, parts):
+    s3.complete_multipart_upload(
+        Bucket=bucket_name,
+        Key=key,
+        UploadId=upload_id,
+        MultipartUpload={'Parts': sorted(
+            ({'PartNumber': int(part['part_number']), 'ETag': part['etag']} for part in parts),
+            key=lambda part: part['PartNumber']
+        )}
+    )
+
+def abort_upload(s3, bucket_name, key, upload_id):
+    s3.abort_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id)